@@ -1,17 +1,105 @@
 from __future__ import absolute_import
 import os
 from celery import Celery
+from celery.signals import celeryd_init
+from kombu import Exchange, Queue
 from django.conf import settings
 from celery.schedules import crontab
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'RetailApp.settings')
-app = Celery('retail_app', broker= 'redis://127.0.0.1:6379/1')
+app = Celery('retail_app', broker= 'redis://127.0.0.1:6379/1', backend='redis://127.0.0.1:6379/2')
 
 # Using a string here means the worker will not have to
 # pickle the object when using Windows.
 app.config_from_object('django.conf:settings')
 
+# Task queues, so that the latency sensitive tasks never wait behind long running ones:
+# - interactive: short tasks that keep the data of the live apis fresh
+# - warming: cache warming, may lag a few minutes behind
+# - batch: report exports, rollups and other long running jobs, the default for tasks without a route
+app.conf.task_queues = (
+	Queue('interactive', Exchange('interactive'), routing_key='interactive'),
+	Queue('warming', Exchange('warming'), routing_key='warming'),
+	Queue('batch', Exchange('batch'), routing_key='batch'),
+)
+app.conf.task_default_queue = 'batch'
+
+# With Redis 0 is the highest priority. A worker that consumes several queues (-Q interactive,warming,batch) always
+# empties them in that order, and within a queue higher priority tasks go first.
+app.conf.task_routes = {
+	'transaction_system.tasks.cache_sales_data_for_current_data': {'queue': 'interactive', 'priority': 0},
+	'transaction_system.tasks.warm_*': {'queue': 'warming', 'priority': 5},
+	'transaction_system.tasks.cache_warming_finished': {'queue': 'warming', 'priority': 5},
+	'transaction_system.tasks.forecast_stock': {'queue': 'warming', 'priority': 5},
+}
+app.conf.task_default_priority = 9
+app.conf.broker_transport_options = {
+	'priority_steps': list(range(10)),
+	'sep': ':',
+	'queue_order_strategy': 'priority',
+	# Unacknowledged tasks are redelivered after this many seconds, it has to be longer than the slowest batch task.
+	'visibility_timeout': 6 * 60 * 60,
+}
+
+# Acknowledge tasks after they ran, so a task of a worker that crashed or was killed for its memory use is run again.
+# All tasks must therefore be idempotent.
+app.conf.task_acks_late = True
+app.conf.task_reject_on_worker_lost = True
+
+# Worker presets, start a worker with CELERY_WORKER_PROFILE=<profile> celery -A RetailApp worker
+# - interactive: one task at a time per process so a short task is never queued behind a prefetched one
+# - warming: cheap queries, more prefetching
+# - batch: few processes, which are replaced once they hold on to too much memory (KiB) after pandas jobs
+WORKER_PROFILES = {
+	'interactive': {
+		'queues': ['interactive'],
+		'worker_pool': 'prefork',
+		'worker_concurrency': 4,
+		'worker_prefetch_multiplier': 1,
+		'worker_max_memory_per_child': 200 * 1024,
+	},
+	'warming': {
+		'queues': ['warming'],
+		'worker_pool': 'prefork',
+		'worker_concurrency': 4,
+		'worker_prefetch_multiplier': 4,
+		'worker_max_memory_per_child': 400 * 1024,
+	},
+	'batch': {
+		'queues': ['batch'],
+		'worker_pool': 'prefork',
+		'worker_concurrency': 2,
+		'worker_prefetch_multiplier': 1,
+		'worker_max_memory_per_child': 1024 * 1024,
+		'worker_max_tasks_per_child': 50,
+	},
+	# Small deployments: a single worker for every queue, interactive tasks first.
+	'all': {
+		'queues': ['interactive', 'warming', 'batch'],
+		'worker_pool': 'prefork',
+		'worker_concurrency': 4,
+		'worker_prefetch_multiplier': 1,
+		'worker_max_memory_per_child': 1024 * 1024,
+	},
+}
+
+WORKER_PROFILE = os.getenv('CELERY_WORKER_PROFILE')
+if WORKER_PROFILE:
+	# Applied at import time, the worker command line reads its defaults from the configuration.
+	app.conf.update({
+		key: value for key, value in WORKER_PROFILES[WORKER_PROFILE].items() if key != 'queues'
+	})
+
+
+@celeryd_init.connect
+def select_profile_queues(instance=None, **kwargs):
+	"""
+	Consume the queues of the worker profile, unless queues are given with -Q.
+	"""
+	if WORKER_PROFILE:
+		instance.app.amqp.queues.select(WORKER_PROFILES[WORKER_PROFILE]['queues'])
+
 # disable UTC so that Celery can use local time
 
 # Load task modules from all registered Django app configs.
@@ -24,5 +112,29 @@ app.conf.beat_schedule = {
 	'tokenApiCall': {
 		'task': 'transaction_system.tasks.cache_sales_data_for_current_data',
 		'schedule': crontab(minute='*/5')
+	},
+
+	# Prewarms the analytics caches more often than they expire (1 hour).
+	'warmSalesCaches': {
+		'task': 'transaction_system.tasks.warm_sales_caches',
+		'schedule': crontab(minute='*/30')
+	},
+
+	# Corrects the drift of yesterday's top-sellers leaderboards.
+	'reconcileLeaderboards': {
+		'task': 'transaction_system.tasks.reconcile_leaderboards',
+		'schedule': crontab(hour=0, minute=15)
+	},
+
+	# End of day stock of every item for the stock-history api, as soon as the day is closed.
+	'snapshotInventory': {
+		'task': 'transaction_system.tasks.snapshot_inventory_levels',
+		'schedule': crontab(hour=0, minute=5)
+	},
+
+	# Days of stock remaining and reorder suggestions for the stock-forecast api.
+	'forecastStock': {
+		'task': 'transaction_system.tasks.forecast_stock',
+		'schedule': crontab(minute='*/15')
 	}
 }
@@ -0,0 +1,228 @@
+"""
+PostgreSQL backend that borrows connections from a per-process pool instead of opening a new one per request.
+
+Configured with DATABASES[alias]['OPTIONS']['pool']:
+- max_size: maximum number of open connections of the process
+- timeout: seconds to wait for a free connection before failing with OperationalError
+- health_check_interval: connections idle for longer than this are checked with `SELECT 1` before reuse
+- max_lifetime: seconds after which a connection is closed instead of returned to the pool
+
+Django "closes" the connection at the end of every request (CONN_MAX_AGE = 0), which hands it back to the pool.
+"""
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from django.db.backends.postgresql import base, creation
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+from transaction_system.instrumentation import get_request_timings
+from transaction_system.metrics import DB_POOL_CONNECTIONS, DB_POOL_WAIT, DB_POOL_TIMEOUTS
+
+
+class ConnectionPool:
+
+    def __init__(self, alias, conn_params, max_size=10, timeout=5.0, health_check_interval=30, max_lifetime=1800):
+        self.alias = alias
+        self.conn_params = conn_params
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.max_lifetime = max_lifetime
+        self._idle = []  # (connection, returned at), the most recently used connection is reused first
+        self._opened_at = {}  # id(connection) -> time the connection was opened
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self.in_use = 0
+        self.acquired = 0
+        self.opened = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+
+    def getconn(self):
+        """
+        Borrow a connection, returns the connection and the seconds spent waiting for it.
+        """
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            self.timeouts += 1
+            DB_POOL_TIMEOUTS.labels(alias=self.alias).inc()
+            raise psycopg2.OperationalError(
+                f'Timed out after {self.timeout}s waiting for a connection from the "{self.alias}" pool '
+                f'(max_size={self.max_size}).'
+            )
+        waited = time.monotonic() - started
+        try:
+            connection = self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.in_use += 1
+            self.acquired += 1
+            self.wait_time += waited
+        DB_POOL_WAIT.labels(alias=self.alias).observe(waited)
+        self._update_gauges()
+        return connection, waited
+
+    def putconn(self, connection):
+        """
+        Return a borrowed connection. Broken, busy or expired connections are closed instead.
+        """
+        try:
+            opened_at = self._opened_at.get(id(connection), 0)
+            reusable = not connection.closed and time.monotonic() - opened_at < self.max_lifetime
+            if reusable:
+                status = connection.info.transaction_status
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    reusable = False
+                elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        connection.rollback()
+                    except psycopg2.Error:
+                        reusable = False
+            if reusable:
+                with self._lock:
+                    self._idle.append((connection, time.monotonic()))
+            else:
+                self._discard(connection)
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            self._slots.release()
+            self._update_gauges()
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                connection, returned_at = self._idle.pop() if self._idle else (None, None)
+            if connection is None:
+                return self._connect()
+            now = time.monotonic()
+            if connection.closed or now - self._opened_at.get(id(connection), 0) >= self.max_lifetime:
+                self._discard(connection)
+            elif now - returned_at > self.health_check_interval and not self._is_healthy(connection):
+                self._discard(connection)
+            else:
+                return connection
+
+    def _connect(self):
+        connection = psycopg2.connect(**self.conn_params)
+        with self._lock:
+            self._opened_at[id(connection)] = time.monotonic()
+            self.opened += 1
+        return connection
+
+    def _is_healthy(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, connection):
+        with self._lock:
+            self._opened_at.pop(id(connection), None)
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def close_idle(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._discard(connection)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        DB_POOL_CONNECTIONS.labels(alias=self.alias, state='in_use').set(self.in_use)
+        DB_POOL_CONNECTIONS.labels(alias=self.alias, state='idle').set(len(self._idle))
+
+    def stats(self):
+        return {
+            'max_size': self.max_size,
+            'in_use': self.in_use,
+            'idle': len(self._idle),
+            'acquired': self.acquired,
+            'opened': self.opened,
+            'timeouts': self.timeouts,
+            'avg_wait_ms': round(self.wait_time / self.acquired * 1000, 3) if self.acquired else 0.0,
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, conn_params, options):
+    # Pools are per process, a forked worker must not share the sockets of its parent. The database name is
+    # part of the key because the test runner switches an alias over to the test database.
+    key = (alias, os.getpid(), conn_params.get('dbname'), conn_params.get('host'), conn_params.get('port'),
+           conn_params.get('user'))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = ConnectionPool(alias, conn_params, **options)
+        return _pools[key]
+
+
+def close_pools(dbname=None):
+    """
+    Close the idle connections of the pools of this process, only those to `dbname` when given.
+    """
+    for key, pool in list(_pools.items()):
+        if dbname is None or key[2] == dbname:
+            pool.close_idle()
+
+
+def pool_stats():
+    """
+    Utilization of the connection pools of the current process, by database alias.
+    """
+    pid = os.getpid()
+    return {key[0]: pool.stats() for key, pool in list(_pools.items()) if key[1] == pid}
+
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep the test database open and make DROP DATABASE fail.
+        close_pools(test_database_name)
+        super()._destroy_test_db(test_database_name, verbosity)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    creation_class = DatabaseCreation
+
+    def get_connection_params(self):
+        conn_params = super().get_connection_params()
+        conn_params.pop('pool', None)
+        return conn_params
+
+    def get_new_connection(self, conn_params):
+        options = self.settings_dict['OPTIONS']
+        self.isolation_level = IsolationLevel(options.get('isolation_level', IsolationLevel.READ_COMMITTED))
+        self.pool = get_pool(self.alias, conn_params, options.get('pool', {}))
+
+        connection, waited = self.pool.getconn()
+        timings = get_request_timings()
+        if timings is not None:
+            timings.add_stage('db-pool', waited)
+
+        if 'isolation_level' in options:
+            connection.isolation_level = self.isolation_level
+        # Same as the postgresql backend: skip psycopg2's json decoding of jsonb values.
+        psycopg2.extras.register_default_jsonb(conn_or_curs=connection, loads=lambda x: x)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.pool.putconn(self.connection)
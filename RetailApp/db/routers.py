@@ -0,0 +1,87 @@
+"""
+Read replica support.
+
+Writes, and every read that does not ask for a replica, go to the primary ('default') database. The analytics
+functions in transaction_system.utils pick their database with `analytics_db`, which spreads them over
+DATABASE_REPLICAS and keeps queries that include today on the primary when the replica lags behind.
+"""
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+from django.utils import timezone
+
+db_logger = logging.getLogger('db')
+
+PRIMARY = 'default'
+
+_replica_lag = {}  # alias -> (checked at, lag in seconds or None)
+
+
+class PrimaryReplicaRouter:
+    """
+    Pins all writes to the primary, objects read from a replica are saved to the primary as well.
+    Replicas get their schema and data through replication, so they are never migrated.
+    """
+
+    def db_for_read(self, model, **hints):
+        return None
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *settings.DATABASE_REPLICAS}
+        return obj1._state.db in databases and obj2._state.db in databases
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+def replica_lag(alias):
+    """
+    Replication lag of a replica in seconds, None when it cannot be determined.
+    The result is cached in the process for REPLICA_LAG_CHECK_INTERVAL seconds.
+    """
+    checked_at, lag = _replica_lag.get(alias, (None, None))
+    if checked_at is not None and time.monotonic() - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL:
+        return lag
+
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        lag = None
+    else:
+        try:
+            with connection.cursor() as cursor:
+                # A database that is not in recovery is a copy, not a streaming standby, and has no lag.
+                cursor.execute(
+                    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+                    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+                )
+                row = cursor.fetchone()
+            lag = None if row[0] is None else float(row[0])
+        except DatabaseError:
+            db_logger.warning('Could not read the replication lag of %s', alias, exc_info=True)
+            lag = None
+    _replica_lag[alias] = (time.monotonic(), lag)
+    return lag
+
+
+def analytics_db(end_date=None):
+    """
+    Database alias for an analytics query over a range ending at `end_date`.
+    Closed days are read from a replica. Ranges that include today only use a replica that is less than
+    REPLICA_MAX_LAG seconds behind, otherwise they fall back to the primary.
+    """
+    if not settings.DATABASE_REPLICAS:
+        return PRIMARY
+    alias = random.choice(settings.DATABASE_REPLICAS)
+    if end_date is None or end_date >= timezone.now().date():
+        lag = replica_lag(alias)
+        if lag is None or lag > settings.REPLICA_MAX_LAG:
+            db_logger.info('Replica %s lags %s seconds behind, reading today from the primary', alias, lag)
+            return PRIMARY
+    return alias
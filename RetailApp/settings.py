@@ -17,6 +17,9 @@ load_dotenv()
 
 IS_TESTING = 'test' in sys.argv
 
+# web (gunicorn / runserver) or celery, selects the database connection pool profile
+PROCESS_TYPE = os.getenv('DJANGO_PROCESS_TYPE') or ('celery' if 'celery' in os.path.basename(sys.argv[0]) else 'web')
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,11 +44,16 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',  # Trigram lookups of the item search
     'rest_framework',
+    'rest_framework.authtoken',
     'transaction_system',
 ]
 
 MIDDLEWARE = [
+    'transaction_system.middleware.MetricsMiddleware',
+    'transaction_system.middleware.ServerTimingMiddleware',
+    'transaction_system.middleware.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +61,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'transaction_system.middleware.AdmissionControlMiddleware',
 ]
 
 ROOT_URLCONF = 'RetailApp.urls'
@@ -88,17 +97,50 @@ if IS_TESTING:
         }
     }
 else:
+    # Connection pool per process type: gunicorn threads share the web pool, a celery worker process runs
+    # one task at a time. See RetailApp/db/postgresql_pool/base.py for the options.
+    DATABASE_POOL_PROFILES = {
+        'web': {'max_size': 10, 'timeout': 5, 'health_check_interval': 30, 'max_lifetime': 30 * 60},
+        'celery': {'max_size': 2, 'timeout': 30, 'health_check_interval': 10, 'max_lifetime': 30 * 60},
+    }
+    DATABASE_POOL = {**DATABASE_POOL_PROFILES[PROCESS_TYPE]}
+    if os.getenv('DATABASE_POOL_MAX_SIZE'):
+        DATABASE_POOL['max_size'] = int(os.getenv('DATABASE_POOL_MAX_SIZE'))
+
     DATABASES = {
         'default': {
-            'ENGINE': 'django.db.backends.postgresql',
+            'ENGINE': 'RetailApp.db.postgresql_pool',
             'NAME': 'retail_store_db',
             'USER': os.getenv('POSTGRES_USERNAME'),
             'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
             'HOST': 'localhost',
             'PORT': '5432',
+            'CONN_MAX_AGE': 0,  # Connections go back to the pool at the end of each request / task
+            'OPTIONS': {
+                'connect_timeout': 5,
+                'pool': DATABASE_POOL,
+            },
         }
     }
 
+# Read replicas for the analytics queries, see RetailApp/db/routers.py. POSTGRES_REPLICA_HOSTS is a comma separated
+# list of host[:port]; when testing, TEST_DATABASE_REPLICA=1 adds a replica that mirrors the test database.
+DATABASE_REPLICAS = []
+if IS_TESTING:
+    _replica_hosts = ['mirror'] if os.getenv('TEST_DATABASE_REPLICA') else []
+else:
+    _replica_hosts = [host.strip() for host in os.getenv('POSTGRES_REPLICA_HOSTS', '').split(',') if host.strip()]
+for _number, _replica_host in enumerate(_replica_hosts, start=1):
+    _host, _, _port = _replica_host.partition(':')
+    _alias = f'replica_{_number}'
+    DATABASES[_alias] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+    if not IS_TESTING:
+        DATABASES[_alias].update({'HOST': _host, 'PORT': _port or DATABASES['default']['PORT']})
+    DATABASE_REPLICAS.append(_alias)
+
+DATABASE_ROUTERS = ['RetailApp.db.routers.PrimaryReplicaRouter']
+REPLICA_MAX_LAG = 5  # Seconds a replica may lag behind before queries that include today go to the primary
+REPLICA_LAG_CHECK_INTERVAL = 5  # Seconds the measured replication lag is reused
 
 CACHES = {
     "default": {
@@ -110,6 +152,56 @@ CACHES = {
     }
 }
 
+# Cache warming, see transaction_system.tasks.warm_sales_caches
+CACHE_WARMING_DAYS = [7, 30, 90]  # Ranges of the last N days that are always prewarmed
+CACHE_WARMING_POPULAR_RANGES = 10  # Most missed ranges of each analytics view that are prewarmed as well
+CACHE_WARMING_MIN_MISSES = 3  # Cache misses in the last week before a range counts as popular
+
+# Longest date range (days) whose market-basket analysis is computed during the request, longer ranges are
+# computed by a celery task
+MARKET_BASKET_SYNC_DAYS = 31
+
+# Admission control, see transaction_system/admission.py. A request of the analytics and report apis waits at most
+# `timeout` seconds for one of `limit` slots of its class per process and of `global_limit` slots of all processes,
+# at most `queue` of them wait, then they get a 429 / 503 with Retry-After. The remaining web threads and database
+# connections (10 per web process) stay reserved for checkout.
+ADMISSION_CONTROL = {
+    'analytics': {'limit': 4, 'queue': 8, 'timeout': 2, 'global_limit': 24, 'retry_after': 5},
+    'reports': {'limit': 1, 'queue': 2, 'timeout': 1, 'global_limit': 4, 'retry_after': 30},
+}
+ADMISSION_LEASE = 5 * 60  # Seconds after which the global slot of a crashed process is freed, renewed while held
+
+# Query cost of the analytics apis, in estimated bill lines of the date range. Larger ranges are computed by a celery
+# task (sales report, trend analysis) and ranges over the maximum are rejected.
+ANALYTICS_SYNC_MAX_BILL_LINES = 2_000_000
+ANALYTICS_MAX_BILL_LINES = 100_000_000
+
+# Sales event stream, see transaction_system/outbox.py
+OUTBOX_BATCH_SIZE = 500  # Events the relay publishes per round trip
+OUTBOX_RELAY_INTERVAL = 1  # Seconds the relay sleeps when it published everything
+OUTBOX_RETENTION = 24 * 60 * 60  # Seconds published events stay in the outbox table
+OUTBOX_STREAM_MAXLEN = 1_000_000  # Events the sales stream keeps for replays (approximately)
+
+# Cold storage of old sales, see transaction_system/archive.py. `python manage.py archive_sales` moves the sales of the
+# months that closed more than SALES_ARCHIVE_AFTER_MONTHS months ago to Parquet files in SALES_ARCHIVE_DIR, a directory
+# every web and celery process can read (a shared volume).
+SALES_ARCHIVE_DIR = os.getenv('SALES_ARCHIVE_DIR', os.path.join(BASE_DIR, 'archive'))
+SALES_ARCHIVE_AFTER_MONTHS = 13
+
+# Stock depletion forecast, see transaction_system/forecasting.py
+STOCK_FORECAST_HISTORY_DAYS = 56  # Days of sales the sales velocity is computed from
+STOCK_FORECAST_HALF_LIFE = 7  # Days after which a day's sales count half in the sales velocity
+STOCK_REORDER_LEAD_DAYS = 7  # Days between ordering and receiving stock
+STOCK_REORDER_COVER_DAYS = 14  # Days of sales a reorder should cover after it arrives
+
+# Live sales stream, see transaction_system/live.py
+LIVE_SALES_HEARTBEAT_INTERVAL = 15  # Seconds without sales before a keep-alive comment is sent
+LIVE_SALES_RESYNC_INTERVAL = 5 * 60  # Seconds between reloads of the running totals from the database
+LIVE_SALES_QUEUE_SIZE = 100  # Events buffered per dashboard before it is sent a fresh snapshot instead
+
+# Item search, see transaction_system/search.py
+ITEM_SEARCH_INDEX_TTL = 60  # Seconds the in-memory trigram index (databases other than PostgreSQL) is reused
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -142,7 +234,8 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',  # Basic Authentication
+        'transaction_system.authentication.CachedTokenAuthentication',  # Token Authentication for the POS clients
+        'transaction_system.authentication.CachedBasicAuthentication',  # Basic Authentication
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',  # Force authentication for all views
@@ -150,3 +243,35 @@ REST_FRAMEWORK = {
 }
 
 AUTH_USER_MODEL = "transaction_system.Users" # Change the default user class by user defined user class
+
+AUTH_CACHE_TIMEOUT = 60 * 5  # Seconds a token lookup is cached
+AUTH_LOCAL_CACHE_TIMEOUT = 10  # Seconds credentials are also cached in the memory of each process
+BASIC_AUTH_CACHE_TIMEOUT = int(os.getenv('BASIC_AUTH_CACHE_TIMEOUT', '30'))  # 0 hashes the password on every request
+
+
+# Instrumentation
+
+# Share of requests (0.0 - 1.0) for which SQL and stage timings are collected and returned in Server-Timing headers
+REQUEST_TIMING_SAMPLE_RATE = float(os.getenv('REQUEST_TIMING_SAMPLE_RATE', '0.05'))
+
+# Share of requests (0.0 - 1.0) that are profiled, admins can also ask for a profile with the X-Profile header
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_INTERVAL = 0.005  # Seconds between two stack samples
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'db': {
+            'handlers': ['console'],
+            'level': os.getenv('DB_LOG_LEVEL', 'WARNING' if IS_TESTING else 'INFO'),
+            'propagate': False,
+        },
+    },
+}
@@ -1,5 +1,66 @@
+import uuid
+
 from django.contrib import admin
+from django.contrib.admin.views.main import SEARCH_VAR
+from django.core.paginator import Paginator
+from django.http import HttpResponseRedirect
+from django.utils import timezone
+from django.utils.functional import cached_property
 from .models import *
+from .utils import estimated_count
+
+# Above this many rows the changelists of the sales tables show PostgreSQL's row estimate instead of a COUNT(*)
+ESTIMATED_COUNT_THRESHOLD = 100000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that counts large results from PostgreSQL's statistics instead of scanning them,
+    small results are still counted exactly.
+    """
+    @cached_property
+    def count(self):
+        estimate = estimated_count(self.object_list)
+        if estimate is None or estimate < ESTIMATED_COUNT_THRESHOLD:
+            return super().count
+        return estimate
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """
+    Changelist of a table with millions of rows: estimated counts, no second count of the unfiltered table,
+    and foreign keys edited as raw ids instead of select boxes with every row of the related table.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def changelist_view(self, request, extra_context=None):
+        """
+        Open the changelist on the current month of the date hierarchy. Unfiltered, the hierarchy lists the years
+        with a DISTINCT over the whole table, drilled down to a month it only reads the days of that month.
+        """
+        if request.method == 'GET' and self.date_hierarchy and SEARCH_VAR not in request.GET \
+                and not any(param.startswith(f'{self.date_hierarchy}__') for param in request.GET):
+            today = timezone.now().date()
+            params = request.GET.copy()
+            params[f'{self.date_hierarchy}__year'] = today.year
+            params[f'{self.date_hierarchy}__month'] = today.month
+            return HttpResponseRedirect(f'{request.path}?{params.urlencode()}')
+        return super().changelist_view(request, extra_context)
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        The search fields of the large tables are UUID keys, a search is an exact lookup of a valid UUID on their index
+        instead of the default icontains over the whole table.
+        """
+        if not search_term:
+            return queryset, False
+        try:
+            value = uuid.UUID(search_term.strip())
+        except ValueError:
+            return queryset.none(), False
+        return queryset.filter(models.Q.create([(field, value) for field in self.get_search_fields(request)],
+                                               connector=models.Q.OR)), False
 
 
 # Register your models here.
@@ -13,14 +74,32 @@ class Users(admin.ModelAdmin):
 @admin.register(Item)
 class Item(admin.ModelAdmin):
     list_display = ('name', 'item_code', 'price', 'category', 'starting_quantity', 'current_quantity')
-    search_fields = ('item_code','category', 'current_quantity')
+    search_fields = ('^item_code', 'name', 'category')
 
 @admin.register(Transaction)
-class Transaction(admin.ModelAdmin):
+class Transaction(LargeTableAdmin):
     list_display = ('transaction_date', 'transaction_id', 'transaction_time', 'total_amount')
-    search_fields = ('transaction_id', 'transaction_date')
+    date_hierarchy = 'transaction_date'
+    ordering = ('-transaction_date', '-transaction_time')  # Read in the order of transaction_date_time_idx
+    search_fields = ('transaction_id',)
 
 @admin.register(BillItem)
-class BillItem(admin.ModelAdmin):
+class BillItem(LargeTableAdmin):
     list_display = ('quantity', 'unit_price', 'transaction', 'item')
-    search_fields = ('transaction',)
\ No newline at end of file
+    list_select_related = ('transaction', 'item')
+    raw_id_fields = ('transaction', 'item')
+    search_fields = ('transaction_id',)
+
+@admin.register(Refund)
+class Refund(LargeTableAdmin):
+    list_display = ('refund_date', 'refund_id', 'transaction', 'total_amount', 'reason')
+    list_select_related = ('transaction',)
+    raw_id_fields = ('transaction',)
+    date_hierarchy = 'refund_date'
+    search_fields = ('refund_id', 'transaction_id')
+
+@admin.register(RefundLine)
+class RefundLine(LargeTableAdmin):
+    list_display = ('quantity', 'unit_price', 'refund', 'item')
+    list_select_related = ('refund', 'item')
+    raw_id_fields = ('refund', 'item')
@@ -0,0 +1,219 @@
+"""
+Admission control of the expensive apis, so that long analytics requests cannot take every web thread and database
+connection away from checkout.
+
+Views declare their admission class with the `admission_class` decorator. A request of a class listed in
+ADMISSION_CONTROL needs one of the `limit` slots of its class in the process and, with a `global_limit`, one of the
+slots shared by all processes in Redis. It waits at most `timeout` seconds for them: when `queue` requests of its class
+are already waiting it is turned away at once with 429, when the wait times out with 503, both with a Retry-After
+header. Views without a class, like checkout, are never queued and keep the rest of the threads and connections.
+
+The cost of an analytics query is estimated from the number of bill lines of its date range before it runs,
+see `estimated_bill_lines`.
+"""
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Min
+from django.http import JsonResponse
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .metrics import ADMISSION_REJECTIONS, ADMISSION_WAIT
+from .models import BillItem, Transaction
+from .utils import estimated_count
+
+db_logger = logging.getLogger('db')
+
+SALES_VOLUME_CACHE_KEY = 'sales_volume'
+SALES_VOLUME_TIMEOUT = 60 * 60
+
+
+def admission_class(name):
+    """
+    Class decorator of the views whose requests are admitted by the `name` class of ADMISSION_CONTROL.
+    """
+    def decorator(view):
+        view.admission_class = name
+        return view
+    return decorator
+
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted, with the status and Retry-After (seconds) of its response.
+    """
+
+    def __init__(self, status, retry_after):
+        super().__init__(status, retry_after)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionClass:
+    """
+    The slots of one admission class in this process, and in Redis when it has a global limit.
+    The lease of a global slot is renewed by a thread while the slot is held.
+    """
+
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.slots = threading.BoundedSemaphore(config['limit'])
+        self.waiting = 0
+        self.lock = threading.Lock()
+        self.leases = {}
+
+    def admit(self):
+        """
+        Take a slot, return the token to release it with.
+        """
+        with self.lock:
+            if self.waiting >= self.config['queue']:
+                raise self.reject(429)
+            self.waiting += 1
+        started = time.monotonic()
+        try:
+            admitted = self.slots.acquire(timeout=self.config['timeout'])
+        finally:
+            with self.lock:
+                self.waiting -= 1
+        if not admitted:
+            raise self.reject(503)
+
+        token = None
+        if self.config.get('global_limit'):
+            token = self._admit_global(started + self.config['timeout'])
+            if token is None:
+                self.slots.release()
+                raise self.reject(503)
+            if token:
+                self._hold(token)
+        ADMISSION_WAIT.labels(admission_class=self.name).observe(time.monotonic() - started)
+        return token
+
+    def release(self, token):
+        if token:
+            with self.lock:
+                released = self.leases.pop(token, None)
+            if released is not None:
+                released.set()
+            try:
+                get_redis_connection('default').zrem(self._key, token)
+            except RedisError:
+                db_logger.warning('Could not release the %s admission slot', self.name, exc_info=True)
+        self.slots.release()
+
+    def reject(self, status):
+        ADMISSION_REJECTIONS.labels(admission_class=self.name, status=status).inc()
+        return Rejected(status, self.config['retry_after'])
+
+    @property
+    def _key(self):
+        return f'admission_{self.name}'
+
+    def _admit_global(self, deadline):
+        """
+        Take one of the `global_limit` slots of all processes: a member of a sorted set scored by the time its lease
+        expires, so that the slots of a process that died are freed after ADMISSION_LEASE seconds.
+        None when no slot became free before the deadline. When Redis is down only the local limit applies.
+        """
+        token = uuid.uuid4().hex
+        try:
+            redis = get_redis_connection('default')
+            while True:
+                now = time.time()
+                with redis.pipeline() as pipe:
+                    pipe.zremrangebyscore(self._key, '-inf', now)
+                    pipe.zadd(self._key, {token: now + settings.ADMISSION_LEASE})
+                    pipe.zcard(self._key)
+                    taken = pipe.execute()[-1]
+                if taken <= self.config['global_limit']:
+                    return token
+                # Concurrent requests over the limit all back off, so the limit is never exceeded
+                redis.zrem(self._key, token)
+                if time.monotonic() >= deadline:
+                    return None
+                time.sleep(min(0.05, max(deadline - time.monotonic(), 0)))
+        except RedisError:
+            db_logger.warning('Could not take a global %s admission slot', self.name, exc_info=True)
+            return ''
+
+    def _hold(self, token):
+        released = threading.Event()
+        with self.lock:
+            self.leases[token] = released
+        threading.Thread(target=self._renew, args=(token, released), name=f'admission-{self.name}',
+                         daemon=True).start()
+
+    def _renew(self, token, released):
+        """
+        Extend the lease of a global slot every third of ADMISSION_LEASE until it is released, so that a request
+        running longer than the lease keeps its slot. A lease that already expired is not taken again.
+        """
+        while not released.wait(settings.ADMISSION_LEASE / 3):
+            try:
+                get_redis_connection('default').zadd(self._key, {token: time.time() + settings.ADMISSION_LEASE},
+                                                     xx=True)
+            except RedisError:
+                db_logger.warning('Could not renew a global %s admission slot', self.name, exc_info=True)
+
+
+_classes = {}
+_classes_lock = threading.Lock()
+
+
+def get_admission_class(name):
+    """
+    The AdmissionClass of a name, None for a class without limits.
+    """
+    config = settings.ADMISSION_CONTROL.get(name)
+    if config is None:
+        return None
+    with _classes_lock:
+        if name not in _classes or _classes[name].config != config:
+            _classes[name] = AdmissionClass(name, config)
+        return _classes[name]
+
+
+def rejected_response(rejected):
+    message = 'Too many requests of this kind are waiting' if rejected.status == 429 else 'The server is busy'
+    response = JsonResponse({'error': f'{message}, retry in {rejected.retry_after} seconds.'}, status=rejected.status)
+    response['Retry-After'] = str(rejected.retry_after)
+    return response
+
+
+def sales_volume():
+    """
+    First and last day with sales and the number of bill lines, from the table statistics on PostgreSQL.
+    Cached for an hour, it only has to be right within an order of magnitude.
+    """
+    volume = cache.get(SALES_VOLUME_CACHE_KEY)
+    if volume is None:
+        days = Transaction.objects.aggregate(first=Min('transaction_date'), last=Max('transaction_date'))
+        lines = estimated_count(BillItem.objects.all())
+        if lines is None:
+            lines = BillItem.objects.count()
+        volume = {'first': days['first'], 'last': days['last'], 'lines': lines}
+        cache.set(SALES_VOLUME_CACHE_KEY, volume, timeout=SALES_VOLUME_TIMEOUT)
+    return volume
+
+
+def estimated_bill_lines(start_date, end_date):
+    """
+    Estimated number of bill lines an analytics query of a date range reads: the days of the range that have sales
+    times the average bill lines per day.
+    """
+    volume = sales_volume()
+    if not volume['lines'] or volume['first'] is None:
+        return 0
+    last = max(volume['last'], timezone.now().date())
+    days = (min(end_date, last) - max(start_date, volume['first'])).days + 1
+    if days <= 0:
+        return 0
+    return days * volume['lines'] // ((last - volume['first']).days + 1)
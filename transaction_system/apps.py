@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class TransactionSystemConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transaction_system'
+
+    def ready(self):
+        # Connects the signals that drop cached credentials when a user or token changes.
+        from . import authentication  # noqa: F401
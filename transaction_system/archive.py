@@ -0,0 +1,220 @@
+"""
+Cold storage of the sales of closed months in compressed Parquet files.
+
+`python manage.py archive_sales` moves the transactions and bill items of the months that closed more than
+SALES_ARCHIVE_AFTER_MONTHS months ago out of the database into SALES_ARCHIVE_DIR, one hive partition per month:
+
+    transactions/month=2024-01/<part>.parquet  transaction_id, transaction_date, transaction_time, total_amount
+    bill_items/month=2024-01/<part>.parquet    transaction_id, transaction_date, transaction_time, item_id, quantity,
+                                               unit_price
+
+Amounts are minor units like in the database. Every day is archived in its own database transaction to zstd compressed
+files of its own, so a scan only reads the months (partitions) and days (file statistics) of its date range.
+Transactions with refunds stay in the database together with their refunds.
+
+A day's files are written under hidden names and renamed when its transaction commits, or deleted when it rolls back,
+so a sale is never visible in both places. A process killed between the commit and the rename leaves hidden files
+(`.<token>.parquet`, the same token in both datasets) with sales that are no longer in the database: rename them by
+hand.
+
+A sale is either in the database or in the archive, never in both: the analytics in utils.py add the `archived_sales`
+of a date range to what the database still holds.
+"""
+import calendar
+import os
+import uuid
+from datetime import date, timedelta
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import BigIntegerField, Exists, OuterRef
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import BillItem, Item, Refund, Transaction
+
+TRANSACTIONS = 'transactions'
+BILL_ITEMS = 'bill_items'
+
+SCHEMAS = {
+    TRANSACTIONS: pa.schema([
+        ('transaction_id', pa.string()),
+        ('transaction_date', pa.date32()),
+        ('transaction_time', pa.timestamp('us', tz='UTC')),
+        ('total_amount', pa.int64()),
+    ]),
+    BILL_ITEMS: pa.schema([
+        ('transaction_id', pa.string()),
+        ('transaction_date', pa.date32()),
+        ('transaction_time', pa.timestamp('us', tz='UTC')),
+        ('item_id', pa.string()),
+        ('quantity', pa.int64()),
+        ('unit_price', pa.int64()),
+    ]),
+}
+
+PARTITIONING = ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive')
+
+
+def archive_dir():
+    return Path(settings.SALES_ARCHIVE_DIR)
+
+
+def month_dates(month):
+    """
+    First and last day of a month ('2024-01').
+    """
+    year, number = (int(part) for part in month.split('-'))
+    return date(year, number, 1), date(year, number, calendar.monthrange(year, number)[1])
+
+
+def archived_months():
+    """
+    The archived months, oldest first.
+    """
+    path = archive_dir() / TRANSACTIONS
+    if not path.is_dir():
+        return []
+    return sorted(entry.name[len('month='):] for entry in os.scandir(path)
+                  if entry.is_dir() and entry.name.startswith('month='))
+
+
+def months_to_archive(today=None):
+    """
+    The months with sales in the database that closed more than SALES_ARCHIVE_AFTER_MONTHS months ago.
+    """
+    today = today or timezone.now().date()
+    month = today.year * 12 + today.month - 1 - settings.SALES_ARCHIVE_AFTER_MONTHS
+    before = date(month // 12, month % 12 + 1, 1)
+    first = Transaction.objects.filter(transaction_date__lt=before).order_by('transaction_date') \
+        .values_list('transaction_date', flat=True).first()
+    months = []
+    while first is not None and first < before:
+        months.append(f'{first:%Y-%m}')
+        first = month_dates(months[-1])[1] + timedelta(days=1)
+    return months
+
+
+class ArchivedSales:
+    """
+    The archived sales of a date range: the bill `lines`, with the current name and category of their item,
+    and the `transactions`, as DataFrames. Amounts are minor units.
+    """
+
+    def __init__(self, lines, transactions):
+        self.lines = lines
+        self.transactions = transactions
+
+
+def _scan(name, columns, start_date, end_date, months):
+    dataset = ds.dataset(archive_dir() / name, format='parquet', partitioning=PARTITIONING)
+    condition = ds.field('month').isin(months) & (ds.field('transaction_date') >= start_date) \
+        & (ds.field('transaction_date') <= end_date)
+    return dataset.to_table(columns=columns, filter=condition).to_pandas()
+
+
+def archived_sales(start_date, end_date, category=None):
+    """
+    The ArchivedSales of a date range, optionally only of the items of a category.
+    None when the range does not reach into an archived month.
+    """
+    months = [month for month in archived_months()
+              if month_dates(month)[0] <= end_date and month_dates(month)[1] >= start_date]
+    if not months:
+        return None
+
+    lines = _scan(BILL_ITEMS, ['transaction_id', 'transaction_date', 'transaction_time', 'item_id', 'quantity',
+                               'unit_price'], start_date, end_date, months)
+    catalog = Item.objects.filter(item_code__in=lines['item_id'].unique().tolist())
+    if category:
+        catalog = catalog.filter(category=category)
+    catalog = pd.DataFrame(list(catalog.values_list('item_code', 'name', 'category')),
+                           columns=['item_id', 'name', 'category'])
+    # Like the join in the database, lines of deleted items are dropped
+    lines = lines.merge(catalog, on='item_id')
+
+    transactions = _scan(TRANSACTIONS, ['transaction_id', 'transaction_date', 'transaction_time', 'total_amount'],
+                         start_date, end_date, months)
+    return ArchivedSales(lines, transactions)
+
+
+def _write_file(name, rows, month, token):
+    """
+    Write the rows of a day to a hidden file of a dataset's month partition, returns its path.
+    Scans skip hidden files, it is renamed when the rows were deleted from the database.
+    """
+    schema = SCHEMAS[name]
+    table = pa.Table.from_arrays([pa.array(column, type=field.type) for column, field in zip(zip(*rows), schema)],
+                                 schema=schema)
+    path = archive_dir() / name / f'month={month}'
+    path.mkdir(parents=True, exist_ok=True)
+    hidden = path / f'.{token}.parquet'
+    pq.write_table(table, hidden, compression='zstd')
+    return hidden
+
+
+def _publish(files, committed):
+    committed.append(True)
+    for hidden in files:
+        hidden.rename(hidden.with_name(hidden.name[1:]))
+
+
+def archive_day(day):
+    """
+    Move the transactions without refunds and the bill items of a day from the database to the archive in one
+    database transaction, returns the number of archived transactions and bill items.
+    """
+    month = f'{day:%Y-%m}'
+    refunded = Refund.objects.filter(transaction=OuterRef('pk'))
+    transactions = Transaction.objects.filter(transaction_date=day).filter(~Exists(refunded))
+    token = uuid.uuid4().hex
+    files, committed = [], []
+    try:
+        with db_transaction.atomic():
+            # Refunds lock their transaction first, the queries after the lock see refunds committed meanwhile
+            if not list(transactions.select_for_update().values_list('pk', flat=True)):
+                return 0, 0
+
+            rows = list(transactions.order_by('transaction_time', 'transaction_id').values_list(
+                'transaction_id', 'transaction_date', 'transaction_time', Cast('total_amount', BigIntegerField())))
+            lines = list(BillItem.objects.filter(transaction__in=transactions)
+                         .order_by('transaction__transaction_time', 'transaction_id', 'id').values_list(
+                'transaction_id', 'transaction__transaction_date', 'transaction__transaction_time', 'item_id',
+                'quantity', Cast('unit_price', BigIntegerField())))
+            files.append(_write_file(TRANSACTIONS, [(str(row[0]),) + row[1:] for row in rows], month, token))
+            if lines:
+                files.append(_write_file(BILL_ITEMS, [(str(line[0]),) + line[1:] for line in lines], month, token))
+
+            BillItem.objects.filter(transaction__in=transactions).delete()
+            transactions.delete()
+            # The files become visible only once the rows are gone from the database
+            db_transaction.on_commit(lambda: _publish(files, committed))
+    except BaseException:
+        if not committed:
+            for hidden in files:
+                if hidden.exists():
+                    hidden.unlink()
+        raise
+    return len(rows), len(lines)
+
+
+def archive_month(month):
+    """
+    Move the transactions without refunds and the bill items of a month from the database to the archive, a day
+    at a time, returns the number of archived transactions and bill items. Archiving a month again moves the rows it
+    still has in the database to new files of its partition.
+    """
+    first, last = month_dates(month)
+    counts = {TRANSACTIONS: 0, BILL_ITEMS: 0}
+    day = first
+    while day <= last:
+        transactions, lines = archive_day(day)
+        counts[TRANSACTIONS] += transactions
+        counts[BILL_ITEMS] += lines
+        day += timedelta(days=1)
+    return counts
@@ -0,0 +1,150 @@
+"""
+Authentication classes that do not pay for a password hash on every request.
+
+Token lookups and verified Basic credentials are kept in a small in-process cache (AUTH_LOCAL_CACHE_TIMEOUT)
+in front of the shared django cache (Redis). Saving a user or deleting a token drops the cached entries
+of that user, other processes see the change once their in-process entry expires.
+"""
+import hashlib
+import hmac
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from rest_framework import exceptions
+from rest_framework.authentication import BasicAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+
+from .models import Users
+
+
+class LocalCache:
+    """
+    Tiny thread safe in-process cache with a TTL, the oldest entries are dropped once `max_size` is reached.
+    """
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            if len(self._data) >= self.max_size:
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (time.monotonic() + timeout, value)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LocalCache()
+
+
+def _cache_get(key):
+    value = local_cache.get(key)
+    if value is None:
+        value = cache.get(key)
+        if value is not None:
+            local_cache.set(key, value, settings.AUTH_LOCAL_CACHE_TIMEOUT)
+    return value
+
+
+def _cache_set(key, value, timeout):
+    cache.set(key, value, timeout=timeout)
+    local_cache.set(key, value, min(timeout, settings.AUTH_LOCAL_CACHE_TIMEOUT))
+
+
+def _cache_delete(key):
+    cache.delete(key)
+    local_cache.delete(key)
+
+
+def _token_cache_key(key):
+    return f'auth_token_{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+def _basic_cache_key(username):
+    return f'auth_basic_{hashlib.sha256(username.encode()).hexdigest()}'
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    DRF token authentication (`Authorization: Token <key>`) with the token lookup cached for AUTH_CACHE_TIMEOUT.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = _token_cache_key(key)
+        token = _cache_get(cache_key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            _cache_set(cache_key, token, settings.AUTH_CACHE_TIMEOUT)
+        elif not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return token.user, token
+
+
+class CachedBasicAuthentication(BasicAuthentication):
+    """
+    Basic authentication for clients that have not moved to tokens yet.
+    Verified credentials are remembered for BASIC_AUTH_CACHE_TIMEOUT seconds as an HMAC of the username and
+    password, so only the first request in that window runs the password hasher. 0 disables the cache.
+    """
+
+    def authenticate_credentials(self, userid, password, request=None):
+        timeout = settings.BASIC_AUTH_CACHE_TIMEOUT
+        if not timeout:
+            return super().authenticate_credentials(userid, password, request)
+
+        cache_key = _basic_cache_key(userid)
+        digest = hmac.new(settings.SECRET_KEY.encode(), f'{userid}:{password}'.encode(), hashlib.sha256).digest()
+        cached = _cache_get(cache_key)
+        if cached is not None and hmac.compare_digest(cached[0], digest):
+            return cached[1], None
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        _cache_set(cache_key, (digest, user), timeout)
+        return user, auth
+
+
+AUTHENTICATION_CLASSES = [CachedTokenAuthentication, CachedBasicAuthentication]
+
+
+def authenticate(request):
+    """
+    Authenticate a plain django request (e.g. of an async view, which cannot be a DRF view) with AUTHENTICATION_CLASSES.
+    Returns the user, or None when the credentials are missing or invalid.
+    """
+    drf_request = Request(request, authenticators=[authentication() for authentication in AUTHENTICATION_CLASSES])
+    try:
+        user = drf_request.user
+    except exceptions.AuthenticationFailed:
+        return None
+    return user if user.is_authenticated else None
+
+
+@receiver([post_save, post_delete], sender=Users)
+def _forget_cached_user(sender, instance, **kwargs):
+    _cache_delete(_basic_cache_key(instance.username))
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        _cache_delete(_token_cache_key(key))
+
+
+@receiver(post_delete, sender=Token)
+def _forget_cached_token(sender, instance, **kwargs):
+    _cache_delete(_token_cache_key(instance.key))
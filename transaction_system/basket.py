@@ -0,0 +1,133 @@
+"""
+Market-basket analysis: which items are bought together.
+
+The bill items of a date range are read in chunks of whole transactions, every chunk becomes a sparse
+transaction x item matrix X of zeros and ones, and X.T @ X adds the number of baskets that contain both items
+to an item x item co-occurrence matrix. Memory is bounded by the chunk size and the number of item pairs that
+were actually bought together, not by the number of transactions.
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from RetailApp.db.routers import analytics_db
+from .instrumentation import timed_stage
+from .models import BillItem, Item
+
+CHUNK_ROWS = 200000  # Bill items read per query
+MIN_PAIR_COUNT = 2  # Baskets an item pair has to appear in to be reported
+MAX_PAIRS = 10000  # Most frequent pairs kept in the result
+
+
+def _transaction_chunks(start_date, end_date, db):
+    """
+    Yield (transaction_ids, item_codes) arrays of the bill items in the range, about CHUNK_ROWS at a time and
+    without splitting a transaction between two chunks.
+    """
+    bill_items = BillItem.objects.using(db) \
+        .filter(transaction__transaction_date__range=(start_date, end_date)) \
+        .order_by('transaction_id')
+    last_transaction = None
+    while True:
+        chunk = bill_items if last_transaction is None else bill_items.filter(transaction_id__gt=last_transaction)
+        rows = list(chunk.values_list('transaction_id', 'item_id')[:CHUNK_ROWS])
+        if not rows:
+            return
+        if len(rows) == CHUNK_ROWS:
+            # The last transaction may continue in the next chunk, it is read again from its start.
+            complete = [row for row in rows if row[0] != rows[-1][0]]
+            if complete:
+                rows = complete
+            else:
+                # A single transaction with more than CHUNK_ROWS bill items
+                rows = list(bill_items.filter(transaction_id=rows[-1][0]).values_list('transaction_id', 'item_id'))
+        transaction_ids, item_codes = zip(*rows)
+        yield np.array(transaction_ids, dtype=object), np.array(item_codes, dtype=object)
+        last_transaction = rows[-1][0]
+
+
+@timed_stage('sparse')
+def co_occurrence(start_date, end_date):
+    """
+    The number of baskets, the item codes and the sparse co-occurrence matrix of a date range.
+    The diagonal holds the number of baskets that contain each item.
+    Items created after the item codes were read (sold while the job runs) are left out.
+    """
+    db = analytics_db(end_date)
+    item_codes = pd.Index(Item.objects.using(db).order_by('item_code').values_list('item_code', flat=True))
+    counts = sparse.csr_matrix((len(item_codes), len(item_codes)), dtype=np.int64)
+    baskets = 0
+    for transaction_ids, codes in _transaction_chunks(start_date, end_date, db):
+        rows, _ = pd.factorize(transaction_ids)
+        columns = item_codes.get_indexer(codes)
+        known = columns >= 0
+        matrix = sparse.csr_matrix((np.ones(known.sum(), dtype=np.int64), (rows[known], columns[known])),
+                                   shape=(rows.max() + 1, len(item_codes)))
+        matrix.data[:] = 1  # An item that appears twice in a basket counts once
+        counts = counts + matrix.T @ matrix
+        baskets += matrix.shape[0]
+    return baskets, item_codes, counts
+
+
+def market_basket(start_date, end_date):
+    """
+    Support, confidence and lift of the item pairs bought together in at least MIN_PAIR_COUNT baskets of a date range,
+    the MAX_PAIRS most frequent pairs first.
+    """
+    baskets, item_codes, counts = co_occurrence(start_date, end_date)
+    if baskets == 0:
+        return {'baskets': 0, 'pairs': []}
+
+    item_counts = counts.diagonal()
+    pairs = sparse.triu(counts, k=1).tocoo()
+    frequent = pairs.data >= MIN_PAIR_COUNT
+    item_a, item_b, together = pairs.row[frequent], pairs.col[frequent], pairs.data[frequent]
+    top = np.argsort(-together, kind='stable')[:MAX_PAIRS]
+    item_a, item_b, together = item_a[top], item_b[top], together[top]
+
+    support = together / baskets
+    confidence_a_b = together / item_counts[item_a]
+    confidence_b_a = together / item_counts[item_b]
+    lift = together * baskets / (item_counts[item_a] * item_counts[item_b])
+
+    names = dict(Item.objects.filter(item_code__in=set(item_codes[item_a]) | set(item_codes[item_b]))
+                 .values_list('item_code', 'name'))
+    return {
+        'baskets': baskets,
+        'pairs': [{
+            'item_a': item_codes[a],
+            'name_a': names.get(item_codes[a]),
+            'item_b': item_codes[b],
+            'name_b': names.get(item_codes[b]),
+            'baskets': int(count),
+            'support': round(float(pair_support), 6),
+            'confidence_a_b': round(float(pair_confidence_a_b), 4),
+            'confidence_b_a': round(float(pair_confidence_b_a), 4),
+            'lift': round(float(pair_lift), 4),
+        } for a, b, count, pair_support, pair_confidence_a_b, pair_confidence_b_a, pair_lift
+            in zip(item_a, item_b, together, support, confidence_a_b, confidence_b_a, lift)],
+    }
+
+
+def bought_together(result, item_code=None, limit=20):
+    """
+    The most frequent pairs of a `market_basket` result, or the items most often bought with `item_code`
+    ordered by confidence (the share of the baskets with `item_code` that also contain the item).
+    """
+    if item_code is None:
+        return result['pairs'][:limit]
+
+    rules = []
+    for pair in result['pairs']:
+        if item_code in (pair['item_a'], pair['item_b']):
+            forward = pair['item_a'] == item_code
+            rules.append({
+                'item_code': pair['item_b'] if forward else pair['item_a'],
+                'name': pair['name_b'] if forward else pair['name_a'],
+                'baskets': pair['baskets'],
+                'support': pair['support'],
+                'confidence': pair['confidence_a_b'] if forward else pair['confidence_b_a'],
+                'lift': pair['lift'],
+            })
+    rules.sort(key=lambda rule: (-rule['confidence'], -rule['lift']))
+    return rules[:limit]
@@ -0,0 +1,142 @@
+"""
+Cache keys of the analytics views and the cache-miss log used to decide which ranges get prewarmed.
+
+Misses are counted per day in Redis sorted sets, relative to the day of the request ("the 30 days ending
+today" is stored as `0:30`), so that a range that is popular today is still the same range tomorrow.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from django_redis import get_redis_connection
+
+from .metrics import record_cache_lookup
+from .utils import get_sales_data_for_date_range
+
+db_logger = logging.getLogger('db')
+
+AVERAGE_SALES_TIMEOUT = 60 * 60
+TREND_ANALYSIS_TIMEOUT = 60 * 60
+SALES_RANGE_TIMEOUT = 60 * 60
+MARKET_BASKET_TIMEOUT = 6 * 60 * 60  # Co-occurrences change slowly and are expensive to compute
+SALES_HEATMAP_TIMEOUT = 24 * 60 * 60  # Only closed periods are cached, their sales do not change
+STOCK_FORECAST_TIMEOUT = 60 * 60  # Refreshed every 15 minutes by the forecast_stock task
+SALES_REPORT_TIMEOUT = 60 * 60
+RECEIPT_TIMEOUT = 24 * 60 * 60  # A receipt only changes with a refund, which deletes it from the cache
+
+# Hard time limit of the celery tasks the views start for an expensive range. The "task in flight" lock that keeps the
+# views from starting the same task twice expires a little after it, so a lost task is started again by the next
+# request instead of the view answering 202 until the result would have expired.
+ANALYTICS_TASK_TIME_LIMIT = 15 * 60
+TASK_LOCK_TIMEOUT = ANALYTICS_TASK_TIME_LIMIT + 5 * 60  # The time limit plus some time waiting in the queue
+
+STOCK_FORECAST_CACHE_KEY = 'stock_forecast'
+
+CACHE_MISS_LOG_DAYS = 7
+
+
+def average_sales_cache_key(start_date, end_date):
+    return f'sales_summary_{start_date}_{end_date}'
+
+
+def average_sales_lock_key(start_date, end_date):
+    return f'sales_summary_running_{start_date}_{end_date}'
+
+
+def receipt_cache_key(transaction_id):
+    return f'receipt_{transaction_id}'
+
+
+def invalidate_receipts(transaction_ids):
+    """
+    Remove the cached receipts of transactions that were refunded or undone.
+    """
+    cache.delete_many([receipt_cache_key(transaction_id) for transaction_id in transaction_ids])
+
+
+def trend_analysis_cache_key(start_date, end_date):
+    return f'trend_analysis_{start_date}_{end_date}'
+
+
+def trend_analysis_lock_key(start_date, end_date):
+    return f'trend_analysis_running_{start_date}_{end_date}'
+
+
+def sales_report_cache_key(start_date, end_date):
+    return f'sales_report_{start_date}_{end_date}'
+
+
+def sales_report_lock_key(start_date, end_date):
+    return f'sales_report_running_{start_date}_{end_date}'
+
+
+def sales_range_cache_key(start_date, end_date):
+    return f'sales_range_{start_date}_{end_date}'
+
+
+def sales_range_lock_key(start_date, end_date):
+    return f'sales_range_running_{start_date}_{end_date}'
+
+
+def market_basket_cache_key(start_date, end_date):
+    return f'market_basket_{start_date}_{end_date}'
+
+
+def market_basket_lock_key(start_date, end_date):
+    return f'market_basket_running_{start_date}_{end_date}'
+
+
+def sales_heatmap_cache_key(start_date, end_date, category=None):
+    return f'sales_heatmap_{start_date}_{end_date}_{category or ""}'
+
+
+def _cache_miss_key(kind, day):
+    return f'cache_misses_{kind}_{day}'
+
+
+def record_cache_miss(kind, start_date, end_date):
+    """
+    Log a cache miss of the `kind` analytics ('average_sales', 'trend_analysis' or 'sales_range') for a range.
+    """
+    today = timezone.now().date()
+    relative_range = f'{(today - end_date).days}:{(end_date - start_date).days + 1}'
+    db_logger.info('cache miss %s %s - %s', kind, start_date, end_date)
+    key = _cache_miss_key(kind, today)
+    redis = get_redis_connection('default')
+    with redis.pipeline() as pipe:
+        pipe.zincrby(key, 1, relative_range)
+        pipe.expire(key, (CACHE_MISS_LOG_DAYS + 1) * 24 * 60 * 60)
+        pipe.execute()
+
+
+def popular_ranges(kind, limit):
+    """
+    The `limit` ranges of `kind` that missed the cache most often in the last CACHE_MISS_LOG_DAYS days,
+    as (start_date, end_date) tuples relative to today.
+    """
+    today = timezone.now().date()
+    keys = [_cache_miss_key(kind, today - timedelta(days=days)) for days in range(CACHE_MISS_LOG_DAYS)]
+    misses = get_redis_connection('default').zunion(keys, withscores=True)
+    ranges = []
+    for relative_range, count in sorted(misses, key=lambda miss: -miss[1]):
+        if count < settings.CACHE_WARMING_MIN_MISSES or len(ranges) == limit:
+            break
+        end_offset, days = (int(value) for value in relative_range.decode().split(':'))
+        end_date = today - timedelta(days=end_offset)
+        ranges.append((end_date - timedelta(days=days - 1), end_date))
+    return ranges
+
+
+def get_cached_sales_data_for_date_range(start_date, end_date):
+    """
+    `get_sales_data_for_date_range` through the cache, used by the sales comparison.
+    """
+    cache_key = sales_range_cache_key(start_date, end_date)
+    sales_data = record_cache_lookup('sales_range', cache.get(cache_key))
+    if sales_data is None:
+        record_cache_miss('sales_range', start_date, end_date)
+        sales_data = get_sales_data_for_date_range(start_date, end_date)
+        cache.set(cache_key, sales_data, timeout=SALES_RANGE_TIMEOUT)
+    return sales_data
@@ -0,0 +1,101 @@
+"""
+Stock depletion forecast for the whole catalog.
+
+The daily quantities sold of every item over the last STOCK_FORECAST_HISTORY_DAYS days are read with a single
+grouped query into an items x days matrix. The sales velocity of every item is the exponentially weighted moving
+average (half-life STOCK_FORECAST_HALF_LIFE days) of its row, computed for all items at once as one matrix-vector
+product, and the days of stock remaining and reorder quantities follow element-wise.
+"""
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from RetailApp.db.routers import analytics_db
+from .instrumentation import stage
+from .models import BillItem, Item
+
+
+def ewma_weights(days, half_life):
+    """
+    Weights of the last `days` days (oldest first) of an exponentially weighted moving average, they add up to 1.
+    """
+    weights = 0.5 ** (np.arange(days - 1, -1, -1) / half_life)
+    return weights / weights.sum()
+
+
+def daily_quantities(start_date, end_date, item_codes, db):
+    """
+    Items x days matrix of the quantities sold per day, rows in the order of `item_codes`.
+    """
+    rows = BillItem.objects.using(db) \
+        .filter(transaction__transaction_date__range=(start_date, end_date)) \
+        .values_list('item_id', 'transaction__transaction_date') \
+        .annotate(quantity=Sum('quantity')) \
+        .order_by()
+    quantities = np.zeros((len(item_codes), (end_date - start_date).days + 1))
+    if rows:
+        item_ids, dates, sold = zip(*rows)
+        with stage('numpy'):
+            days = (np.array(dates, dtype='datetime64[D]') - np.datetime64(start_date, 'D')).astype(int)
+            quantities[item_codes.get_indexer(item_ids), days] = sold
+    return quantities
+
+
+def forecast_stock_depletion():
+    """
+    Sales velocity, days of stock remaining and suggested reorder quantity of every item that sold in the history
+    window, the items that run out first first.
+    """
+    today = timezone.now().date()
+    history_days = settings.STOCK_FORECAST_HISTORY_DAYS
+    # Today is not over yet and would pull every velocity down, the history ends yesterday.
+    end_date = today - timedelta(days=1)
+    start_date = end_date - timedelta(days=history_days - 1)
+
+    items = list(Item.objects.order_by('item_code').values_list('item_code', 'name', 'category', 'current_quantity'))
+    if not items:
+        return {'date': str(today), 'items': []}
+    item_codes, names, categories, current_quantity = zip(*items)
+    item_codes = pd.Index(item_codes)
+    quantities = daily_quantities(start_date, end_date, item_codes, analytics_db(end_date))
+
+    with stage('numpy'):
+        current_quantity = np.array(current_quantity, dtype=float)
+        velocity = quantities @ ewma_weights(history_days, settings.STOCK_FORECAST_HALF_LIFE)
+        selling = velocity > 0
+        days_remaining = np.full(len(item_codes), np.inf)
+        days_remaining[selling] = current_quantity[selling] / velocity[selling]
+        target_stock = velocity * (settings.STOCK_REORDER_LEAD_DAYS + settings.STOCK_REORDER_COVER_DAYS)
+        reorder_quantity = np.ceil(np.clip(target_stock - current_quantity, 0, None)).astype(int)
+        order = np.argsort(days_remaining[selling], kind='stable')
+        selected = np.flatnonzero(selling)[order]
+
+    return {
+        'date': str(today),
+        'items': [{
+            'item_code': item_codes[index],
+            'name': names[index],
+            'category': categories[index],
+            'current_quantity': int(current_quantity[index]),
+            'daily_velocity': round(float(velocity[index]), 3),
+            'days_remaining': round(float(days_remaining[index]), 1),
+            'reorder_quantity': int(reorder_quantity[index]),
+        } for index in selected],
+    }
+
+
+def items_running_out(forecast, days, category=None, limit=100):
+    """
+    The items of a forecast whose stock lasts less than `days` days.
+    """
+    running_out = []
+    for item in forecast['items']:
+        if item['days_remaining'] >= days or len(running_out) == limit:
+            break
+        if category is None or item['category'] == category:
+            running_out.append(item)
+    return running_out
@@ -0,0 +1,109 @@
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+
+
+_current_timings = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """
+    Collects the SQL and stage timings of a single sampled request.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.slowest_sql = ''
+        self.slowest_sql_time = 0.0
+        self.stages = {}
+
+    def record_query(self, execute, sql, params, many, context):
+        """
+        Database execute wrapper, see https://docs.djangoproject.com/en/4.2/topics/db/instrumentation/
+        """
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.queries += 1
+            self.sql_time += duration
+            if duration > self.slowest_sql_time:
+                self.slowest_sql_time = duration
+                self.slowest_sql = sql
+
+    def add_stage(self, name, duration):
+        self.stages[name] = self.stages.get(name, 0.0) + duration
+
+    def server_timing(self, total):
+        """
+        Build the value of the Server-Timing header, durations are in milliseconds.
+        """
+        metrics = [
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.queries} queries"',
+            f'db-slowest;dur={self.slowest_sql_time * 1000:.1f}',
+        ]
+        metrics += [f'{name};dur={duration * 1000:.1f}' for name, duration in self.stages.items()]
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(metrics)
+
+    def as_dict(self, total):
+        return {
+            'queries': self.queries,
+            'sql_time_ms': round(self.sql_time * 1000, 1),
+            'slowest_sql_ms': round(self.slowest_sql_time * 1000, 1),
+            'slowest_sql': self.slowest_sql,
+            'stages_ms': {name: round(duration * 1000, 1) for name, duration in self.stages.items()},
+            'total_ms': round(total * 1000, 1),
+        }
+
+
+def start_request_timings():
+    """
+    Start collecting timings for the current request, returns the timings and a token for `stop_request_timings`.
+    """
+    timings = RequestTimings()
+    return timings, _current_timings.set(timings)
+
+
+def stop_request_timings(token):
+    _current_timings.reset(token)
+
+
+def get_request_timings():
+    """
+    Timings of the current request, None when the request is not sampled.
+    """
+    return _current_timings.get()
+
+
+@contextmanager
+def stage(name):
+    """
+    Time a block of code as the stage `name` of the current request.
+    Costs a single context variable lookup when the request is not sampled.
+    """
+    timings = _current_timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add_stage(name, time.perf_counter() - started)
+
+
+def timed_stage(name):
+    """
+    Decorator version of `stage`.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,192 @@
+"""
+Bulk changes of the item catalog: price files and received stock.
+
+Changes are diffed against the current catalog in memory, so only the items that really change are written:
+changed names, prices and categories and received stock as `current_quantity + received` (an increment, which cannot
+lose a concurrent checkout) in chunks, and new items with an upserting `bulk_create`.
+
+On PostgreSQL every chunk is a single `UPDATE ... FROM (VALUES ...)`; `bulk_update` builds a CASE expression per
+field and row in Python, which costs about 30 seconds for a 40k row price file. Other databases use `bulk_update`
+with F() increments.
+"""
+import csv
+import io
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.db import connection, transaction as db_transaction
+from django.db.models import F
+
+from .models import Item
+from .money import to_minor_units
+
+BATCH_SIZE = 2000
+ATTRIBUTES = ('name', 'price', 'category')
+
+
+class InventoryError(ValueError):
+    """
+    Raised when a row of an inventory file is invalid, the message names the row.
+    """
+
+
+def read_inventory_file(content, file_format):
+    """
+    Rows of a CSV (with a header line) or JSON (a list of objects) inventory file.
+    Columns: item_code, and any of name, price, category, received_quantity.
+    """
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+    if file_format == 'csv':
+        return list(csv.DictReader(io.StringIO(content)))
+    if file_format == 'json':
+        rows = json.loads(content)
+        if not isinstance(rows, list):
+            raise InventoryError('A JSON inventory file has to contain a list of items.')
+        return rows
+    raise InventoryError(f'Unknown inventory file format {file_format}, use csv or json.')
+
+
+def clean_inventory_rows(rows):
+    """
+    Validate and convert the rows, later rows of the same item_code are merged into earlier ones
+    (received quantities add up). Returns {item_code: change}.
+    """
+    changes = {}
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            raise InventoryError(f'Row {number}: expected an object with an item_code.')
+        item_code = str(row.get('item_code') or '').strip()
+        if not item_code or len(item_code) > 50:
+            raise InventoryError(f'Row {number}: item_code is required and at most 50 characters long.')
+
+        change = {}
+        for field in ('name', 'category'):
+            value = str(row.get(field) or '').strip()
+            if len(value) > 255:
+                raise InventoryError(f'Row {number}: {field} is longer than 255 characters.')
+            if value:
+                change[field] = value
+        if row.get('price') not in (None, ''):
+            try:
+                change['price'] = Decimal(str(row['price'])).quantize(Decimal('0.01'))
+            except InvalidOperation:
+                raise InventoryError(f"Row {number}: invalid price {row['price']}.")
+            if change['price'] < 0 or change['price'] >= 10 ** 8:
+                raise InventoryError(f"Row {number}: price {row['price']} is out of range.")
+        received = row.get('received_quantity')
+        if received not in (None, ''):
+            try:
+                received = int(received)
+            except (TypeError, ValueError):
+                raise InventoryError(f'Row {number}: invalid received_quantity {received}.')
+            if received < 0:
+                raise InventoryError(f'Row {number}: received_quantity cannot be negative.')
+            change['received_quantity'] = received
+
+        merged = changes.setdefault(item_code, {})
+        merged['received_quantity'] = merged.get('received_quantity', 0) + change.pop('received_quantity', 0)
+        merged.update(change)
+    return changes
+
+
+def _current_catalog(item_codes):
+    catalog = {}
+    item_codes = list(item_codes)
+    for start in range(0, len(item_codes), BATCH_SIZE):
+        for item in Item.objects.filter(item_code__in=item_codes[start:start + BATCH_SIZE]) \
+                .only('item_code', *ATTRIBUTES):
+            catalog[item.item_code] = item
+    return catalog
+
+
+def _update_items(updated, updated_fields, restocked):
+    """
+    Write the changed attributes of `updated` items and add the received quantities of `restocked`
+    ({item_code: quantity}).
+    """
+    if connection.vendor != 'postgresql':
+        if updated:
+            Item.objects.bulk_update(updated, sorted(updated_fields), batch_size=BATCH_SIZE)
+        if restocked:
+            Item.objects.bulk_update([Item(item_code=item_code, current_quantity=F('current_quantity') + quantity)
+                                      for item_code, quantity in restocked.items()],
+                                     ['current_quantity'], batch_size=BATCH_SIZE)
+        return
+
+    updated = {item.item_code: item for item in updated}
+    rows = []
+    for item_code in sorted(updated.keys() | restocked.keys()):
+        item = updated.get(item_code)
+        rows.append(item_code)
+        for field in ATTRIBUTES:
+            # An attribute no item changed is not written, like with bulk_update
+            value = getattr(item, field) if item is not None and field in updated_fields else None
+            rows.append(to_minor_units(value) if field == 'price' and value is not None else value)
+        rows.append(restocked.get(item_code, 0))
+    table = Item._meta.db_table
+    columns = len(ATTRIBUTES) + 2
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE * columns):
+            chunk = rows[start:start + BATCH_SIZE * columns]
+            values = ', '.join(['(%s, %s::varchar, %s::bigint, %s::varchar, %s::integer)'] * (len(chunk) // columns))
+            # A NULL attribute was not changed and keeps its value
+            cursor.execute(
+                f'UPDATE {table} AS item SET name = COALESCE(change.name, item.name), '
+                f'price = COALESCE(change.price, item.price), category = COALESCE(change.category, item.category), '
+                f'current_quantity = item.current_quantity + change.received_quantity '
+                f'FROM (VALUES {values}) AS change (item_code, name, price, category, received_quantity) '
+                f'WHERE item.item_code = change.item_code',
+                chunk,
+            )
+
+
+def apply_inventory_changes(rows, dry_run=False):
+    """
+    Apply the rows of an inventory file in a single transaction and return the number of rows, created, updated,
+    restocked and unchanged items and the total received quantity. With `dry_run` nothing is written.
+    """
+    changes = clean_inventory_rows(rows)
+    catalog = _current_catalog(changes)
+
+    updated, created = [], []
+    restocked = {}
+    updated_fields = set()
+    for item_code, change in sorted(changes.items()):
+        item = catalog.get(item_code)
+        if item is None:
+            missing = [field for field in ATTRIBUTES if field not in change]
+            if missing:
+                raise InventoryError(f"New item {item_code} needs {', '.join(missing)}.")
+            created.append(Item(item_code=item_code, name=change['name'], price=change['price'],
+                                category=change['category'], starting_quantity=change['received_quantity'],
+                                current_quantity=change['received_quantity']))
+            continue
+
+        changed = {field for field in ATTRIBUTES if field in change and getattr(item, field) != change[field]}
+        if changed:
+            for field in changed:
+                setattr(item, field, change[field])
+            updated.append(item)
+            updated_fields |= changed
+        if change['received_quantity']:
+            restocked[item_code] = change['received_quantity']
+
+    if not dry_run:
+        with db_transaction.atomic():
+            _update_items(updated, updated_fields, restocked)
+            if created:
+                # Upsert, an item created since the catalog was read gets the attributes of the file.
+                Item.objects.bulk_create(created, batch_size=BATCH_SIZE, update_conflicts=True,
+                                         unique_fields=['item_code'], update_fields=list(ATTRIBUTES))
+
+    touched = {item.item_code for item in updated} | restocked.keys()
+    return {
+        'rows': len(rows),
+        'created': len(created),
+        'updated': len(updated),
+        'restocked': len(restocked),
+        'unchanged': len(catalog) - len(touched),
+        'received_quantity': sum(change['received_quantity'] for change in changes.values()),
+        'dry_run': dry_run,
+    }
@@ -0,0 +1,144 @@
+"""
+Real-time top sellers, kept in Redis sorted sets.
+
+Every checkout increments the quantity and revenue of its items and their categories in a sorted set per day and one per
+hour (UTC), so the top K of today or of the last N hours is read with ZREVRANGE instead of grouping the day's bill items.
+The counters are best effort: a checkout whose update was lost never fails because of it, and the nightly
+`reconcile_leaderboard` task rebuilds the closed day from the BillItem table.
+"""
+import logging
+import uuid
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.db.models import F, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+from .models import BillItem, Item
+from .money import as_money
+
+db_logger = logging.getLogger('db')
+
+DIMENSIONS = ('item', 'category')
+METRICS = ('quantity', 'revenue')
+
+MAX_HOURS = 48
+DAY_KEY_TIMEOUT = 8 * 24 * 60 * 60
+HOUR_KEY_TIMEOUT = (MAX_HOURS + 1) * 60 * 60
+
+
+def day_key(dimension, metric, day):
+    return f'leaderboard_{dimension}_{metric}_{day}'
+
+
+def hour_key(dimension, metric, hour):
+    return f'leaderboard_{dimension}_{metric}_{hour:%Y-%m-%dT%H}'
+
+
+def _scores(bill_items):
+    """
+    Quantity and revenue of the bill items per (dimension, metric) and member (item_code or category).
+    """
+    scores = defaultdict(lambda: defaultdict(float))
+    for bill_item in bill_items:
+        for dimension, member in (('item', bill_item.item.item_code), ('category', bill_item.item.category)):
+            scores[dimension, 'quantity'][member] += bill_item.quantity
+            scores[dimension, 'revenue'][member] += float(bill_item.quantity * bill_item.unit_price)
+    return scores
+
+
+def record_sale(transaction, bill_items):
+    """
+    Add the bill items of a committed transaction to the leaderboards of its day and hour.
+    """
+    hour = transaction.transaction_time.replace(minute=0, second=0, microsecond=0)
+    try:
+        with get_redis_connection('default').pipeline(transaction=False) as pipe:
+            for (dimension, metric), members in _scores(bill_items).items():
+                for key, timeout in ((day_key(dimension, metric, transaction.transaction_date), DAY_KEY_TIMEOUT),
+                                     (hour_key(dimension, metric, hour), HOUR_KEY_TIMEOUT)):
+                    for member, score in members.items():
+                        pipe.zincrby(key, score, member)
+                    pipe.expire(key, timeout)
+            pipe.execute()
+    except RedisError:
+        db_logger.warning('Could not update the leaderboard for %s', transaction.transaction_id, exc_info=True)
+
+
+def top_sellers(dimension, metric, limit, hours=None):
+    """
+    The `limit` best selling items or categories by quantity or revenue, of today or of the last `hours` hours,
+    as a list of (member, score) tuples.
+    """
+    redis = get_redis_connection('default')
+    if hours is None:
+        key = day_key(dimension, metric, timezone.now().date())
+        return [(member.decode(), score) for member, score in redis.zrevrange(key, 0, limit - 1, withscores=True)]
+
+    now = timezone.now().replace(minute=0, second=0, microsecond=0)
+    keys = [hour_key(dimension, metric, now - timedelta(hours=offset)) for offset in range(hours)]
+    union_key = f'leaderboard_union_{uuid.uuid4().hex}'
+    with redis.pipeline() as pipe:
+        pipe.zunionstore(union_key, keys)
+        pipe.zrevrange(union_key, 0, limit - 1, withscores=True)
+        pipe.delete(union_key)
+        _, top, _ = pipe.execute()
+    return [(member.decode(), score) for member, score in top]
+
+
+def get_top_sellers(limit, hours=None):
+    """
+    Top items and categories by quantity and by revenue, as returned by the top-sellers api.
+    """
+    top = {(dimension, metric): top_sellers(dimension, metric, limit, hours)
+           for dimension in DIMENSIONS for metric in METRICS}
+    item_codes = {item_code for metric in METRICS for item_code, _ in top['item', metric]}
+    names = dict(Item.objects.filter(item_code__in=item_codes).values_list('item_code', 'name'))
+    response = {}
+    for metric in METRICS:
+        response[f'top_items_by_{metric}'] = [
+            {'item_code': item_code, 'name': names.get(item_code), f'total_{metric}': score}
+            for item_code, score in top['item', metric]
+        ]
+        response[f'top_categories_by_{metric}'] = [
+            {'category': category, f'total_{metric}': score} for category, score in top['category', metric]
+        ]
+    return response
+
+
+def reconcile_leaderboard(day):
+    """
+    Rebuild the leaderboards of a day and its hours from the BillItem table, correcting lost or repeated updates.
+    Returns the number of rewritten sorted sets.
+    """
+    rows = BillItem.objects.filter(transaction__transaction_date=day) \
+        .annotate(hour=TruncHour('transaction__transaction_time')) \
+        .values('item_id', 'item__category', 'hour') \
+        .annotate(total_quantity=Sum('quantity'), total_revenue=as_money(Sum(F('quantity') * F('unit_price')))) \
+        .order_by()
+
+    sets = defaultdict(lambda: defaultdict(float))
+    for row in rows:
+        for dimension, member in (('item', row['item_id']), ('category', row['item__category'])):
+            for metric in METRICS:
+                score = float(row[f'total_{metric}'])
+                sets[day_key(dimension, metric, day)][member] += score
+                sets[hour_key(dimension, metric, row['hour'])][member] += score
+
+    # Hours of the day that had sales before, but none in the database, are cleared as well.
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    day_keys = {day_key(dimension, metric, day) for dimension in DIMENSIONS for metric in METRICS}
+    hour_keys = {hour_key(dimension, metric, start + timedelta(hours=hour))
+                 for dimension in DIMENSIONS for metric in METRICS for hour in range(24)}
+
+    with get_redis_connection('default').pipeline() as pipe:
+        for key in day_keys | hour_keys:
+            pipe.delete(key)
+            if sets.get(key):
+                pipe.zadd(key, sets[key])
+                pipe.expire(key, DAY_KEY_TIMEOUT if key in day_keys else HOUR_KEY_TIMEOUT)
+        pipe.execute()
+    return len(sets)
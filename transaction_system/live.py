@@ -0,0 +1,186 @@
+"""
+Live sales feed for the dashboards.
+
+Checkouts publish their totals to a Redis channel after they are committed. Every ASGI process runs a single
+subscription to that channel, keeps today's running totals in memory and fans the events out to the dashboards
+connected to it, so a new dashboard costs neither a query nor a Redis connection. The running totals are reloaded
+from the database every LIVE_SALES_RESYNC_INTERVAL seconds, which also corrects events lost while Redis was unavailable.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import RedisError
+
+db_logger = logging.getLogger('db')
+
+SALES_EVENTS_CHANNEL = 'sales_events'
+
+
+def sale_event(transaction, bill_items):
+    """
+    The increments a committed transaction adds to the sales summary of its day.
+    """
+    items, categories = defaultdict(int), defaultdict(int)
+    for bill_item in bill_items:
+        items[bill_item.item.name] += bill_item.quantity
+        categories[bill_item.item.category] += bill_item.quantity
+    return {
+        'date': str(transaction.transaction_date),
+        'transaction_id': str(transaction.transaction_id),
+        'total_sales': float(transaction.total_amount),
+        'items_quantity': [{'item__name': name, 'total_quantity_sold': quantity}
+                           for name, quantity in items.items()],
+        'categories_quantity': [{'item__category': category, 'total_quantity_sold': quantity}
+                                for category, quantity in categories.items()],
+    }
+
+
+def publish_sale(transaction, bill_items):
+    """
+    Publish a committed transaction to the live sales feed, a checkout never fails because of it.
+    """
+    try:
+        get_redis_connection('default').publish(SALES_EVENTS_CHANNEL, json.dumps(sale_event(transaction, bill_items)))
+    except RedisError:
+        db_logger.warning('Could not publish sale %s to the live feed', transaction.transaction_id, exc_info=True)
+
+
+class RunningTotals:
+    """
+    Today's sales summary, in the format of the sales-summary api, kept up to date with the sale events.
+    """
+
+    def __init__(self, summary, date):
+        self.date = str(date)
+        self.total_sales = float(summary['total_sales'])
+        self.items = {row['item__name']: row['total_quantity_sold'] for row in summary['items_quantity']}
+        self.categories = {row['item__category']: row['total_quantity_sold'] for row in summary['categories_quantity']}
+
+    def apply(self, event):
+        if event['date'] != self.date:
+            # The first sale of a new day starts new totals.
+            self.__init__({'total_sales': 0, 'items_quantity': [], 'categories_quantity': []}, event['date'])
+        self.total_sales += event['total_sales']
+        for row in event['items_quantity']:
+            self.items[row['item__name']] = self.items.get(row['item__name'], 0) + row['total_quantity_sold']
+        for row in event['categories_quantity']:
+            self.categories[row['item__category']] = \
+                self.categories.get(row['item__category'], 0) + row['total_quantity_sold']
+
+    def as_dict(self):
+        return {
+            'date': self.date,
+            'total_sales': round(self.total_sales, 2),
+            'items_quantity': [{'item__name': name, 'total_quantity_sold': quantity}
+                               for name, quantity in sorted(self.items.items())],
+            'categories_quantity': [{'item__category': category, 'total_quantity_sold': quantity}
+                                    for category, quantity in sorted(self.categories.items())],
+        }
+
+
+class SalesFeed:
+    """
+    Fans the sale events of the Redis channel out to the dashboards connected to this process.
+
+    A background thread listens to the channel and loads the running totals from the database; it hands
+    everything to the event loop, which owns the totals and the queue of every subscriber.
+    """
+
+    def __init__(self):
+        self.totals = None
+        self._subscribers = set()
+        self._loop = None
+        self._thread = None
+
+    async def subscribe(self):
+        """
+        Yield ('snapshot', totals) whenever the running totals were (re)loaded, ('sale', event) for every sale
+        and ('heartbeat', None) when nothing happened for LIVE_SALES_HEARTBEAT_INTERVAL seconds.
+        """
+        queue = asyncio.Queue(maxsize=settings.LIVE_SALES_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        self._start()
+        if self.totals is not None:
+            queue.put_nowait(('snapshot', self.totals.as_dict()))
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), settings.LIVE_SALES_HEARTBEAT_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield 'heartbeat', None
+        finally:
+            self._subscribers.discard(queue)
+
+    def _start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._loop = asyncio.get_running_loop()
+            self._thread = threading.Thread(target=self._listen, name='live-sales-feed', daemon=True)
+            self._thread.start()
+
+    def _broadcast(self, message):
+        for queue in list(self._subscribers):
+            if queue.full():
+                # A dashboard that cannot keep up skips the backlog and starts over from the current totals.
+                while not queue.empty():
+                    queue.get_nowait()
+                message_for_queue = ('snapshot', self.totals.as_dict())
+            else:
+                message_for_queue = message
+            queue.put_nowait(message_for_queue)
+
+    def on_snapshot(self, summary, date):
+        self.totals = RunningTotals(summary, date)
+        self._broadcast(('snapshot', self.totals.as_dict()))
+
+    def on_event(self, event):
+        if self.totals is None:
+            # Nothing to add the sale to before the first snapshot.
+            return
+        self.totals.apply(event)
+        self._broadcast(('sale', event))
+
+    def _load_totals(self):
+        from .utils import get_sales_summary_for_day  # utils publishes the sales, import it late to avoid the cycle
+
+        today = timezone.now().date()
+        try:
+            summary = get_sales_summary_for_day(today)
+        finally:
+            connections.close_all()
+        self._loop.call_soon_threadsafe(self.on_snapshot, summary, today)
+
+    def _listen(self):
+        while True:
+            pubsub = get_redis_connection('default').pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(SALES_EVENTS_CHANNEL)
+                # Subscribe first, sales committed while the totals load are then counted at worst twice until the
+                # next resync, instead of never.
+                self._load_totals()
+                loaded_at = time.monotonic()
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message is not None:
+                        self._loop.call_soon_threadsafe(self.on_event, json.loads(message['data']))
+                    if time.monotonic() - loaded_at > settings.LIVE_SALES_RESYNC_INTERVAL:
+                        self._load_totals()
+                        loaded_at = time.monotonic()
+            except (RedisError, DatabaseError):
+                db_logger.warning('Live sales feed failed, restarting', exc_info=True)
+                time.sleep(1)
+            except RuntimeError:
+                # The event loop was closed, the server is shutting down.
+                return
+            finally:
+                pubsub.close()
+
+
+sales_feed = SalesFeed()
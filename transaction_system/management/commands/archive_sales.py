@@ -0,0 +1,30 @@
+import json
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transaction_system.archive import archive_month, months_to_archive
+
+
+class Command(BaseCommand):
+    help = 'Move the sales of closed months from the database to the Parquet archive (SALES_ARCHIVE_DIR).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('months', nargs='*',
+                            help='Months to archive (2024-01), by default the months older than '
+                                 'SALES_ARCHIVE_AFTER_MONTHS.')
+        parser.add_argument('--dry-run', action='store_true', help='Only list the months that would be archived.')
+
+    def handle(self, *args, **options):
+        months = options['months'] or months_to_archive()
+        invalid = [month for month in months if not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', month)]
+        if invalid:
+            raise CommandError(f"Invalid months {', '.join(invalid)}, use YYYY-MM.")
+        if options['dry_run']:
+            self.stdout.write(json.dumps({'months': months}))
+            return
+        for month in months:
+            started = time.perf_counter()
+            counts = archive_month(month)
+            self.stdout.write(f'{month}: {json.dumps(counts)} archived in {time.perf_counter() - started:.2f}s')
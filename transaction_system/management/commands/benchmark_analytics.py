@@ -0,0 +1,226 @@
+import json
+import os
+import platform
+import random
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from transaction_system.basket import market_basket
+from transaction_system.forecasting import forecast_stock_depletion
+from transaction_system.models import Item, Transaction, BillItem
+from transaction_system.utils import get_sales_summary_for_day, get_avg_sales_summary, get_sales_data, \
+    get_sales_data_by_item, calculate_moving_average, calculate_manual_trend, get_sales_data_for_date_range
+
+
+SCALES = {
+    '10k': 10_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+
+DEFAULT_BASELINE = settings.BASE_DIR / 'benchmarks' / 'analytics_baseline.json'
+
+BATCH_SIZE = 10_000
+
+
+def generate_sales_data(bill_lines, items=500, days=90, seed=1498):
+    """
+    Fill the database with `bill_lines` BillItem rows spread over `days` days ending today.
+    Each transaction holds 1-5 lines, the same shape as populate_data.py.
+    """
+    rnd = random.Random(seed)
+    categories = [f'Category {n}' for n in range(20)]
+    Item.objects.bulk_create([
+        Item(
+            name=f'Item {n}',
+            item_code=f'BM{n:06d}',
+            price=Decimal(rnd.randint(100, 20000)) / 100,
+            category=rnd.choice(categories),
+            starting_quantity=10 ** 9,
+            current_quantity=10 ** 9,
+        )
+        for n in range(items)
+    ], batch_size=BATCH_SIZE)
+    catalog = list(Item.objects.values_list('item_code', 'price'))
+
+    end_date = timezone.now().date()
+    created = 0
+    while created < bill_lines:
+        transactions, lines = [], []
+        while len(lines) < BATCH_SIZE and created + len(lines) < bill_lines:
+            transaction = Transaction(
+                transaction_id=uuid.uuid4(),
+                transaction_date=end_date - timedelta(days=rnd.randrange(days)),
+            )
+            total_amount = 0
+            for _ in range(min(rnd.randint(1, 5), bill_lines - created - len(lines))):
+                item_code, price = rnd.choice(catalog)
+                quantity = rnd.randint(1, 10)
+                lines.append(BillItem(transaction_id=transaction.transaction_id, item_id=item_code,
+                                      quantity=quantity, unit_price=price))
+                total_amount += quantity * price
+            transaction.total_amount = total_amount
+            transactions.append(transaction)
+        Transaction.objects.bulk_create(transactions)
+        BillItem.objects.bulk_create(lines)
+        created += len(lines)
+    return end_date - timedelta(days=days - 1), end_date
+
+
+def clear_sales_data():
+    BillItem.objects.all().delete()
+    Transaction.objects.all().delete()
+    Item.objects.all().delete()
+
+
+def build_cases(start_date, end_date):
+    """
+    Return (name, callable, rows) for every benchmarked analytics function.
+    `rows` is the number of bill lines (or DataFrame rows) the call has to process.
+    """
+    lines_in_range = BillItem.objects.filter(transaction__transaction_date__range=(start_date, end_date)).count()
+    lines_today = BillItem.objects.filter(transaction__transaction_date=end_date).count()
+    trend_df = get_sales_data_by_item(start_date, end_date).to_frame()
+
+    return [
+        ('get_sales_summary_for_day', lambda: get_sales_summary_for_day(end_date), lines_today),
+        ('get_avg_sales_summary', lambda: get_avg_sales_summary(start_date, end_date), lines_in_range),
+        ('get_sales_data', lambda: get_sales_data(start_date, end_date), lines_in_range),
+        ('get_sales_data_by_item', lambda: get_sales_data_by_item(start_date, end_date), lines_in_range),
+        ('calculate_moving_average', lambda: calculate_moving_average(trend_df.copy()), len(trend_df)),
+        ('calculate_manual_trend', lambda: calculate_manual_trend(trend_df.copy()), len(trend_df)),
+        ('get_sales_data_for_date_range', lambda: get_sales_data_for_date_range(start_date, end_date), lines_in_range),
+        ('market_basket', lambda: market_basket(start_date, end_date), lines_in_range),
+        ('forecast_stock_depletion', forecast_stock_depletion, Item.objects.count()),
+    ]
+
+
+def measure(func, rows, repeat):
+    """
+    Time `func` `repeat` times and keep the best wall time, then run it once more
+    under tracemalloc and query capture so that neither skews the timing.
+    """
+    wall_time = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        wall_time = min(wall_time, time.perf_counter() - started)
+
+    tracemalloc.start()
+    with CaptureQueriesContext(connection) as queries:
+        func()
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'wall_time': wall_time,
+        'queries': len(queries),
+        'peak_memory': peak_memory,
+        'rows': rows,
+        'rows_per_sec': rows / wall_time if wall_time else 0.0,
+    }
+
+
+def compare_with_baseline(results, baseline, tolerance):
+    """
+    Return a list of human readable regressions of `results` against `baseline`.
+    Wall time and peak memory may grow by `tolerance`; the query count may not grow at all.
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric in ('wall_time', 'peak_memory'):
+            if result[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {previous[metric]:.4g} -> {result[metric]:.4g}')
+        if result['queries'] > previous['queries']:
+            regressions.append(f"{name}: queries {previous['queries']} -> {result['queries']}")
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the analytics functions in transaction_system.utils on generated datasets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='10k',
+                            help=f"Comma separated dataset sizes in bill lines: {', '.join(SCALES)}")
+        parser.add_argument('--items', type=int, default=500, help='Number of SKUs in the generated catalog.')
+        parser.add_argument('--days', type=int, default=90, help='Number of days the sales are spread over.')
+        parser.add_argument('--repeat', type=int, default=3, help='Timed runs per function, best one is kept.')
+        parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='Path of the baseline JSON file.')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed relative slowdown / memory growth before a regression is reported.')
+        parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline.')
+        parser.add_argument('--keepdb', action='store_true',
+                            help='Keep the benchmark database and reuse its data when the size matches.')
+
+    def handle(self, *args, **options):
+        scales = [scale.strip().lower() for scale in options['scales'].split(',')]
+        unknown = [scale for scale in scales if scale not in SCALES]
+        if unknown:
+            raise CommandError(f"Unknown scale(s): {', '.join(unknown)}")
+
+        baseline_path = options['baseline']
+        try:
+            with open(baseline_path) as baseline_file:
+                baseline = json.load(baseline_file)
+        except FileNotFoundError:
+            baseline = {}
+
+        # Never touch real sales data: run against a throwaway test database.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'])
+        regressions, results = [], {}
+        try:
+            for scale in scales:
+                results[scale] = self.run_scale(scale, options)
+                found = compare_with_baseline(results[scale], baseline.get('scales', {}).get(scale, {}),
+                                              options['tolerance'])
+                regressions.extend(f'[{scale}] {regression}' for regression in found)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        if options['save_baseline']:
+            baseline.setdefault('scales', {}).update(results)
+            baseline['environment'] = {
+                'python': platform.python_version(),
+                'database': connection.vendor,
+                'machine': platform.machine(),
+            }
+            os.makedirs(os.path.dirname(baseline_path) or '.', exist_ok=True)
+            with open(baseline_path, 'w') as baseline_file:
+                json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {baseline_path}'))
+
+        if regressions:
+            raise CommandError('Performance regressions found:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
+
+    def run_scale(self, scale, options):
+        bill_lines = SCALES[scale]
+        if BillItem.objects.count() != bill_lines:
+            self.stdout.write(f'Generating {bill_lines} bill lines ...')
+            clear_sales_data()
+            generate_sales_data(bill_lines, items=options['items'], days=options['days'])
+
+        start_date, end_date = Transaction.objects.order_by('transaction_date') \
+            .values_list('transaction_date', flat=True)[0], timezone.now().date()
+
+        self.stdout.write(f'\n{scale} ({bill_lines} bill lines)')
+        self.stdout.write(f"{'function':<32}{'wall (s)':>12}{'queries':>10}{'peak (MB)':>12}{'rows/s':>14}")
+        results = {}
+        for name, func, rows in build_cases(start_date, end_date):
+            result = results[name] = measure(func, rows, options['repeat'])
+            self.stdout.write(f"{name:<32}{result['wall_time']:>12.4f}{result['queries']:>10}"
+                              f"{result['peak_memory'] / 2 ** 20:>12.2f}{result['rows_per_sec']:>14.0f}")
+        return results
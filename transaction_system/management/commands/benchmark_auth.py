@@ -0,0 +1,63 @@
+import base64
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework.authentication import BasicAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory
+
+from transaction_system.authentication import CachedBasicAuthentication, CachedTokenAuthentication, local_cache
+from transaction_system.models import Item, Users
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-request cost of plain Basic, cached Basic and cached Token authentication.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50, help='Requests per authentication scheme.')
+
+    def handle(self, *args, **options):
+        # Run against a throwaway test database, the benchmark creates its own user and item.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options['requests'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, requests):
+        user = Users.objects.create_user(username='benchmark', password='benchmark-password')
+        token = Token.objects.create(user=user)
+        Item.objects.create(name='Pizza', item_code='P001', price=10, category='Food',
+                            starting_quantity=100, current_quantity=100)
+
+        basic = 'Basic ' + base64.b64encode(b'benchmark:benchmark-password').decode()
+        schemes = [
+            ('basic (no cache)', BasicAuthentication(), basic),
+            ('basic (cached)', CachedBasicAuthentication(), basic),
+            ('token (cached)', CachedTokenAuthentication(), f'Token {token.key}'),
+        ]
+        factory = APIRequestFactory()
+        client = Client()
+        url = reverse('item-details', args=['P001'])
+
+        self.stdout.write(f"{'scheme':<20}{'auth (ms)':>12}{'request (ms)':>15}")
+        for name, authenticator, header in schemes:
+            local_cache.clear()
+            with override_settings(BASIC_AUTH_CACHE_TIMEOUT=0 if name == 'basic (no cache)' else 30,
+                                   REQUEST_TIMING_SAMPLE_RATE=0, PROFILING_SAMPLE_RATE=0):
+                request = factory.get(url, HTTP_AUTHORIZATION=header)
+                started = time.perf_counter()
+                for _ in range(requests):
+                    authenticator.authenticate(request)
+                auth_cost = (time.perf_counter() - started) / requests
+
+                started = time.perf_counter()
+                for _ in range(requests):
+                    response = client.get(url, HTTP_AUTHORIZATION=header)
+                    assert response.status_code == 200, response.content
+                request_cost = (time.perf_counter() - started) / requests
+            self.stdout.write(f'{name:<20}{auth_cost * 1000:>12.2f}{request_cost * 1000:>15.2f}')
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections, close_old_connections
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from RetailApp.db.postgresql_pool.base import DatabaseWrapper as PooledDatabaseWrapper, pool_stats
+from transaction_system.models import Item, Users
+
+
+class Command(BaseCommand):
+    help = 'Compare the per-request cost of items/<item_code> with a new database connection per request ' \
+           'and with the connection pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help='Requests per connection strategy.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('The connection benchmark needs the PostgreSQL database.')
+
+        # Run against a throwaway test database, the benchmark creates its own user and item.
+        old_name = connection.settings_dict['NAME']
+        default_connection = connections['default']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options['requests'])
+        finally:
+            connections['default'].close()
+            connections['default'] = default_connection
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, requests):
+        user = Users.objects.create_user(username='benchmark', password='benchmark-password')
+        header = f'Token {Token.objects.create(user=user).key}'
+        Item.objects.create(name='Pizza', item_code='P001', price=10, category='Food',
+                            starting_quantity=100, current_quantity=100)
+        pooled_settings = {**connection.settings_dict, 'CONN_MAX_AGE': 0}
+        plain_settings = {**pooled_settings, 'OPTIONS': {
+            key: value for key, value in pooled_settings['OPTIONS'].items() if key != 'pool'
+        }}
+        connection.close()
+
+        client = Client()
+        url = reverse('item-details', args=['P001'])
+        self.stdout.write(f"{'strategy':<24}{'request (ms)':>15}")
+        for name, wrapper_class, settings_dict in (
+                ('connection per request', PostgresDatabaseWrapper, plain_settings),
+                ('connection pool', PooledDatabaseWrapper, pooled_settings)):
+            connections['default'] = wrapper_class(settings_dict, alias='default')
+            with override_settings(REQUEST_TIMING_SAMPLE_RATE=0, PROFILING_SAMPLE_RATE=0):
+                started = time.perf_counter()
+                for _ in range(requests):
+                    response = client.get(url, HTTP_AUTHORIZATION=header)
+                    assert response.status_code == 200, response.content
+                    # What Django does on request_finished; the test client skips it.
+                    close_old_connections()
+                request_cost = (time.perf_counter() - started) / requests
+            connections['default'].close()
+            self.stdout.write(f'{name:<24}{request_cost * 1000:>15.2f}')
+
+        self.stdout.write(f'\nPool utilization: {pool_stats()}')
@@ -0,0 +1,29 @@
+import json
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from transaction_system.inventory import InventoryError, apply_inventory_changes, read_inventory_file
+
+
+class Command(BaseCommand):
+    help = 'Apply a CSV or JSON file of item changes (price, name, category, received_quantity) to the catalog.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file with a header line or JSON file with a list of items.')
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help='File format, by default taken from the file extension.')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would change.')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('json' if os.path.splitext(options['path'])[1].lower() == '.json' else 'csv')
+        try:
+            with open(options['path'], 'rb') as file:
+                rows = read_inventory_file(file.read(), file_format)
+            started = time.perf_counter()
+            report = apply_inventory_changes(rows, dry_run=options['dry_run'])
+        except (OSError, InventoryError, ValueError) as e:
+            raise CommandError(str(e))
+        self.stdout.write(json.dumps(report))
+        self.stdout.write(f'Applied in {time.perf_counter() - started:.2f}s')
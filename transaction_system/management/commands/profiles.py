@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from transaction_system.profiling import list_profiles, summarize_profile
+
+
+class Command(BaseCommand):
+    help = 'List the captured request profiles, or summarize one of them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', help='Profile to summarize, lists all profiles when omitted.')
+        parser.add_argument('--limit', type=int, default=20, help='Number of frames shown in a summary.')
+        parser.add_argument('--dir', default=settings.PROFILING_DIR, help='Directory of the captured profiles.')
+
+    def handle(self, *args, **options):
+        if options['profile_id']:
+            self.summarize(options['dir'], options['profile_id'], options['limit'])
+            return
+
+        profiles = list_profiles(options['dir'])
+        if not profiles:
+            self.stdout.write(f"No profiles captured in {options['dir']}")
+            return
+        self.stdout.write(f"{'id':<28}{'duration (s)':>13}{'samples':>9}  {'status':<7}request")
+        for profile in profiles:
+            self.stdout.write(f"{profile['id']:<28}{profile['duration']:>13.3f}{profile['samples']:>9}  "
+                              f"{profile.get('status', ''):<7}{profile.get('method', '')} {profile.get('path', '')}")
+
+    def summarize(self, directory, profile_id, limit):
+        try:
+            samples, frames = summarize_profile(directory, profile_id, limit)
+        except FileNotFoundError:
+            raise CommandError(f'Profile {profile_id} not found in {directory}')
+        samples = samples or 1
+
+        self.stdout.write(f"{'self %':>7}{'total %':>9}  frame")
+        for frame, own, total in frames:
+            self.stdout.write(f'{own * 100 / samples:>7.1f}{total * 100 / samples:>9.1f}  {frame}')
+        self.stdout.write(f'\nFlamegraph input: {directory}/{profile_id}.folded')
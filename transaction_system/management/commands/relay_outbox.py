@@ -0,0 +1,42 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError
+from redis.exceptions import RedisError
+
+from transaction_system.outbox import publish_outbox, purge_outbox, update_outbox_metrics
+
+PURGE_INTERVAL = 60  # Seconds between deletions of the published events
+
+
+class Command(BaseCommand):
+    help = 'Publish the sale events of the outbox to the sales stream in Redis, until stopped.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Publish the events that are waiting and stop.')
+        parser.add_argument('--batch-size', type=int, help='Events per batch, OUTBOX_BATCH_SIZE by default.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or settings.OUTBOX_BATCH_SIZE
+        purged_at = 0
+        while True:
+            try:
+                published = 0
+                while True:
+                    count = publish_outbox(batch_size)
+                    published += count
+                    if count < batch_size:
+                        break
+                if time.monotonic() - purged_at > PURGE_INTERVAL:
+                    purge_outbox()
+                    purged_at = time.monotonic()
+                update_outbox_metrics()
+            except (DatabaseError, RedisError) as e:
+                if options['once']:
+                    raise
+                self.stderr.write(f'Relaying the outbox failed, retrying: {e}')
+            if options['once']:
+                self.stdout.write(f'Published {published} events')
+                return
+            time.sleep(settings.OUTBOX_RELAY_INTERVAL)
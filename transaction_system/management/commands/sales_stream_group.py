@@ -0,0 +1,22 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from transaction_system.outbox import consumer_groups, create_consumer_group
+
+
+class Command(BaseCommand):
+    help = 'Create a consumer group of the sales stream or move it to an offset to replay events, ' \
+           'without a group list the groups with their offset and lag.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('group', nargs='?', help='Name of the consumer group.')
+        parser.add_argument('--offset', default='$',
+                            help="Stream id after which the group reads, '0' replays the whole stream, "
+                                 "'$' (default) only reads new events.")
+
+    def handle(self, *args, **options):
+        if options['group']:
+            create_consumer_group(options['group'], options['offset'])
+        for group in consumer_groups():
+            self.stdout.write(json.dumps(group))
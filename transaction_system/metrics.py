@@ -0,0 +1,164 @@
+"""
+Prometheus metrics of the retail app.
+
+When PROMETHEUS_MULTIPROC_DIR is set (it has to be set before the app starts and shared by all gunicorn and
+celery worker processes of a host), every process writes its samples to that directory and /metrics
+aggregates them, so the numbers are correct no matter which worker answers the scrape.
+"""
+import os
+import time
+
+from celery.signals import before_task_publish, task_prerun, task_postrun, task_failure
+from django.http import HttpResponse
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, \
+    generate_latest, multiprocess
+
+
+VIEW_LATENCY = Histogram(
+    'retail_view_latency_seconds', 'Latency of the transaction_system views.',
+    ['view', 'method', 'status'],
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60),
+)
+
+CHECKOUT_OUTCOMES = Counter(
+    'retail_checkout_total', 'Outcomes of add-sales checkouts.',
+    ['outcome'],
+)
+
+STOCK_LOCK_WAIT = Histogram(
+    'retail_stock_lock_wait_seconds', 'Time spent waiting for the stock row locks during checkout.',
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 5),
+)
+
+ADMISSION_REJECTIONS = Counter(
+    'retail_admission_rejections_total', 'Requests turned away by admission control, 429 queue full or 503 timed out.',
+    ['admission_class', 'status'],
+)
+
+ADMISSION_WAIT = Histogram(
+    'retail_admission_wait_seconds', 'Time admitted requests waited for a slot of their admission class.',
+    ['admission_class'],
+    buckets=(.001, .005, .01, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+
+OUTBOX_PUBLISHED = Counter(
+    'retail_outbox_published_total', 'Outbox events published to the sales stream.',
+)
+
+OUTBOX_BACKLOG = Gauge(
+    'retail_outbox_backlog_events', 'Outbox events that were not published to the sales stream yet.',
+    multiprocess_mode='livemax',
+)
+
+OUTBOX_BACKLOG_AGE = Gauge(
+    'retail_outbox_backlog_age_seconds', 'Age of the oldest outbox event that was not published yet.',
+    multiprocess_mode='livemax',
+)
+
+SALES_STREAM_LAG = Gauge(
+    'retail_sales_stream_lag_events', 'Events of the sales stream not delivered to a consumer group yet.',
+    ['group'],
+    multiprocess_mode='livemax',
+)
+
+SALES_STREAM_PENDING = Gauge(
+    'retail_sales_stream_pending_events', 'Events of the sales stream delivered to a consumer group but not acknowledged.',
+    ['group'],
+    multiprocess_mode='livemax',
+)
+
+CACHE_LOOKUPS = Counter(
+    'retail_cache_lookups_total', 'Lookups of cached sales summaries.',
+    ['cache', 'result'],
+)
+
+CELERY_TASK_DURATION = Histogram(
+    'retail_celery_task_duration_seconds', 'Run time of celery tasks.',
+    ['task', 'queue', 'state'],
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900),
+)
+
+CELERY_QUEUE_WAIT = Histogram(
+    'retail_celery_queue_wait_seconds', 'Time celery tasks spent in their queue before a worker started them.',
+    ['queue'],
+    buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+
+CELERY_TASK_FAILURES = Counter(
+    'retail_celery_task_failures_total', 'Failed celery tasks.',
+    ['task', 'queue'],
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    'retail_db_pool_connections', 'Connections of the database connection pools.',
+    ['alias', 'state'],
+    multiprocess_mode='livesum',
+)
+
+DB_POOL_WAIT = Histogram(
+    'retail_db_pool_wait_seconds', 'Time spent waiting for a connection from the database connection pool.',
+    ['alias'],
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5),
+)
+
+DB_POOL_TIMEOUTS = Counter(
+    'retail_db_pool_timeouts_total', 'Requests that gave up waiting for a database connection.',
+    ['alias'],
+)
+
+
+def record_cache_lookup(cache_name, value):
+    """
+    Count a cache lookup as a hit or a miss and return the looked up value.
+    """
+    CACHE_LOOKUPS.labels(cache=cache_name, result='miss' if value is None else 'hit').inc()
+    return value
+
+
+_task_started_at = {}
+
+
+def _task_queue(task):
+    """
+    Name of the queue a task was consumed from, tasks that ran eagerly were never queued.
+    """
+    delivery_info = task.request.delivery_info or {}
+    return delivery_info.get('routing_key') or 'eager'
+
+
+@before_task_publish.connect
+def _task_published(headers=None, **kwargs):
+    headers['published_at'] = time.time()
+
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    _task_started_at[task_id] = time.perf_counter()
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is not None:
+        CELERY_QUEUE_WAIT.labels(queue=_task_queue(task)).observe(max(time.time() - published_at, 0))
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started_at.pop(task_id, None)
+    if started is not None:
+        CELERY_TASK_DURATION.labels(task=task.name, queue=_task_queue(task), state=state or 'UNKNOWN') \
+            .observe(time.perf_counter() - started)
+
+
+@task_failure.connect
+def _task_failed(sender=None, **kwargs):
+    CELERY_TASK_FAILURES.labels(task=sender.name, queue=_task_queue(sender)).inc()
+
+
+def metrics_view(request):
+    """
+    Expose the metrics in the Prometheus text format.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,142 @@
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from RetailApp.db.postgresql_pool.base import pool_stats
+from .admission import Rejected, get_admission_class, rejected_response
+from .instrumentation import start_request_timings, stop_request_timings, get_request_timings
+from .metrics import VIEW_LATENCY
+from .profiling import SamplingProfiler, should_profile
+
+db_logger = logging.getLogger('db')
+
+
+class ServerTimingMiddleware:
+    """
+    Records the number of queries, total SQL time, the slowest statement, pandas stages and
+    render time for a sample of the requests.
+    The timings are returned in the Server-Timing header and written to the `db` logger.
+
+    The share of sampled requests is set by REQUEST_TIMING_SAMPLE_RATE (0.0 - 1.0).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+
+        timings, token = start_request_timings()
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.record_query))
+                response = self.get_response(request)
+        finally:
+            stop_request_timings(token)
+        total = time.perf_counter() - started
+
+        response['Server-Timing'] = timings.server_timing(total)
+        db_logger.info(
+            'request timings %s %s: %s queries in %.1fms, total %.1fms',
+            request.method, request.path, timings.queries, timings.sql_time * 1000, total * 1000,
+            extra={'method': request.method, 'path': request.path, 'status': response.status_code,
+                   'db_pools': pool_stats(), **timings.as_dict(total)},
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook, time it with a post render callback.
+        timings = get_request_timings()
+        if timings is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(
+                lambda rendered: timings.add_stage('render', time.perf_counter() - started)
+            )
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Observes the latency of every transaction_system view in the retail_view_latency_seconds histogram.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        view_class = getattr(match.func, 'view_class', None) if match else None
+        if view_class is not None and view_class.__module__.startswith('transaction_system.'):
+            VIEW_LATENCY.labels(view=match.url_name, method=request.method, status=response.status_code) \
+                .observe(time.perf_counter() - started)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Runs the sampling profiler around a single request when asked for by an admin with the X-Profile header,
+    or for the PROFILING_SAMPLE_RATE share of requests. Captured profiles are saved to PROFILING_DIR and
+    can be inspected with `python manage.py profiles`.
+    Requests that are not profiled only pay for the header lookup and one random number, plus a (cached)
+    authentication when they send the header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request):
+            return self.get_response(request)
+
+        profiler = SamplingProfiler(interval=settings.PROFILING_INTERVAL).start()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.stop()
+
+        match = request.resolver_match
+        response['X-Profile-Id'] = profiler.save(
+            settings.PROFILING_DIR,
+            method=request.method,
+            path=request.get_full_path(),
+            view=match.url_name if match else None,
+            status=response.status_code,
+        )
+        return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Runs the views of an admission class (see transaction_system/admission.py) in one of the slots of their class,
+    or answers 429 / 503 with a Retry-After header when no slot is free in time.
+    Last in MIDDLEWARE, since it calls the view itself to hold the slot while the view runs.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None)
+        admission = get_admission_class(getattr(view_class, 'admission_class', None))
+        if admission is None:
+            return None
+        try:
+            token = admission.admit()
+        except Rejected as rejected:
+            return rejected_response(rejected)
+        try:
+            return view_func(request, *view_args, **view_kwargs)
+        finally:
+            admission.release(token)
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction_system', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_date', 'transaction_time'], name='transaction_date_time_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import transaction_system.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction_system', '0002_transaction_date_time_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Refund',
+            fields=[
+                ('refund_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('refund_date', models.DateField(db_index=True)),
+                ('refund_time', models.DateTimeField(auto_now_add=True)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10, validators=[transaction_system.models.validate_interval_for_price])),
+                ('reason', models.CharField(blank=True, max_length=255)),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='refunds', to='transaction_system.transaction')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RefundLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10, validators=[transaction_system.models.validate_interval_for_price])),
+                ('item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='transaction_system.item')),
+                ('refund', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='transaction_system.refund')),
+            ],
+        ),
+    ]
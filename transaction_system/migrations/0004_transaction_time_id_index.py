@@ -0,0 +1,17 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction_system', '0003_refund'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_time', 'transaction_id'], name='transaction_time_id_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations
+
+# The indexes serve the trigram similarity (%) and LIKE / ILIKE matching of the item search and the admin.
+# They are expression indexes on UPPER(), the form Django's icontains and istartswith lookups compare.
+TRIGRAM_INDEXES = {
+    'item_name_trgm_idx': 'name',
+    'item_code_trgm_idx': 'item_code',
+}
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return  # Other databases search with the in-memory index of transaction_system/search.py
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            # The server lacks the contrib extensions, the item search falls back to the in-memory index
+            return
+    table = schema_editor.quote_name(apps.get_model('transaction_system', 'Item')._meta.db_table)
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, column in TRIGRAM_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {table} '
+                              f'USING gin (UPPER({schema_editor.quote_name(column)}) gin_trgm_ops)')
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction_system', '0004_transaction_time_id_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
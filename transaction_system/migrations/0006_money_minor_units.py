@@ -0,0 +1,106 @@
+# Generated by Django 4.2.16 on 2026-10-19 09:46
+
+from django.db import migrations
+import transaction_system.models
+import transaction_system.money
+
+# Money columns converted from numeric(10, 2) to bigint minor units (cents)
+MONEY_FIELDS = [
+    ('billitem', 'unit_price'),
+    ('item', 'price'),
+    ('refund', 'total_amount'),
+    ('refundline', 'unit_price'),
+    ('transaction', 'total_amount'),
+]
+
+
+STATE_OPERATIONS = [
+    migrations.AlterField(
+        model_name='billitem',
+        name='unit_price',
+        field=transaction_system.money.MoneyField(validators=[transaction_system.models.validate_interval_for_price]),
+    ),
+    migrations.AlterField(
+        model_name='item',
+        name='price',
+        field=transaction_system.money.MoneyField(validators=[transaction_system.models.validate_interval_for_price]),
+    ),
+    migrations.AlterField(
+        model_name='refund',
+        name='total_amount',
+        field=transaction_system.money.MoneyField(default=0, validators=[transaction_system.models.validate_interval_for_price]),
+    ),
+    migrations.AlterField(
+        model_name='refundline',
+        name='unit_price',
+        field=transaction_system.money.MoneyField(validators=[transaction_system.models.validate_interval_for_price]),
+    ),
+    migrations.AlterField(
+        model_name='transaction',
+        name='total_amount',
+        field=transaction_system.money.MoneyField(default=0, validators=[transaction_system.models.validate_interval_for_price]),
+    ),
+]
+
+
+def _columns(apps):
+    """
+    The numeric(10, 2) money fields of every table, `apps` is the state before this migration in both directions.
+    """
+    tables = {}
+    for model_name, field_name in MONEY_FIELDS:
+        model = apps.get_model('transaction_system', model_name)
+        tables.setdefault(model, []).append(model._meta.get_field(field_name))
+    return tables
+
+
+def _money_field(model, field):
+    money_field = next(operation.field for operation in STATE_OPERATIONS
+                       if (operation.model_name, operation.name) == (model._meta.model_name, field.name)).clone()
+    money_field.set_attributes_from_name(field.name)
+    money_field.model = model
+    return money_field
+
+
+def to_minor_units(apps, schema_editor):
+    quote = schema_editor.quote_name
+    for model, fields in _columns(apps).items():
+        table = quote(model._meta.db_table)
+        if schema_editor.connection.vendor == 'postgresql':
+            # One rewrite of each table, numeric(10, 2) could not hold the scaled values in place
+            schema_editor.execute(f'ALTER TABLE {table} ' + ', '.join(
+                f'ALTER COLUMN {quote(field.column)} TYPE bigint USING round({quote(field.column)} * 100)::bigint'
+                for field in fields))
+            continue
+        for field in fields:
+            schema_editor.execute(f'UPDATE {table} SET {quote(field.column)} = '
+                                  f'CAST(ROUND({quote(field.column)} * 100) AS INTEGER)')
+            schema_editor.alter_field(model, field, _money_field(model, field))
+
+
+def to_major_units(apps, schema_editor):
+    quote = schema_editor.quote_name
+    for model, fields in _columns(apps).items():
+        table = quote(model._meta.db_table)
+        if schema_editor.connection.vendor == 'postgresql':
+            schema_editor.execute(f'ALTER TABLE {table} ' + ', '.join(
+                f'ALTER COLUMN {quote(field.column)} TYPE numeric(10, 2) USING {quote(field.column)} / 100.0'
+                for field in fields))
+            continue
+        for field in fields:
+            schema_editor.alter_field(model, _money_field(model, field), field)
+            schema_editor.execute(f'UPDATE {table} SET {quote(field.column)} = {quote(field.column)} / 100.0')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transaction_system', '0005_item_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=STATE_OPERATIONS,
+            database_operations=[migrations.RunPython(to_minor_units, to_major_units)],
+        ),
+    ]
@@ -4,6 +4,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.exceptions import ValidationError
 
+from .money import MoneyField
+
 
 def validate_interval_for_price(value):
     """
@@ -27,7 +29,7 @@ class Users(AbstractUser):
 class Item(models.Model):
     name = models.CharField(max_length=255, db_index=True)
     item_code = models.CharField(max_length=50, primary_key=True)
-    price = models.DecimalField(max_digits=10, decimal_places=2,  validators=[validate_interval_for_price])
+    price = MoneyField(validators=[validate_interval_for_price])
     category = models.CharField(max_length=255)
     starting_quantity = models.PositiveIntegerField()
     current_quantity = models.PositiveIntegerField()
@@ -40,7 +42,15 @@ class Transaction(models.Model):
     transaction_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     transaction_date = models.DateField(db_index=True)
     transaction_time = models.DateTimeField(auto_now_add=True)
-    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, validators=[validate_interval_for_price])  # Total Bill Amount
+    total_amount = MoneyField(default=0, validators=[validate_interval_for_price])  # Total Bill Amount
+
+    class Meta:
+        indexes = [
+            # Date range scans of the hour x weekday heatmap read the sale time from the index
+            models.Index(fields=['transaction_date', 'transaction_time'], name='transaction_date_time_idx'),
+            # Cursor pagination of the transaction history
+            models.Index(fields=['transaction_time', 'transaction_id'], name='transaction_time_id_idx'),
+        ]
 
     def __str__(self):
         return f'Transaction {self.transaction_id} on {self.transaction_date}'
@@ -50,8 +60,69 @@ class BillItem(models.Model):
     transaction = models.ForeignKey(Transaction, related_name='bill_items', on_delete=models.CASCADE)
     item = models.ForeignKey(Item, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField()
-    unit_price = models.DecimalField(max_digits=10, decimal_places=2, validators=[validate_interval_for_price])
+    unit_price = MoneyField(validators=[validate_interval_for_price])
 
     def __str__(self):
         return f'{self.quantity} of {self.item.name}'
 
+
+
+# Refund model, a void is a refund of every remaining bill item of a transaction
+class Refund(models.Model):
+    refund_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    transaction = models.ForeignKey(Transaction, related_name='refunds', on_delete=models.CASCADE)
+    refund_date = models.DateField(db_index=True)
+    refund_time = models.DateTimeField(auto_now_add=True)
+    total_amount = MoneyField(default=0, validators=[validate_interval_for_price])
+    reason = models.CharField(max_length=255, blank=True)
+
+    def __str__(self):
+        return f'Refund {self.refund_id} of {self.transaction_id}'
+
+# RefundLine model
+class RefundLine(models.Model):
+    refund = models.ForeignKey(Refund, related_name='lines', on_delete=models.CASCADE)
+    item = models.ForeignKey(Item, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    unit_price = MoneyField(validators=[validate_interval_for_price])
+
+    def __str__(self):
+        return f'{self.quantity} of {self.item_id} refunded'
+
+
+# OutboxEvent model, events written in the transaction that caused them and relayed to the sales stream
+class OutboxEvent(models.Model):
+    SALE = 'sale'
+    EVENT_TYPES = [(SALE, 'Sale')]
+
+    id = models.BigAutoField(primary_key=True)  # Publish order, sent as `event_id` with the stream entry
+    event_type = models.CharField(max_length=20, choices=EVENT_TYPES)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    published_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # The relay reads the events that were not published yet in id order
+            models.Index(fields=['id'], condition=models.Q(published_at__isnull=True), name='outbox_unpublished_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.event_type} event {self.id}'
+
+
+# InventorySnapshot model, the stock of an item at the end of a day
+class InventorySnapshot(models.Model):
+    # Indexed by the unique constraint, which starts with the item
+    item = models.ForeignKey(Item, related_name='snapshots', on_delete=models.CASCADE, db_index=False)
+    snapshot_date = models.DateField()
+    quantity = models.IntegerField()
+
+    class Meta:
+        constraints = [
+            # One snapshot per item and day, also the index of the stock history of an item
+            models.UniqueConstraint(fields=['item', 'snapshot_date'], name='inventory_snapshot_item_date_uniq'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} of {self.item_id} on {self.snapshot_date}'
@@ -0,0 +1,115 @@
+"""
+Money stored as an integer number of minor units (cents).
+
+MoneyField columns are bigints, so sums and averages in the database are exact integer arithmetic and the analytics
+read int64 values, while the models, forms, admin and serializers keep working with Decimal amounts.
+Integer expressions over money columns (e.g. `F('quantity') * F('unit_price')`) are in minor units, `as_money`
+turns their result into an exact Decimal amount in major units.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+from django import forms
+from django.core import exceptions, validators
+from django.db import connection, models
+from django.db.models import ExpressionWrapper, Value
+from django.db.models.functions import Cast, Coalesce
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+DECIMAL_PLACES = 2
+MINOR_UNITS = 10 ** DECIMAL_PLACES
+CENT = Decimal(1).scaleb(-DECIMAL_PLACES)
+AVERAGE_DECIMAL_PLACES = DECIMAL_PLACES + 2  # Averages of amounts keep fractions of a cent
+MAX_DIGITS = 30
+
+
+def to_minor_units(amount):
+    """
+    Integer number of minor units of an amount, rounded half up to whole cents.
+    """
+    if isinstance(amount, int):
+        return amount * MINOR_UNITS
+    return int((Decimal(str(amount)) * MINOR_UNITS).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(minor_units):
+    """
+    Decimal amount of a number of minor units.
+    """
+    return Decimal(int(minor_units)).scaleb(-DECIMAL_PLACES)
+
+
+class AmountField(models.DecimalField):
+    """
+    Output field of `as_money`: exact Decimal amounts with the same number of places on every database
+    (SQLite has no numeric type and returns the shortest decimal of its result).
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return Decimal(value).quantize(Decimal(1).scaleb(-self.decimal_places), rounding=ROUND_HALF_UP)
+
+
+def average_amount(minor_units, count):
+    """
+    Decimal average in major units, with AVERAGE_DECIMAL_PLACES places, of `count` amounts that sum to `minor_units`.
+    """
+    average = (Decimal(int(minor_units)) / count).scaleb(-DECIMAL_PLACES)
+    return average.quantize(Decimal(1).scaleb(-AVERAGE_DECIMAL_PLACES), rounding=ROUND_HALF_UP)
+
+
+def as_money(expression, decimal_places=DECIMAL_PLACES, default=None):
+    """
+    The result of an expression in minor units (a Sum, an Avg, ...) as a Decimal amount in major units with
+    `decimal_places` places (AVERAGE_DECIMAL_PLACES for averages), `default` instead of NULL.
+    The conversion is a numeric multiplication in the database, sums stay exact.
+    """
+    output_field = AmountField(max_digits=MAX_DIGITS, decimal_places=decimal_places)
+    amount = Cast(ExpressionWrapper(expression * Value(CENT), output_field=output_field), output_field)
+    if default is not None:
+        amount = Coalesce(amount, Value(Decimal(default)), output_field=output_field)
+    return amount
+
+
+class MoneyField(models.BigIntegerField):
+    """
+    Amount of money stored as a bigint of minor units and presented as a Decimal with DECIMAL_PLACES places.
+    """
+    description = 'Amount of money in minor units'
+    default_error_messages = {
+        'invalid': _('“%(value)s” value must be a decimal number.'),
+    }
+
+    @cached_property
+    def validators(self):
+        # The range of the bigint column, in major units like the values that are validated
+        min_value, max_value = connection.ops.integer_field_range(self.get_internal_type())
+        range_validators = []
+        if min_value is not None:
+            range_validators.append(validators.MinValueValidator(from_minor_units(min_value)))
+        if max_value is not None:
+            range_validators.append(validators.MaxValueValidator(from_minor_units(max_value)))
+        return [*self.default_validators, *self._validators, *range_validators]
+
+    def from_db_value(self, value, expression, connection):
+        if value is None:
+            return value
+        return from_minor_units(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        try:
+            return Decimal(str(value)).quantize(CENT)
+        except ArithmeticError:
+            raise exceptions.ValidationError(self.error_messages['invalid'], code='invalid', params={'value': value})
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return to_minor_units(value)
+
+    def formfield(self, **kwargs):
+        return models.Field.formfield(self, **{'form_class': forms.DecimalField, 'decimal_places': DECIMAL_PLACES,
+                                               **kwargs})
@@ -0,0 +1,147 @@
+"""
+Transactional outbox of the sales and the Redis Stream downstream systems (loyalty, BI) consume them from.
+
+create_transaction writes a compact sale event to the OutboxEvent table in the same database transaction as the sale,
+so there is an event for every committed sale and none for a rolled back one. The relay
+(`python manage.py relay_outbox`) publishes the unpublished events in batches to the SALES_STREAM stream and marks
+them published. Delivery is at least once: when the relay dies between publishing a batch and marking it, the batch is
+published again, consumers skip events whose `event_id` they have seen.
+
+The order of the stream is only approximately the order of the sales. Event ids are assigned at INSERT but checkouts
+commit in any order, so an event with a lower id can become visible after a higher one was published, and several
+relays publish their batches side by side. Consumers must not rely on the order of the `event_id`s, only dedupe them.
+
+Consumers read the stream incrementally with consumer groups (XREADGROUP and XACK, see `read_sales_events`), each group
+at its own offset; `create_consumer_group` starts a group at any stream id and so replays the events from there.
+The stream keeps the last OUTBOX_STREAM_MAXLEN events.
+"""
+import json
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.db.models import Min
+from django.utils import timezone
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from .metrics import OUTBOX_BACKLOG, OUTBOX_BACKLOG_AGE, OUTBOX_PUBLISHED, SALES_STREAM_LAG, SALES_STREAM_PENDING
+from .models import OutboxEvent
+
+db_logger = logging.getLogger('db')
+
+SALES_STREAM = 'sales_stream'
+
+
+def add_sale_event(transaction, bill_items):
+    """
+    Write the outbox event of a sale, in the database transaction of the sale.
+    Amounts are decimal strings, like in the apis.
+    """
+    return OutboxEvent.objects.create(event_type=OutboxEvent.SALE, payload={
+        'transaction_id': str(transaction.transaction_id),
+        'time': transaction.transaction_time.isoformat(),
+        'total_amount': str(transaction.total_amount),
+        'items': [[bill_item.item_id, bill_item.quantity, str(bill_item.unit_price)] for bill_item in bill_items],
+    })
+
+
+def publish_outbox(batch_size=None):
+    """
+    Publish the next batch of unpublished events to the sales stream and mark them published, returns their number.
+    The batch stays locked until it is marked, concurrent relays skip the locked events and publish other batches.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    with db_transaction.atomic():
+        events = list(OutboxEvent.objects.select_for_update(skip_locked=True).filter(published_at__isnull=True)
+                      .order_by('id')[:batch_size])
+        if not events:
+            return 0
+        with get_redis_connection('default').pipeline(transaction=False) as pipe:
+            for event in events:
+                pipe.xadd(SALES_STREAM, {
+                    'event_id': event.id,
+                    'event_type': event.event_type,
+                    'payload': json.dumps(event.payload, separators=(',', ':')),
+                }, maxlen=settings.OUTBOX_STREAM_MAXLEN, approximate=True)
+            pipe.execute()
+        OutboxEvent.objects.filter(id__in=[event.id for event in events]).update(published_at=timezone.now())
+    OUTBOX_PUBLISHED.inc(len(events))
+    return len(events)
+
+
+def purge_outbox():
+    """
+    Delete the events that were published more than OUTBOX_RETENTION seconds ago, the stream keeps them for replays.
+    """
+    published_before = timezone.now() - timedelta(seconds=settings.OUTBOX_RETENTION)
+    return OutboxEvent.objects.filter(published_at__lt=published_before).delete()[0]
+
+
+def update_outbox_metrics():
+    """
+    Set the backlog of the outbox and the lag of every consumer group of the sales stream.
+    """
+    backlog = OutboxEvent.objects.filter(published_at__isnull=True)
+    oldest = backlog.aggregate(oldest=Min('created_at'))['oldest']
+    OUTBOX_BACKLOG.set(backlog.count())
+    OUTBOX_BACKLOG_AGE.set((timezone.now() - oldest).total_seconds() if oldest else 0)
+    for group in consumer_groups():
+        SALES_STREAM_PENDING.labels(group=group['name']).set(group['pending'])
+        if group['lag'] is not None:  # Unknown before Redis 7 and after the stream was trimmed past the group
+            SALES_STREAM_LAG.labels(group=group['name']).set(group['lag'])
+
+
+def consumer_groups():
+    """
+    The consumer groups of the sales stream with their offset (last delivered id), events delivered but not
+    acknowledged (pending) and events not delivered yet (lag).
+    """
+    try:
+        groups = get_redis_connection('default').xinfo_groups(SALES_STREAM)
+    except ResponseError:  # No stream yet
+        return []
+    return [{
+        'name': group['name'].decode(),
+        'last_delivered_id': group['last-delivered-id'].decode(),
+        'pending': group['pending'],
+        'lag': group.get('lag'),
+    } for group in groups]
+
+
+def create_consumer_group(group, offset='$'):
+    """
+    Create a consumer group that reads the events after `offset` (a stream id, '0' for every event in the stream,
+    '$' for new events only), or move an existing group to `offset` to replay the events after it.
+    """
+    redis = get_redis_connection('default')
+    try:
+        redis.xgroup_create(SALES_STREAM, group, id=offset, mkstream=True)
+    except ResponseError as e:
+        if 'BUSYGROUP' not in str(e):
+            raise
+        redis.xgroup_setid(SALES_STREAM, group, offset)
+
+
+def read_sales_events(group, consumer, count=100, block=None):
+    """
+    The next events of a consumer group for one of its consumers, as (stream_id, event) tuples.
+    Acknowledge them with `ack_sales_events` once processed, unacknowledged events stay pending for the consumer.
+    """
+    streams = get_redis_connection('default').xreadgroup(group, consumer, {SALES_STREAM: '>'}, count=count,
+                                                         block=block)
+    events = []
+    for _, entries in streams:
+        for stream_id, fields in entries:
+            events.append((stream_id.decode(), {
+                'event_id': int(fields[b'event_id']),
+                'event_type': fields[b'event_type'].decode(),
+                'payload': json.loads(fields[b'payload']),
+            }))
+    return events
+
+
+def ack_sales_events(group, stream_ids):
+    if stream_ids:
+        get_redis_connection('default').xack(SALES_STREAM, group, *stream_ids)
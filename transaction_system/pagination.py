@@ -0,0 +1,13 @@
+from rest_framework.pagination import CursorPagination
+
+
+class TransactionCursorPagination(CursorPagination):
+    """
+    Newest transactions first. The cursor holds the transaction_time of the page boundary (DRF encodes only the first
+    ordering field) plus an offset past the rows sharing that time, so every page is an index range scan of
+    transaction_time_id_idx, however deep the client pages. transaction_id only makes the order of equal times stable.
+    """
+    ordering = ('-transaction_time', '-transaction_id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,11 @@
+from rest_framework.permissions import BasePermission
+
+
+class IsStoreAdmin(BasePermission):
+    """
+    Allows access only to users with the `admin` flag, e.g. for voiding and refunding sales.
+    """
+    message = 'Only store admins can do this.'
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.admin)
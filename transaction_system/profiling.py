@@ -0,0 +1,120 @@
+"""
+Low overhead sampling profiler for single requests.
+
+A background thread looks at the stack of the profiled thread every PROFILING_INTERVAL seconds and counts
+the collapsed stacks. The result is stored in the flamegraph "folded" format (one `frame;frame;frame count`
+line per stack), which flamegraph.pl, speedscope and inferno read directly, next to a small JSON file
+with the request details.
+"""
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+
+from .authentication import authenticate
+
+
+class SamplingProfiler:
+
+    def __init__(self, thread_id=None, interval=0.005):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = self.stopped = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.stopped = time.perf_counter()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def save(self, directory, **details):
+        """
+        Write the folded stacks and the request details to `directory`, return the profile id.
+        """
+        os.makedirs(directory, exist_ok=True)
+        profile_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+        with open(os.path.join(directory, f'{profile_id}.folded'), 'w') as folded_file:
+            for stack, count in self.stacks.most_common():
+                folded_file.write(f'{stack} {count}\n')
+        with open(os.path.join(directory, f'{profile_id}.json'), 'w') as details_file:
+            json.dump({
+                'id': profile_id,
+                'duration': self.stopped - self.started,
+                'samples': self.samples,
+                'interval': self.interval,
+                **details,
+            }, details_file, indent=2)
+        return profile_id
+
+
+def list_profiles(directory):
+    """
+    Details of all captured profiles, newest first.
+    """
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for file_name in os.listdir(directory):
+        if file_name.endswith('.json'):
+            with open(os.path.join(directory, file_name)) as details_file:
+                profiles.append(json.load(details_file))
+    return sorted(profiles, key=lambda profile: profile['id'], reverse=True)
+
+
+def summarize_profile(directory, profile_id, limit=20):
+    """
+    Return the number of samples of a profile and its `limit` hottest frames as
+    (frame, self samples, total samples) tuples.
+    Self samples count the stacks a frame is on top of, total samples the stacks it appears in.
+    """
+    own, total = Counter(), Counter()
+    with open(os.path.join(directory, f'{profile_id}.folded')) as folded_file:
+        for line in folded_file:
+            stack, count = line.rsplit(' ', 1)
+            frames = stack.split(';')
+            own[frames[-1]] += int(count)
+            for frame in set(frames):
+                total[frame] += int(count)
+    return sum(own.values()), [(frame, own[frame], count) for frame, count in total.most_common(limit)]
+
+
+def should_profile(request):
+    """
+    Profile when an admin asks for it with the X-Profile header or when the request falls in the
+    PROFILING_SAMPLE_RATE share.
+    The header of other clients is ignored, so they cannot turn the profiler on.
+    """
+    if request.headers.get('X-Profile'):
+        # DRF only authenticates inside the view, after the profiler would have started.
+        user = authenticate(request)
+        if user is not None and user.admin:
+            return True
+    return random.random() < settings.PROFILING_SAMPLE_RATE
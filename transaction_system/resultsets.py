@@ -0,0 +1,99 @@
+"""
+Columnar result sets of the analytics queries.
+
+A queryset's rows are read with `values_list` in chunks straight into typed NumPy arrays instead of a list of dicts
+with a copy of every key per row. Columns with few distinct values (item names, categories, dates) are dictionary
+encoded: an int32 code per row and the distinct values once, which pandas takes over as a Categorical without
+copying the strings.
+"""
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+CHUNK_SIZE = 10000
+
+# Kinds of columns
+CATEGORY = 'category'  # Dictionary encoded
+INTEGER = 'integer'
+FLOAT = 'float'
+
+DTYPES = {CATEGORY: np.int32, INTEGER: np.int64, FLOAT: np.float64}
+
+
+class ResultSet:
+    """
+    Rows of a query as one NumPy array per column, `columns` maps the column names to their kind.
+    Dictionary encoded columns keep their codes in `arrays` and their distinct values in `categories`.
+    """
+
+    def __init__(self, columns, arrays, categories):
+        self.columns = columns
+        self.arrays = arrays
+        self.categories = categories
+
+    @classmethod
+    def from_queryset(cls, queryset, columns, chunk_size=CHUNK_SIZE):
+        """
+        Read the `columns` ({name: kind}, the names are fields or annotations of the queryset) of every row.
+        """
+        names = list(columns)
+        lookups = {name: {} for name, kind in columns.items() if kind == CATEGORY}
+        chunks = {name: [] for name in names}
+        rows = queryset.values_list(*names).iterator(chunk_size=chunk_size)
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            for name, values in zip(names, zip(*chunk)):
+                if name in lookups:
+                    lookup = lookups[name]
+                    values = [lookup.setdefault(value, len(lookup)) for value in values]
+                chunks[name].append(np.array(values, dtype=DTYPES[columns[name]]))
+
+        arrays = {name: np.concatenate(chunks[name]) if chunks[name] else np.empty(0, dtype=DTYPES[columns[name]])
+                  for name in names}
+        return cls(columns, arrays, {name: list(lookup) for name, lookup in lookups.items()})
+
+    @classmethod
+    def from_frame(cls, frame, columns):
+        """
+        The `columns` ({name: kind}) of a DataFrame.
+        """
+        arrays, categories = {}, {}
+        for name, kind in columns.items():
+            if kind == CATEGORY:
+                codes, uniques = pd.factorize(frame[name])
+                arrays[name] = codes.astype(DTYPES[kind])
+                categories[name] = list(uniques)
+            else:
+                arrays[name] = frame[name].to_numpy(dtype=DTYPES[kind])
+        return cls(columns, arrays, categories)
+
+    def __len__(self):
+        return len(next(iter(self.arrays.values()))) if self.arrays else 0
+
+    def __iter__(self):
+        """
+        The rows as dicts, built one at a time.
+        """
+        names = list(self.columns)
+        columns = [self.arrays[name].tolist() for name in names]
+        for name in self.categories:
+            position = names.index(name)
+            categories = self.categories[name]
+            columns[position] = [categories[code] for code in columns[position]]
+        for row in zip(*columns):
+            yield dict(zip(names, row))
+
+    def to_frame(self):
+        """
+        The rows as a DataFrame, which shares the arrays of the result set.
+        """
+        data = {}
+        for name in self.columns:
+            if name in self.categories:
+                data[name] = pd.Categorical.from_codes(self.arrays[name], categories=self.categories[name])
+            else:
+                data[name] = self.arrays[name]
+        return pd.DataFrame(data, columns=list(self.columns), copy=False)
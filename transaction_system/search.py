@@ -0,0 +1,176 @@
+"""
+Item search by code prefix, name substring and fuzzy trigram similarity, for the POS item lookup.
+
+On PostgreSQL the matching runs against the pg_trgm GIN indexes on UPPER(name) and UPPER(item_code)
+(migration 0005), which serve the `%` similarity operator as well as LIKE '%term%' and 'term%'.
+Other databases (SQLite in development and tests) and PostgreSQL servers without pg_trgm use an in-memory trigram
+index of the catalog with the same trigrams, similarity and ranking, rebuilt every ITEM_SEARCH_INDEX_TTL seconds.
+
+Results are ranked: exact item code, item code prefix, name prefix, name substring, then by similarity.
+"""
+import bisect
+import re
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+from django.conf import settings
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.functions import Upper
+
+from .instrumentation import timed_stage
+from .models import Item
+
+SIMILARITY_THRESHOLD = 0.3  # pg_trgm's default pg_trgm.similarity_threshold
+MIN_FUZZY_LENGTH = 3  # Shorter terms only match code and name prefixes
+
+WORD = re.compile(r'[^\W_]+')
+
+
+def trigrams(text):
+    """
+    The trigrams of a text the way pg_trgm extracts them: lower case words padded with two spaces
+    in front and one at the end.
+    """
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        word = f'  {word} '
+        grams.update(word[i:i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+class NgramIndex:
+    """
+    In-memory trigram index of the item codes and names, posting lists of numpy arrays so that a search
+    is a few vectorized operations over the positions of the catalog.
+    """
+
+    def __init__(self, items):
+        self.item_codes, codes, self.names = [], [], []
+        postings = defaultdict(list)  # Trigram -> positions of the names that contain it
+        sizes = []
+        for position, (code, name) in enumerate(items):
+            self.item_codes.append(code)
+            codes.append(code.upper())
+            self.names.append(name.upper())
+            name_grams = trigrams(name)
+            sizes.append(len(name_grams))
+            for gram in name_grams:
+                postings[gram].append(position)
+        self.grams = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+        self.sizes = np.array(sizes, dtype=float)
+        self.positions = {code: position for position, code in enumerate(codes)}
+        self.code_order = sorted(range(len(codes)), key=codes.__getitem__)
+        self.sorted_codes = [codes[position] for position in self.code_order]
+        self.name_order = sorted(range(len(self.names)), key=self.names.__getitem__)
+        self.sorted_names = [self.names[position] for position in self.name_order]
+        self.name_rank = np.empty(len(self.names), dtype=np.int64)
+        self.name_rank[self.name_order] = np.arange(len(self.names))
+        self.built_at = time.monotonic()
+
+    @staticmethod
+    def _prefixed(sorted_values, order, term):
+        start = bisect.bisect_left(sorted_values, term)
+        end = bisect.bisect_left(sorted_values, term + '\uffff', start)
+        return np.array(order[start:end], dtype=np.int64)
+
+    def _shared(self, grams):
+        postings = [self.grams[gram] for gram in grams if gram in self.grams]
+        if not postings:
+            return np.zeros(len(self.names), dtype=np.int64)
+        return np.bincount(np.concatenate(postings), minlength=len(self.names))
+
+    def search(self, term, limit):
+        """
+        Item codes of the best `limit` matches of a term.
+        """
+        term = term.upper()
+        rank = np.full(len(self.names), 5)  # 5: no match
+        similarity = np.zeros(len(self.names))
+        if len(term) >= MIN_FUZZY_LENGTH:
+            term_grams = trigrams(term)
+            shared = self._shared(term_grams)
+            similarity = shared / (len(term_grams) + self.sizes - shared)
+            rank[similarity >= SIMILARITY_THRESHOLD] = 4
+            # A name that contains the term contains all of its trigrams that are not padded word boundaries
+            inner = [gram for gram in term_grams if ' ' not in gram]
+            possible = np.flatnonzero(self._shared(inner) >= len(inner) if inner else shared > 0)
+            rank[[position for position in possible if term in self.names[position]]] = 3
+        rank[self._prefixed(self.sorted_names, self.name_order, term)] = 2
+        rank[self._prefixed(self.sorted_codes, self.code_order, term)] = 1
+        if term in self.positions:
+            rank[self.positions[term]] = 0
+
+        candidates = np.flatnonzero(rank < 5)
+        best = np.lexsort((self.name_rank[candidates], -similarity[candidates], rank[candidates]))[:limit]
+        return [self.item_codes[position] for position in candidates[best]]
+
+
+def trigram_support(alias):
+    """
+    Whether the pg_trgm extension is installed in a PostgreSQL database, checked once per process.
+    """
+    if alias not in _trigram_support:
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+            _trigram_support[alias] = cursor.fetchone() is not None
+    return _trigram_support[alias]
+
+
+_trigram_support = {}
+_index = None
+_index_lock = threading.Lock()
+
+
+def item_index():
+    """
+    The in-memory index of the catalog, rebuilt when it is older than ITEM_SEARCH_INDEX_TTL seconds.
+    """
+    global _index
+    with _index_lock:
+        if _index is None or time.monotonic() - _index.built_at > settings.ITEM_SEARCH_INDEX_TTL:
+            _index = NgramIndex(Item.objects.values_list('item_code', 'name').iterator(chunk_size=10000))
+        return _index
+
+
+def clear_item_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+@timed_stage('search')
+def search_items(term, limit=10):
+    """
+    The `limit` best matching items of a search term, best first.
+    """
+    term = term.strip()
+    if connection.vendor != 'postgresql' or not trigram_support(connection.alias):
+        item_codes = item_index().search(term, limit)
+        items = Item.objects.in_bulk(item_codes)
+        return [items[code] for code in item_codes if code in items]
+
+    term = term.upper()
+    matches = Q(upper_code__startswith=term) | Q(upper_name__startswith=term)
+    if len(term) >= MIN_FUZZY_LENGTH:
+        matches |= Q(upper_name__contains=term) | Q(upper_name__trigram_similar=term)
+    return list(
+        Item.objects.annotate(upper_code=Upper('item_code'), upper_name=Upper('name'))
+        .filter(matches)
+        .annotate(
+            rank=Case(
+                When(upper_code=term, then=Value(0)),
+                When(upper_code__startswith=term, then=Value(1)),
+                When(upper_name__startswith=term, then=Value(2)),
+                When(upper_name__contains=term, then=Value(3)),
+                default=Value(4),
+                output_field=IntegerField(),
+            ),
+            similarity=TrigramSimilarity('upper_name', term),
+        )
+        .order_by('rank', '-similarity', 'name')[:limit]
+    )
@@ -1,19 +1,38 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Item, Transaction, BillItem
+from .models import Item, Transaction, BillItem, Refund, RefundLine
+from .admission import estimated_bill_lines
+from .leaderboard import MAX_HOURS
+from .money import DECIMAL_PLACES, MoneyField
 
-class ItemSerializer(serializers.ModelSerializer):
+
+class MoneySerializerField(serializers.DecimalField):
+    """
+    Amounts of MoneyField columns, presented as decimals like the numeric columns they replaced.
+    """
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_digits', 18)
+        kwargs.setdefault('decimal_places', DECIMAL_PLACES)
+        super().__init__(**kwargs)
+
+
+class ModelSerializer(serializers.ModelSerializer):
+    serializer_field_mapping = {**serializers.ModelSerializer.serializer_field_mapping, MoneyField: MoneySerializerField}
+
+
+class ItemSerializer(ModelSerializer):
     class Meta:
         model = Item
         fields = ['item_code', 'name', 'price', 'starting_quantity', 'current_quantity', 'category']
 
-class BillItemSerializer(serializers.ModelSerializer):
+class BillItemSerializer(ModelSerializer):
     item = ItemSerializer()
 
     class Meta:
         model = BillItem
         fields = ['item', 'quantity', 'unit_price']
 
-class TransactionSerializer(serializers.ModelSerializer):
+class TransactionSerializer(ModelSerializer):
     bill_items = BillItemSerializer(many=True, read_only=True)
 
     class Meta:
@@ -21,6 +40,38 @@ class TransactionSerializer(serializers.ModelSerializer):
         fields = ['transaction_id', 'transaction_date', 'total_amount', 'bill_items']
 
 
+class RefundLineSerializer(ModelSerializer):
+    item_code = serializers.CharField(source='item_id')
+
+    class Meta:
+        model = RefundLine
+        fields = ['item_code', 'quantity', 'unit_price']
+
+class RefundSerializer(ModelSerializer):
+    lines = RefundLineSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Refund
+        fields = ['refund_id', 'transaction_id', 'refund_date', 'total_amount', 'reason', 'lines']
+
+
+class ReceiptLineSerializer(ModelSerializer):
+    item_code = serializers.CharField(source='item_id')
+    name = serializers.CharField(source='item.name')
+
+    class Meta:
+        model = BillItem
+        fields = ['item_code', 'name', 'quantity', 'unit_price']
+
+class ReceiptSerializer(ModelSerializer):
+    bill_items = ReceiptLineSerializer(many=True, read_only=True)
+    refunds = RefundSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Transaction
+        fields = ['transaction_id', 'transaction_date', 'transaction_time', 'total_amount', 'bill_items', 'refunds']
+
+
 class SalesSummarySerializer(serializers.Serializer):
     total_sales = serializers.DecimalField(max_digits=10, decimal_places=2)
     total_items_sold = serializers.IntegerField()
@@ -61,7 +112,44 @@ class SalesTransactionSerializer(serializers.Serializer):
         return items
 
 
+class RefundItemSerializer(serializers.Serializer):
+    item_code = serializers.CharField(max_length=50)
+    quantity = serializers.IntegerField(min_value=1)
+
+class RefundTransactionSerializer(serializers.Serializer):
+    transaction_id = serializers.UUIDField()
+    items = RefundItemSerializer(many=True, required=False)  # Leave out to void the whole transaction
+
+class RefundRequestSerializer(serializers.Serializer):
+    transactions = RefundTransactionSerializer(many=True)
+    reason = serializers.CharField(max_length=255, required=False, default='')
+
+    def validate_transactions(self, transactions):
+        if not transactions:
+            raise serializers.ValidationError("At least one transaction is required for a refund.")
+        if len(transactions) > 1000:
+            raise serializers.ValidationError("At most 1000 transactions can be refunded at once.")
+        return transactions
+
+
+def query_cost(start_date, end_date):
+    """
+    Estimated bill lines of an analytics query of a date range, a validation error over ANALYTICS_MAX_BILL_LINES.
+    """
+    bill_lines = estimated_bill_lines(start_date, end_date)
+    if bill_lines > settings.ANALYTICS_MAX_BILL_LINES:
+        raise serializers.ValidationError(
+            f"The date range {start_date} - {end_date} covers about {bill_lines} sales lines, "
+            f"at most {settings.ANALYTICS_MAX_BILL_LINES} can be analyzed at once.")
+    return bill_lines
+
+
 class DateRangeSerializer(serializers.Serializer):
+    """
+    Date range of an analytics query, with the estimated number of bill lines the query reads as its cost.
+    Ranges over ANALYTICS_MAX_BILL_LINES are rejected, ranges over ANALYTICS_SYNC_MAX_BILL_LINES should not be
+    computed during the request (`runs_async`).
+    """
     start_date = serializers.DateField()
     end_date = serializers.DateField()
 
@@ -72,9 +160,71 @@ class DateRangeSerializer(serializers.Serializer):
         if start_date > end_date:
             raise serializers.ValidationError("start_date must be before end_date.")
 
+        self.estimated_bill_lines = query_cost(start_date, end_date)
+        return data
+
+    @property
+    def runs_async(self):
+        return self.estimated_bill_lines > settings.ANALYTICS_SYNC_MAX_BILL_LINES
+
+
+class TransactionHistoryRequestSerializer(serializers.Serializer):
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    start_time = serializers.DateTimeField(required=False)
+    end_time = serializers.DateTimeField(required=False)
+
+    def validate(self, data):
+        for start, end in (('start_date', 'end_date'), ('start_time', 'end_time')):
+            if start in data and end in data and data[start] > data[end]:
+                raise serializers.ValidationError(f"{start} must be before {end}.")
+        return data
+
+
+class MarketBasketRequestSerializer(DateRangeSerializer):
+    item_code = serializers.CharField(max_length=50, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+
+class SalesHeatmapRequestSerializer(DateRangeSerializer):
+    category = serializers.CharField(max_length=255, required=False)
+
+
+class StockForecastRequestSerializer(serializers.Serializer):
+    days = serializers.IntegerField(min_value=1, max_value=365, default=7)
+    category = serializers.CharField(max_length=255, required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=100)
+
+
+class StockHistoryRequestSerializer(serializers.Serializer):
+    item_codes = serializers.CharField()
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    def validate_item_codes(self, value):
+        item_codes = list(dict.fromkeys(item_code.strip() for item_code in value.split(',') if item_code.strip()))
+        if not item_codes or len(item_codes) > 100:
+            raise serializers.ValidationError("Between 1 and 100 comma separated item codes are required.")
+        return item_codes
+
+    def validate(self, data):
+        if data['start_date'] > data['end_date']:
+            raise serializers.ValidationError("start_date must be before end_date.")
+        if (data['end_date'] - data['start_date']).days >= 366:
+            raise serializers.ValidationError("The date range can be at most 366 days long.")
         return data
 
 
+class ItemSearchRequestSerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=100)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
+class TopSellersRequestSerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    hours = serializers.IntegerField(min_value=1, max_value=MAX_HOURS, required=False)
+
+
 class SalesComparisonRequestSerializer(serializers.Serializer):
     start_date_1 = serializers.DateField()
     end_date_1 = serializers.DateField()
@@ -92,4 +242,12 @@ class SalesComparisonRequestSerializer(serializers.Serializer):
         if start_date_2 > end_date_2:
             raise serializers.ValidationError("The second date range is invalid.")
 
-        return data
\ No newline at end of file
+        self.estimated_bill_lines = [query_cost(start_date_1, end_date_1), query_cost(start_date_2, end_date_2)]
+        return data
+
+    @property
+    def runs_async(self):
+        """
+        Per date range, whether its totals should be computed by a celery task instead of during the request.
+        """
+        return [bill_lines > settings.ANALYTICS_SYNC_MAX_BILL_LINES for bill_lines in self.estimated_bill_lines]
\ No newline at end of file
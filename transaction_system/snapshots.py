@@ -0,0 +1,82 @@
+"""
+Daily inventory snapshots: the stock of every item at the end of each day, for stock level history.
+
+Only the live `Item.current_quantity` is kept on the item, so the stock of a past day would have to be rebuilt by
+replaying every bill item and refund since. The nightly `snapshot_inventory` task instead writes one InventorySnapshot
+row per item for the day that just closed with a single `INSERT ... SELECT`: the current stock plus what was sold and
+minus what was refunded after the day ended, so a snapshot taken a few minutes after midnight is still exact. Stock
+received in those minutes counts for the closed day.
+
+`stock_history` reads the series of a range from the snapshots (one row per item and day, from the unique index) and
+takes today's stock from the items, its cost grows with days x items requested, not with the sales.
+"""
+from datetime import timedelta
+
+from django.db import connection
+from django.utils import timezone
+
+from RetailApp.db.routers import analytics_db
+from .models import BillItem, InventorySnapshot, Item, Refund, RefundLine, Transaction
+from .utils import ItemNotFound
+
+
+def snapshot_inventory(day):
+    """
+    Write the end of day stock of every item on `day` (a closed day), returns the number of snapshots written.
+    Snapshots that already exist are kept, so the task can run again.
+    """
+    day = connection.ops.adapt_datefield_value(day)
+    with connection.cursor() as cursor:
+        # WHERE TRUE keeps SQLite from reading ON CONFLICT as a join constraint
+        cursor.execute(
+            f'INSERT INTO {InventorySnapshot._meta.db_table} (item_id, snapshot_date, quantity) '
+            f'SELECT item.item_code, %s, item.current_quantity + COALESCE(sold.quantity, 0) '
+            f'- COALESCE(refunded.quantity, 0) '
+            f'FROM {Item._meta.db_table} AS item '
+            f'LEFT JOIN (SELECT bill_item.item_id, SUM(bill_item.quantity) AS quantity '
+            f'FROM {BillItem._meta.db_table} AS bill_item JOIN {Transaction._meta.db_table} AS sale '
+            f'ON sale.transaction_id = bill_item.transaction_id WHERE sale.transaction_date > %s '
+            f'GROUP BY bill_item.item_id) AS sold ON sold.item_id = item.item_code '
+            f'LEFT JOIN (SELECT line.item_id, SUM(line.quantity) AS quantity '
+            f'FROM {RefundLine._meta.db_table} AS line JOIN {Refund._meta.db_table} AS refund '
+            f'ON refund.refund_id = line.refund_id WHERE refund.refund_date > %s '
+            f'GROUP BY line.item_id) AS refunded ON refunded.item_id = item.item_code '
+            f'WHERE TRUE '
+            f'ON CONFLICT (item_id, snapshot_date) DO NOTHING',
+            [day, day, day],
+        )
+        return cursor.rowcount
+
+
+def stock_history(item_codes, start_date, end_date):
+    """
+    Daily stock of the items in a date range: the dates (up to today) and per item its quantities on those dates,
+    None for a day without a snapshot. Today's quantity is the live stock.
+    """
+    today = timezone.now().date()
+    end_date = min(end_date, today)
+    db = analytics_db(end_date)
+
+    items = {item_code: (name, quantity) for item_code, name, quantity in Item.objects.using(db)
+             .filter(item_code__in=item_codes).values_list('item_code', 'name', 'current_quantity')}
+    missing = [item_code for item_code in item_codes if item_code not in items]
+    if missing:
+        raise ItemNotFound(f"Items not found: {', '.join(missing)}.")
+
+    dates = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    positions = {day: position for position, day in enumerate(dates)}
+    quantities = {item_code: [None] * len(dates) for item_code in item_codes}
+    snapshots = InventorySnapshot.objects.using(db) \
+        .filter(item_id__in=item_codes, snapshot_date__range=(start_date, end_date)) \
+        .values_list('item_id', 'snapshot_date', 'quantity')
+    for item_code, snapshot_date, quantity in snapshots:
+        quantities[item_code][positions[snapshot_date]] = quantity
+    if dates and dates[-1] == today:
+        for item_code in item_codes:
+            quantities[item_code][-1] = items[item_code][1]
+
+    return {
+        'dates': dates,
+        'items': [{'item_code': item_code, 'name': items[item_code][0], 'quantities': quantities[item_code]}
+                  for item_code in item_codes],
+    }
@@ -1,3 +1,7 @@
+from datetime import date, timedelta
+
+from celery import chord
+from django.conf import settings
 from django.utils import timezone
 
 from django.core.cache import cache
@@ -5,7 +9,18 @@ from django.core.cache import cache
 from RetailApp.celery import app
 import logging
 
-from transaction_system.utils import get_sales_summary_for_day
+from transaction_system.utils import get_sales_summary_for_day, get_avg_sales_summary, get_trend_analysis, \
+    get_sales_data_for_date_range, get_sales_report
+from transaction_system.caching import AVERAGE_SALES_TIMEOUT, TREND_ANALYSIS_TIMEOUT, SALES_RANGE_TIMEOUT, \
+    MARKET_BASKET_TIMEOUT, ANALYTICS_TASK_TIME_LIMIT, average_sales_cache_key, trend_analysis_cache_key, sales_range_cache_key, \
+    STOCK_FORECAST_TIMEOUT, STOCK_FORECAST_CACHE_KEY, market_basket_cache_key, market_basket_lock_key, popular_ranges, \
+    SALES_REPORT_TIMEOUT, sales_report_cache_key, sales_report_lock_key, trend_analysis_lock_key, \
+    average_sales_lock_key, sales_range_lock_key
+from transaction_system.basket import market_basket
+from transaction_system.forecasting import forecast_stock_depletion
+from transaction_system.leaderboard import reconcile_leaderboard
+from transaction_system.snapshots import snapshot_inventory
+from transaction_system import metrics  # noqa: F401 - registers the celery task duration and failure metrics
 
 db_logger = logging.getLogger('db')
 
@@ -21,3 +36,180 @@ def cache_sales_data_for_current_data():
     summary = get_sales_summary_for_day(today)
     cache.set(cache_key, summary, timeout=60 * 5)  # Cache for 5 minutes
     return True
+
+
+@app.task
+def reconcile_leaderboards(day=None):
+    """
+    Rebuild the top-sellers leaderboards of a day (yesterday by default) from the bill items.
+    Scheduled nightly using celery beat scheduler, after the day is closed.
+    """
+    day = date.fromisoformat(day) if day else timezone.now().date() - timedelta(days=1)
+    return reconcile_leaderboard(day)
+
+
+def cache_warming_ranges():
+    """
+    The date ranges to prewarm for each kind of analytics: the last CACHE_WARMING_DAYS days, the same periods
+    right before them for the sales comparison, and the ranges that missed the cache most often.
+    """
+    today = timezone.now().date()
+    standard_ranges = [(today - timedelta(days=days - 1), today) for days in settings.CACHE_WARMING_DAYS]
+    previous_ranges = [(today - timedelta(days=2 * days - 1), today - timedelta(days=days))
+                       for days in settings.CACHE_WARMING_DAYS]
+
+    limit = settings.CACHE_WARMING_POPULAR_RANGES
+    return {
+        'average_sales': set(standard_ranges + popular_ranges('average_sales', limit)),
+        'trend_analysis': set(standard_ranges + popular_ranges('trend_analysis', limit)),
+        'sales_range': set(standard_ranges + previous_ranges + popular_ranges('sales_range', limit)),
+    }
+
+
+@app.task
+def warm_average_sales(start_date, end_date):
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    cache.set(average_sales_cache_key(start_date, end_date), get_avg_sales_summary(start_date, end_date),
+              timeout=AVERAGE_SALES_TIMEOUT)
+    return 'average_sales'
+
+
+@app.task
+def warm_trend_analysis(start_date, end_date):
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    cache.set(trend_analysis_cache_key(start_date, end_date), get_trend_analysis(start_date, end_date),
+              timeout=TREND_ANALYSIS_TIMEOUT)
+    return 'trend_analysis'
+
+
+@app.task
+def warm_sales_range(start_date, end_date):
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    cache.set(sales_range_cache_key(start_date, end_date), get_sales_data_for_date_range(start_date, end_date),
+              timeout=SALES_RANGE_TIMEOUT)
+    return 'sales_range'
+
+
+WARMING_TASKS = {
+    'average_sales': warm_average_sales,
+    'trend_analysis': warm_trend_analysis,
+    'sales_range': warm_sales_range,
+}
+
+
+@app.task
+def warm_sales_caches():
+    """
+    Prewarm the cached analytics of the standard and the popular date ranges in parallel, under the keys the views read.
+    Scheduled with celery beat more often than the cached values expire, so users never hit a cold cache for them.
+    """
+    header = [
+        WARMING_TASKS[kind].si(start_date.isoformat(), end_date.isoformat())
+        for kind, ranges in cache_warming_ranges().items()
+        for start_date, end_date in sorted(ranges)
+    ]
+    chord(header)(cache_warming_finished.s())
+    return len(header)
+
+
+@app.task
+def snapshot_inventory_levels(day=None):
+    """
+    Write the end of day stock of every item on a day (yesterday by default) for the stock-history api.
+    Scheduled right after midnight using celery beat scheduler.
+    """
+    day = date.fromisoformat(day) if day else timezone.now().date() - timedelta(days=1)
+    return snapshot_inventory(day)
+
+
+@app.task
+def cache_warming_finished(results):
+    counts = {kind: results.count(kind) for kind in WARMING_TASKS}
+    db_logger.info('cache warming finished: %s', counts)
+    return counts
+
+
+@app.task(time_limit=ANALYTICS_TASK_TIME_LIMIT)
+def compute_market_basket(start_date, end_date):
+    """
+    Compute the item co-occurrences of a date range into the cache read by the market-basket api.
+    Runs on the batch queue, the api enqueues it for ranges that are too long to compute during the request.
+    """
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    try:
+        result = market_basket(start_date, end_date)
+        cache.set(market_basket_cache_key(start_date, end_date), result, timeout=MARKET_BASKET_TIMEOUT)
+    finally:
+        cache.delete(market_basket_lock_key(start_date, end_date))
+    return result['baskets']
+
+
+@app.task(time_limit=ANALYTICS_TASK_TIME_LIMIT)
+def compute_average_sales(start_date, end_date):
+    """
+    Compute the average sales summary of a date range into the cache read by the average-sales api.
+    Runs on the batch queue, the api enqueues it for ranges with too many sales lines to summarize during the request.
+    """
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    try:
+        summary = get_avg_sales_summary(start_date, end_date)
+        cache.set(average_sales_cache_key(start_date, end_date), summary, timeout=AVERAGE_SALES_TIMEOUT)
+    finally:
+        cache.delete(average_sales_lock_key(start_date, end_date))
+    return len(summary['items'])
+
+
+@app.task(time_limit=ANALYTICS_TASK_TIME_LIMIT)
+def compute_sales_range(start_date, end_date):
+    """
+    Compute the sales totals of a date range into the cache read by the sales-comparison api.
+    Runs on the batch queue, the api enqueues it for ranges with too many sales lines to total during the request.
+    """
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    try:
+        sales_data = get_sales_data_for_date_range(start_date, end_date)
+        cache.set(sales_range_cache_key(start_date, end_date), sales_data, timeout=SALES_RANGE_TIMEOUT)
+    finally:
+        cache.delete(sales_range_lock_key(start_date, end_date))
+    return sales_data['total_quantity_sold']
+
+
+@app.task(time_limit=ANALYTICS_TASK_TIME_LIMIT)
+def compute_trend_analysis(start_date, end_date):
+    """
+    Compute the trend analysis of a date range into the cache read by the trend-analysis api.
+    Runs on the batch queue, the api enqueues it for ranges with too many sales lines to analyze during the request.
+    """
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    try:
+        trend_data = get_trend_analysis(start_date, end_date)
+        cache.set(trend_analysis_cache_key(start_date, end_date), trend_data, timeout=TREND_ANALYSIS_TIMEOUT)
+    finally:
+        cache.delete(trend_analysis_lock_key(start_date, end_date))
+    return len(trend_data)
+
+
+@app.task(time_limit=ANALYTICS_TASK_TIME_LIMIT)
+def export_sales_report(start_date, end_date):
+    """
+    Generate the CSV sales report of a date range into the cache read by the sales-report api.
+    Runs on the batch queue, the api enqueues it for ranges with too many sales lines to export during the request.
+    """
+    start_date, end_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+    try:
+        report = get_sales_report(start_date, end_date)
+        cache.set(sales_report_cache_key(start_date, end_date), report, timeout=SALES_REPORT_TIMEOUT)
+    finally:
+        cache.delete(sales_report_lock_key(start_date, end_date))
+    return len(report)
+
+
+@app.task
+def forecast_stock():
+    """
+    Precompute the stock depletion forecast of the whole catalog for the stock-forecast api.
+    Scheduled every 15 mins using celery beat scheduler.
+    """
+    forecast = forecast_stock_depletion()
+    cache.set(STOCK_FORECAST_CACHE_KEY, forecast, timeout=STOCK_FORECAST_TIMEOUT)
+    return len(forecast['items'])
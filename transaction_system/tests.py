@@ -1,12 +1,57 @@
 import base64
+import json
+import uuid
+import tempfile
+import time
+from pathlib import Path
+from io import StringIO
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from unittest import mock, skipUnless
 
 from django.test import TestCase
-from .utils import parse_date_range, calculate_total_amount, create_transaction
+from .utils import parse_date_range, calculate_total_amount, create_transaction, get_sales_data_for_date_range, \
+    get_sales_heatmap, undo_transaction, get_sales_summary_for_day, get_sales_data, \
+    get_sales_data_by_item, get_trend_analysis, get_avg_sales_summary, refund_transactions, InsufficientStock
 from django.core.exceptions import ValidationError
 from datetime import datetime
 from rest_framework.test import APITestCase
 from django.urls import reverse
-from .models import Item, Users
+from django.conf import settings
+from django.test import override_settings, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import DatabaseError, connection, connections
+from django.utils import timezone
+from RetailApp.db.routers import PrimaryReplicaRouter, analytics_db
+from prometheus_client import REGISTRY
+from .profiling import list_profiles
+from rest_framework.authtoken.models import Token
+from .models import Item, Transaction, Refund, Users, OutboxEvent, InventorySnapshot
+from .outbox import SALES_STREAM, ack_sales_events, create_consumer_group, publish_outbox, purge_outbox, \
+    read_sales_events, update_outbox_metrics
+from .management.commands.benchmark_analytics import compare_with_baseline
+from django.core.cache import cache
+from RetailApp.celery import app
+from .caching import average_sales_cache_key, trend_analysis_cache_key, sales_range_cache_key, record_cache_miss, \
+    popular_ranges, market_basket_cache_key, market_basket_lock_key, TASK_LOCK_TIMEOUT, \
+    trend_analysis_lock_key
+from .tasks import warm_average_sales, warm_sales_range, warm_sales_caches, compute_market_basket, forecast_stock, \
+    compute_trend_analysis, export_sales_report, snapshot_inventory_levels, compute_average_sales, compute_sales_range
+from .forecasting import ewma_weights, forecast_stock_depletion
+from .basket import _transaction_chunks, co_occurrence, market_basket
+from .leaderboard import day_key, top_sellers, reconcile_leaderboard
+from .live import SALES_EVENTS_CHANNEL, SalesFeed
+from .inventory import InventoryError, _current_catalog, apply_inventory_changes, read_inventory_file
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from .search import clear_item_index, trigrams
+from .snapshots import stock_history
+from .money import from_minor_units, to_minor_units
+from .archive import archive_day, archived_months, archived_sales, months_to_archive
+from .admission import AdmissionClass, Rejected, estimated_bill_lines, get_admission_class
+from django_redis import get_redis_connection
+from decimal import Decimal
 
 
 
@@ -47,6 +92,16 @@ class TestUtilityFunctions(TestCase):
         self.assertEqual(item1.current_quantity, 48)
 
 
+    def test_compare_with_baseline(self):
+        baseline = {'get_sales_data': {'wall_time': 1.0, 'peak_memory': 100, 'queries': 3}}
+        within_tolerance = {'get_sales_data': {'wall_time': 1.2, 'peak_memory': 100, 'queries': 3},
+                            'calculate_manual_trend': {'wall_time': 9.0, 'peak_memory': 9, 'queries': 0}}
+        self.assertEqual(compare_with_baseline(within_tolerance, baseline, tolerance=0.25), [])
+
+        slower = {'get_sales_data': {'wall_time': 2.0, 'peak_memory': 100, 'queries': 4}}
+        regressions = compare_with_baseline(slower, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 2)
+
 
 class TransactionAPITests(APITestCase):
 
@@ -136,3 +191,1099 @@ class ItemTransactionIntegrationTests(APITestCase):
         # Step 3: Check if item stock is updated
         item.refresh_from_db()
         self.assertEqual(item.current_quantity, 45)
+
+
+class ServerTimingMiddlewareTests(APITestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, starting_quantity=100, current_quantity=50)
+        self.user = Users.objects.create_user(username='testuser', password='testpass')
+        self.credentials = base64.b64encode(b'testuser:testpass').decode('utf-8')
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=1.0)
+    def test_sampled_request_has_server_timing(self):
+        url = reverse('item-details', args=['P001'])
+        response = self.client.get(url, HTTP_AUTHORIZATION='Basic ' + self.credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('render;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0.0)
+    def test_unsampled_request_has_no_server_timing(self):
+        url = reverse('item-details', args=['P001'])
+        response = self.client.get(url, HTTP_AUTHORIZATION='Basic ' + self.credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Server-Timing'))
+
+
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, starting_quantity=100, current_quantity=50)
+        self.user = Users.objects.create_user(username='testuser', password='testpass')
+        self.credentials = base64.b64encode(b'testuser:testpass').decode('utf-8')
+
+    def checkout_count(self, outcome):
+        return REGISTRY.get_sample_value('retail_checkout_total', {'outcome': outcome}) or 0
+
+    def test_checkout_outcomes_are_counted(self):
+        url = reverse('add-sales')
+        before = {outcome: self.checkout_count(outcome) for outcome in ('success', 'out_of_stock', 'missing_item')}
+        for quantity, item_code in ((2, 'P001'), (500, 'P001'), (1, 'P111')):
+            self.client.post(url, {'items': [{'item_code': item_code, 'quantity': quantity}]}, format='json',
+                             HTTP_AUTHORIZATION='Basic ' + self.credentials)
+        for outcome in before:
+            self.assertEqual(self.checkout_count(outcome), before[outcome] + 1)
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('item-details', args=['P001']), HTTP_AUTHORIZATION='Basic ' + self.credentials)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'retail_view_latency_seconds_bucket{', response.content)
+        self.assertIn(b'view="item-details"', response.content)
+
+
+class ProfilingMiddlewareTests(APITestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, starting_quantity=100, current_quantity=50)
+        Users.objects.create_user(username='testuser', password='testpass')
+        Users.objects.create_user(username='adminuser', password='testpass', admin=True)
+        self.profile_dir = tempfile.mkdtemp()
+
+    def get_item(self, username, **headers):
+        credentials = base64.b64encode(f'{username}:testpass'.encode()).decode('utf-8')
+        with self.settings(PROFILING_DIR=self.profile_dir):
+            return self.client.get(reverse('item-details', args=['P001']),
+                                   HTTP_AUTHORIZATION='Basic ' + credentials, **headers)
+
+    def test_admin_can_request_a_profile(self):
+        response = self.get_item('adminuser', HTTP_X_PROFILE='1')
+        self.assertEqual(response.status_code, 200)
+        profiles = list_profiles(self.profile_dir)
+        self.assertEqual([profile['id'] for profile in profiles], [response['X-Profile-Id']])
+        self.assertEqual(profiles[0]['view'], 'item-details')
+
+    def test_profile_header_is_ignored_for_other_users(self):
+        with mock.patch('transaction_system.middleware.SamplingProfiler') as profiler:
+            response = self.get_item('testuser', HTTP_X_PROFILE='1')
+            self.assertEqual(response.status_code, 200)
+            self.client.get(reverse('item-details', args=['P001']), HTTP_X_PROFILE='1')
+        profiler.assert_not_called()
+        self.assertFalse(response.has_header('X-Profile-Id'))
+        self.assertEqual(list_profiles(self.profile_dir), [])
+
+
+class AuthenticationTests(APITestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, starting_quantity=100, current_quantity=50)
+        self.user = Users.objects.create_user(username='testuser', password='testpass')
+        self.url = reverse('item-details', args=['P001'])
+
+    def test_token_authentication(self):
+        response = self.client.post(reverse('api-token'), {'username': 'testuser', 'password': 'testpass'})
+        self.assertEqual(response.status_code, 200)
+        token = response.data['token']
+        for _ in range(2):
+            response = self.client.get(self.url, HTTP_AUTHORIZATION='Token ' + token)
+            self.assertEqual(response.status_code, 200)
+
+        Token.objects.filter(key=token).delete()
+        response = self.client.get(self.url, HTTP_AUTHORIZATION='Token ' + token)
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(BASIC_AUTH_CACHE_TIMEOUT=30)
+    def test_cached_basic_credentials_are_dropped_on_password_change(self):
+        credentials = base64.b64encode(b'testuser:testpass').decode('utf-8')
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Basic ' + credentials).status_code, 200)
+
+        wrong_credentials = base64.b64encode(b'testuser:wrongpass').decode('utf-8')
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Basic ' + wrong_credentials).status_code, 401)
+
+        self.user.set_password('newpass')
+        self.user.save()
+        self.assertEqual(self.client.get(self.url, HTTP_AUTHORIZATION='Basic ' + credentials).status_code, 401)
+
+
+@skipUnless(connection.settings_dict['ENGINE'] == 'RetailApp.db.postgresql_pool', 'Needs the pooled PostgreSQL backend')
+class ConnectionPoolTests(TestCase):
+
+    def test_connections_are_reused_and_bounded(self):
+        from psycopg2 import OperationalError
+        from RetailApp.db.postgresql_pool.base import ConnectionPool
+
+        pool = ConnectionPool('test', connection.get_connection_params(), max_size=1, timeout=0.1)
+        first, _ = pool.getconn()
+        with self.assertRaises(OperationalError):
+            pool.getconn()
+        pool.putconn(first)
+
+        second, _ = pool.getconn()
+        self.assertIs(first, second)
+        pool.putconn(second)
+        self.assertEqual(pool.stats()['opened'], 1)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.close_idle()
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class ReplicaRoutingTests(TestCase):
+
+    def test_closed_days_are_read_from_the_replica(self):
+        yesterday = timezone.now().date() - timedelta(days=1)
+        with mock.patch('RetailApp.db.routers.replica_lag', return_value=600):
+            self.assertEqual(analytics_db(yesterday), 'replica_1')
+
+    def test_today_falls_back_to_the_primary_when_the_replica_lags(self):
+        today = timezone.now().date()
+        with mock.patch('RetailApp.db.routers.replica_lag', return_value=0.5):
+            self.assertEqual(analytics_db(today), 'replica_1')
+        with mock.patch('RetailApp.db.routers.replica_lag', return_value=600):
+            self.assertEqual(analytics_db(today), 'default')
+        with mock.patch('RetailApp.db.routers.replica_lag', return_value=None):
+            self.assertEqual(analytics_db(today), 'default')
+
+    def test_writes_are_pinned_to_the_primary(self):
+        self.assertEqual(PrimaryReplicaRouter().db_for_write(Item), 'default')
+        self.assertFalse(PrimaryReplicaRouter().allow_migrate('replica_1', 'transaction_system'))
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'Set TEST_DATABASE_REPLICA=1 to test with a replica database')
+class ReplicaQueryTests(TransactionTestCase):
+    databases = {'default', *settings.DATABASE_REPLICAS}
+
+    def test_analytics_query_runs_on_the_replica(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, starting_quantity=100, current_quantity=50)
+        create_transaction([{'item_code': 'P001', 'quantity': 2}])
+        yesterday = timezone.now().date() - timedelta(days=1)
+
+        with CaptureQueriesContext(connections['replica_1']) as replica_queries, \
+                CaptureQueriesContext(connections['default']) as primary_queries:
+            sales_data = get_sales_data_for_date_range(yesterday - timedelta(days=7), yesterday)
+        self.assertEqual(sales_data['total_quantity_sold'], None)
+        self.assertEqual(len(replica_queries), 1)
+        self.assertEqual(len(primary_queries), 0)
+
+
+class CacheWarmingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, starting_quantity=100, current_quantity=50)
+        create_transaction([{'item_code': 'P001', 'quantity': 2}])
+        self.today = timezone.now().date()
+
+    def test_warmed_ranges_are_read_by_the_views(self):
+        start_date = self.today - timedelta(days=6)
+        warm_average_sales(start_date.isoformat(), self.today.isoformat())
+        warm_sales_range(start_date.isoformat(), self.today.isoformat())
+        self.assertEqual(cache.get(average_sales_cache_key(start_date, self.today))['avg_sales_amount'], 20.0)
+        self.assertEqual(cache.get(sales_range_cache_key(start_date, self.today))['total_quantity_sold'], 2)
+
+    def test_often_missed_ranges_become_popular(self):
+        start_date = self.today - timedelta(days=13)
+        for _ in range(settings.CACHE_WARMING_MIN_MISSES):
+            record_cache_miss('trend_analysis', start_date, self.today)
+        record_cache_miss('trend_analysis', self.today - timedelta(days=1), self.today)
+        self.assertEqual(popular_ranges('trend_analysis', 10), [(start_date, self.today)])
+        self.assertEqual(popular_ranges('average_sales', 10), [])
+
+    def test_warm_sales_caches(self):
+        start_date = self.today - timedelta(days=13)
+        for _ in range(settings.CACHE_WARMING_MIN_MISSES):
+            record_cache_miss('trend_analysis', start_date, self.today)
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', False)
+        warm_sales_caches()
+        for days in settings.CACHE_WARMING_DAYS:
+            self.assertIsNotNone(cache.get(trend_analysis_cache_key(self.today - timedelta(days=days - 1), self.today)))
+        self.assertIsNotNone(cache.get(trend_analysis_cache_key(start_date, self.today)))
+
+
+class CeleryRoutingTests(TestCase):
+
+    def route(self, task_name):
+        return app.amqp.router.route({}, task_name)
+
+    def test_tasks_are_routed_to_their_queues(self):
+        self.assertEqual(self.route('transaction_system.tasks.cache_sales_data_for_current_data')['queue'].name,
+                         'interactive')
+        self.assertEqual(self.route('transaction_system.tasks.warm_trend_analysis')['queue'].name, 'warming')
+        self.assertEqual(self.route('transaction_system.tasks.export_sales_report')['queue'].name, 'batch')
+
+    def test_interactive_tasks_have_the_highest_priority(self):
+        self.assertLess(self.route('transaction_system.tasks.cache_sales_data_for_current_data')['priority'],
+                        self.route('transaction_system.tasks.warm_trend_analysis')['priority'])
+
+
+class LeaderboardTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=100,
+                            current_quantity=50)
+        Item.objects.create(name="Cola", item_code="D001", price=2.0, category='Drinks', starting_quantity=100,
+                            current_quantity=50)
+        Users.objects.create_user(username='testuser', password='testpass')
+        self.credentials = 'Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8')
+        with self.captureOnCommitCallbacks(execute=True):
+            create_transaction([{'item_code': 'P001', 'quantity': 1}, {'item_code': 'D001', 'quantity': 3}])
+        with self.captureOnCommitCallbacks(execute=True):
+            create_transaction([{'item_code': 'P001', 'quantity': 1}])
+
+    def test_checkout_updates_the_leaderboard(self):
+        response = self.client.get(reverse('top-sellers'), HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['item_code'] for item in response.data['top_items_by_quantity']], ['D001', 'P001'])
+        self.assertEqual([item['item_code'] for item in response.data['top_items_by_revenue']], ['P001', 'D001'])
+        self.assertEqual(response.data['top_categories_by_revenue'][0], {'category': 'Food', 'total_revenue': 20.0})
+
+        response = self.client.get(reverse('top-sellers'), {'hours': 2, 'limit': 1},
+                                   HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.data['top_items_by_quantity'], [{'item_code': 'D001', 'name': 'Cola',
+                                                                    'total_quantity': 3.0}])
+
+    def test_reconciliation_corrects_drift(self):
+        today = timezone.now().date()
+        get_redis_connection('default').zincrby(day_key('item', 'quantity', today), 10, 'P001')
+        reconcile_leaderboard(today)
+        self.assertEqual(top_sellers('item', 'quantity', 10), [('D001', 3.0), ('P001', 2.0)])
+        self.assertEqual(top_sellers('item', 'quantity', 10, hours=2), [('D001', 3.0), ('P001', 2.0)])
+
+
+class LiveSalesTests(TestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=100,
+                            current_quantity=50)
+
+    def test_checkout_publishes_the_sale(self):
+        pubsub = get_redis_connection('default').pubsub()
+        pubsub.subscribe(SALES_EVENTS_CHANNEL)
+        self.assertEqual(pubsub.get_message(timeout=1.0)['type'], 'subscribe')
+        with self.captureOnCommitCallbacks(execute=True):
+            transaction = create_transaction([{'item_code': 'P001', 'quantity': 2}])
+        event = json.loads(pubsub.get_message(timeout=1.0)['data'])
+        pubsub.close()
+        self.assertEqual(event['transaction_id'], str(transaction.transaction_id))
+        self.assertEqual(event['total_sales'], 20.0)
+        self.assertEqual(event['items_quantity'], [{'item__name': 'Pizza', 'total_quantity_sold': 2}])
+
+    async def test_feed_fans_out_running_totals(self):
+        feed = SalesFeed()
+        today = timezone.now().date()
+        with mock.patch.object(SalesFeed, '_start'):
+            first, second = feed.subscribe(), feed.subscribe()
+            feed.on_snapshot({'total_sales': 10, 'items_quantity': [{'item__name': 'Pizza', 'total_quantity_sold': 1}],
+                              'categories_quantity': []}, today)
+            self.assertEqual((await first.__anext__())[0], 'snapshot')
+            feed.on_event({'date': str(today), 'total_sales': 20.0, 'items_quantity': [
+                {'item__name': 'Pizza', 'total_quantity_sold': 2}], 'categories_quantity': [
+                {'item__category': 'Food', 'total_quantity_sold': 2}]})
+            self.assertEqual((await first.__anext__())[0], 'sale')
+            # The second dashboard subscribed after the snapshot and starts from the running totals.
+            event, totals = await second.__anext__()
+            self.assertEqual(event, 'snapshot')
+            self.assertEqual(totals['total_sales'], 30.0)
+            self.assertEqual(totals['items_quantity'], [{'item__name': 'Pizza', 'total_quantity_sold': 3}])
+            await first.aclose()
+            await second.aclose()
+
+    async def test_live_sales_needs_authentication(self):
+        response = await self.async_client.get(reverse('live-sales'))
+        self.assertEqual(response.status_code, 401)
+
+
+class MarketBasketTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        for code, name in (('P001', 'Pizza'), ('D001', 'Cola'), ('S001', 'Salad')):
+            Item.objects.create(name=name, item_code=code, price=5.0, category='Food', starting_quantity=100,
+                                current_quantity=100)
+        for basket in (['P001', 'D001'], ['P001', 'D001'], ['P001', 'D001', 'S001'], ['P001'], ['S001', 'P001']):
+            create_transaction([{'item_code': item_code, 'quantity': 1} for item_code in basket])
+        Users.objects.create_user(username='testuser', password='testpass')
+        self.credentials = 'Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8')
+        self.today = timezone.now().date()
+
+    def test_support_confidence_and_lift(self):
+        # Chunks smaller than a basket are extended, larger ones end before a split basket.
+        for chunk_rows in (1, 4, 1000):
+            with mock.patch('transaction_system.basket.CHUNK_ROWS', chunk_rows):
+                result = market_basket(self.today, self.today)
+            self.assertEqual(result['baskets'], 5)
+            pizza_cola, pizza_salad = result['pairs']
+            self.assertEqual((pizza_cola['item_a'], pizza_cola['item_b'], pizza_cola['baskets']), ('D001', 'P001', 3))
+            self.assertEqual(pizza_cola['support'], 0.6)
+            self.assertEqual(pizza_cola['confidence_a_b'], 1.0)  # Every basket with cola has pizza
+            self.assertEqual(pizza_cola['confidence_b_a'], 0.6)
+            self.assertEqual(pizza_cola['lift'], 1.0)
+            self.assertEqual(pizza_salad['baskets'], 2)
+
+    def test_items_created_during_the_job_are_left_out(self):
+        read_chunks = _transaction_chunks
+
+        def sell_a_new_item_then_read_chunks(*args):
+            Item.objects.create(name='Soup', item_code='N001', price=5.0, category='Food', starting_quantity=10,
+                                current_quantity=10)
+            create_transaction([{'item_code': 'N001', 'quantity': 1}, {'item_code': 'P001', 'quantity': 1}])
+            return read_chunks(*args)
+
+        with mock.patch('transaction_system.basket._transaction_chunks', sell_a_new_item_then_read_chunks):
+            baskets, item_codes, counts = co_occurrence(self.today, self.today)
+        self.assertEqual(baskets, 6)
+        self.assertNotIn('N001', item_codes)
+        self.assertEqual(counts[item_codes.get_loc('P001'), item_codes.get_loc('P001')], 6)
+
+    def test_items_bought_with_an_item(self):
+        response = self.client.get(reverse('market-basket'), {
+            'start_date': self.today, 'end_date': self.today, 'item_code': 'P001'}, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['item_code'] for item in response.data['bought_with']], ['D001', 'S001'])
+        self.assertIsNotNone(cache.get(market_basket_cache_key(self.today, self.today)))
+
+    def test_long_ranges_are_computed_by_celery(self):
+        start_date = self.today - timedelta(days=settings.MARKET_BASKET_SYNC_DAYS)
+        with mock.patch('transaction_system.views.compute_market_basket.delay') as delay:
+            for _ in range(2):
+                response = self.client.get(reverse('market-basket'), {'start_date': start_date, 'end_date': self.today},
+                                           HTTP_AUTHORIZATION=self.credentials)
+                self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(start_date.isoformat(), self.today.isoformat())
+        # A lost task is started again once the lock expired, long before the result would
+        self.assertLessEqual(cache.ttl(market_basket_lock_key(start_date, self.today)), TASK_LOCK_TIMEOUT)
+
+        compute_market_basket(start_date.isoformat(), self.today.isoformat())
+        response = self.client.get(reverse('market-basket'), {'start_date': start_date, 'end_date': self.today},
+                                   HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.data['pairs'][0]['baskets'], 3)
+
+
+class StockForecastTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=1000,
+                            current_quantity=1000)
+        Item.objects.create(name="Cola", item_code="D001", price=2.0, category='Drinks', starting_quantity=1000,
+                            current_quantity=1000)
+        Item.objects.create(name="Salad", item_code="S001", price=2.0, category='Food', starting_quantity=100,
+                            current_quantity=100)
+        yesterday = timezone.now().date() - timedelta(days=1)
+        for days_ago in range(settings.STOCK_FORECAST_HISTORY_DAYS):
+            transaction = create_transaction([{'item_code': 'P001', 'quantity': 10}, {'item_code': 'D001', 'quantity': 1}])
+            Transaction.objects.filter(pk=transaction.pk).update(transaction_date=yesterday - timedelta(days=days_ago))
+        Item.objects.filter(item_code='P001').update(current_quantity=40)
+        Item.objects.filter(item_code='D001').update(current_quantity=100)
+        Users.objects.create_user(username='testuser', password='testpass')
+        self.credentials = 'Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8')
+
+    def test_days_remaining_and_reorder_quantity(self):
+        forecast = forecast_stock_depletion()
+        pizza, cola = forecast['items']  # Salad did not sell and has no forecast
+        self.assertEqual((pizza['item_code'], pizza['daily_velocity'], pizza['days_remaining']), ('P001', 10.0, 4.0))
+        lead_and_cover = settings.STOCK_REORDER_LEAD_DAYS + settings.STOCK_REORDER_COVER_DAYS
+        self.assertEqual(pizza['reorder_quantity'], 10 * lead_and_cover - 40)
+        self.assertEqual((cola['item_code'], cola['days_remaining']), ('D001', 100.0))
+
+    def test_recent_sales_weigh_more(self):
+        weights = ewma_weights(settings.STOCK_FORECAST_HISTORY_DAYS, settings.STOCK_FORECAST_HALF_LIFE)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        self.assertAlmostEqual(weights[-1 - settings.STOCK_FORECAST_HALF_LIFE] * 2, weights[-1])
+
+    def test_stock_forecast_is_served_from_the_cache(self):
+        forecast_stock()
+        with self.assertNumQueries(1):  # Authentication only
+            response = self.client.get(reverse('stock-forecast'), {'days': 7}, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['item_code'] for item in response.data['items']], ['P001'])
+
+
+class SalesHeatmapTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=100,
+                            current_quantity=100)
+        Item.objects.create(name="Cola", item_code="D001", price=2.0, category='Drinks', starting_quantity=100,
+                            current_quantity=100)
+        # Tuesday 2024-09-17 at 14:30 and 14:45 and Sunday 2024-09-22 at 09:00 (UTC)
+        for sold_at, quantity in ((datetime(2024, 9, 17, 14, 30), 1), (datetime(2024, 9, 17, 14, 45), 2),
+                                  (datetime(2024, 9, 22, 9, 0), 3)):
+            transaction = create_transaction([{'item_code': 'P001', 'quantity': quantity},
+                                              {'item_code': 'D001', 'quantity': 1}])
+            sold_at = timezone.make_aware(sold_at, timezone.utc)
+            Transaction.objects.filter(pk=transaction.pk).update(transaction_date=sold_at.date(), transaction_time=sold_at)
+        Users.objects.create_user(username='testuser', password='testpass')
+        self.credentials = 'Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8')
+
+    def test_sales_are_bucketed_by_weekday_and_hour(self):
+        heatmap = get_sales_heatmap(datetime(2024, 9, 16).date(), datetime(2024, 9, 22).date())
+        self.assertEqual(heatmap['total_quantity_sold'][1][14], 5)
+        self.assertEqual(heatmap['transactions'][1][14], 2)
+        self.assertEqual(heatmap['total_sales'][6][9], 32.0)
+        self.assertEqual(sum(map(sum, heatmap['transactions'])), 3)
+
+        heatmap = get_sales_heatmap(datetime(2024, 9, 16).date(), datetime(2024, 9, 22).date(), category='Drinks')
+        self.assertEqual(heatmap['total_quantity_sold'][1][14], 2)
+
+    def test_closed_periods_are_cached(self):
+        params = {'start_date': '2024-09-16', 'end_date': '2024-09-22', 'category': 'Food'}
+        response = self.client.get(reverse('sales-heatmap'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total_quantity_sold'][6][9], 3)
+        with self.assertNumQueries(0):  # The credentials are cached as well
+            response = self.client.get(reverse('sales-heatmap'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.data['total_quantity_sold'][6][9], 3)
+
+
+class RefundTests(APITestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=100,
+                            current_quantity=50)
+        Item.objects.create(name="Cola", item_code="D001", price=2.0, category='Drinks', starting_quantity=100,
+                            current_quantity=50)
+        self.first = create_transaction([{'item_code': 'P001', 'quantity': 2}, {'item_code': 'D001', 'quantity': 3}])
+        self.second = create_transaction([{'item_code': 'P001', 'quantity': 1}])
+        Users.objects.create_user(username='admin', password='testpass', admin=True)
+        Users.objects.create_user(username='cashier', password='testpass')
+
+    def post_refund(self, data, username='admin'):
+        credentials = base64.b64encode(f'{username}:testpass'.encode()).decode('utf-8')
+        return self.client.post(reverse('refunds'), data, format='json', HTTP_AUTHORIZATION='Basic ' + credentials)
+
+    def stock(self):
+        return dict(Item.objects.values_list('item_code', 'current_quantity'))
+
+    def test_partial_refund(self):
+        response = self.post_refund({'transactions': [
+            {'transaction_id': str(self.first.pk), 'items': [{'item_code': 'D001', 'quantity': 2}]}]})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(float(response.data[0]['total_amount']), 4.0)
+        self.assertEqual(self.stock(), {'P001': 47, 'D001': 49})
+
+        response = self.post_refund({'transactions': [
+            {'transaction_id': str(self.first.pk), 'items': [{'item_code': 'D001', 'quantity': 2}]}]})
+        self.assertEqual(response.status_code, 400)  # Only 1 cola is left to refund
+        self.assertEqual(self.stock(), {'P001': 47, 'D001': 49})
+
+    def test_batch_void_restores_stock_in_one_update(self):
+        self.post_refund({'transactions': [
+            {'transaction_id': str(self.first.pk), 'items': [{'item_code': 'D001', 'quantity': 1}]}]})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_refund({'transactions': [{'transaction_id': str(self.first.pk)},
+                                                          {'transaction_id': str(self.second.pk)}],
+                                         'reason': 'Duplicate till upload'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.stock(), {'P001': 50, 'D001': 50})
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE')]), 1)
+        self.assertEqual(sorted(float(refund['total_amount']) for refund in response.data), [10.0, 24.0])
+
+    def test_a_failed_batch_refunds_nothing(self):
+        response = self.post_refund({'transactions': [{'transaction_id': str(self.first.pk)},
+                                                      {'transaction_id': str(uuid.uuid4())}]})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.stock(), {'P001': 47, 'D001': 47})
+        self.assertFalse(Refund.objects.exists())
+
+    def test_only_admins_can_refund(self):
+        response = self.post_refund({'transactions': [{'transaction_id': str(self.first.pk)}]}, username='cashier')
+        self.assertEqual(response.status_code, 403)
+
+    def test_undo_transaction(self):
+        undo_transaction(self.first)
+        self.assertEqual(self.stock(), {'P001': 49, 'D001': 50})
+        self.assertFalse(Transaction.objects.filter(pk=self.first.pk).exists())
+
+
+class InventoryTests(APITestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=100,
+                            current_quantity=50)
+        Item.objects.create(name="Cola", item_code="D001", price=2.0, category='Drinks', starting_quantity=100,
+                            current_quantity=50)
+        Users.objects.create_user(username='admin', password='testpass', admin=True)
+        Users.objects.create_user(username='cashier', password='testpass')
+
+    def post_inventory(self, data, username='admin', **kwargs):
+        credentials = base64.b64encode(f'{username}:testpass'.encode()).decode('utf-8')
+        return self.client.post(reverse('inventory') + kwargs.pop('query', ''), data,
+                                HTTP_AUTHORIZATION='Basic ' + credentials, **kwargs)
+
+    def test_apply_changes(self):
+        report = apply_inventory_changes([
+            {'item_code': 'P001', 'price': '11.5'},
+            {'item_code': 'D001', 'price': '2.00', 'received_quantity': 20},
+            {'item_code': 'D001', 'received_quantity': '5'},
+            {'item_code': 'S001', 'name': 'Salad', 'price': '6', 'category': 'Food', 'received_quantity': 30},
+        ])
+        self.assertEqual(report, {'rows': 4, 'created': 1, 'updated': 1, 'restocked': 1, 'unchanged': 0,
+                                  'received_quantity': 55, 'dry_run': False})
+        items = {item.item_code: item for item in Item.objects.all()}
+        self.assertEqual(float(items['P001'].price), 11.5)
+        self.assertEqual(items['D001'].current_quantity, 75)
+        self.assertEqual((items['S001'].starting_quantity, items['S001'].current_quantity), (30, 30))
+
+    def test_unchanged_items_are_not_written(self):
+        with CaptureQueriesContext(connection) as queries:
+            report = apply_inventory_changes([{'item_code': 'P001', 'price': '10.00', 'category': 'Food'}])
+        self.assertEqual(report['unchanged'], 1)
+        self.assertFalse([query for query in queries if query['sql'].startswith(('UPDATE', 'INSERT'))])
+
+    def test_only_changed_attributes_are_written(self):
+        read_catalog = _current_catalog
+
+        def read_catalog_then_rename(changes):
+            catalog = read_catalog(changes)
+            Item.objects.filter(item_code='P001').update(name='Pizza Margherita')  # Renamed since it was read
+            return catalog
+
+        with mock.patch('transaction_system.inventory._current_catalog', read_catalog_then_rename):
+            apply_inventory_changes([{'item_code': 'P001', 'price': '11.5'}, {'item_code': 'D001', 'price': '2.5'}])
+        item = Item.objects.get(item_code='P001')
+        self.assertEqual((item.name, float(item.price)), ('Pizza Margherita', 11.5))
+
+    def test_invalid_rows_change_nothing(self):
+        with self.assertRaisesMessage(InventoryError, 'Row 2'):
+            apply_inventory_changes([{'item_code': 'P001', 'price': '1'}, {'item_code': 'D001', 'price': 'cheap'}])
+        with self.assertRaisesMessage(InventoryError, 'New item S001 needs'):
+            apply_inventory_changes([{'item_code': 'P001', 'price': '1'}, {'item_code': 'S001', 'price': '1'}])
+        self.assertEqual(float(Item.objects.get(item_code='P001').price), 10.0)
+
+    def test_csv_upload_and_dry_run(self):
+        csv_file = SimpleUploadedFile('prices.csv', b'item_code,price,received_quantity\nP001,12.00,\nD001,,10\n')
+        response = self.post_inventory({'file': csv_file}, query='?dry_run=true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['updated'], response.data['restocked']), (1, 1))
+        self.assertEqual(dict(Item.objects.values_list('item_code', 'current_quantity')), {'P001': 50, 'D001': 50})
+
+        response = self.post_inventory([{'item_code': 'D001', 'received_quantity': 10}], format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Item.objects.get(item_code='D001').current_quantity, 60)
+
+    def test_only_admins_can_change_inventory(self):
+        response = self.post_inventory([{'item_code': 'D001', 'received_quantity': 10}], username='cashier',
+                                       format='json')
+        self.assertEqual(response.status_code, 403)
+
+    def test_import_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as file:
+            json.dump([{'item_code': 'P001', 'name': 'Pizza Margherita'}], file)
+            file.flush()
+            call_command('import_inventory', file.name, stdout=tempfile.TemporaryFile('w'))
+        self.assertEqual(Item.objects.get(item_code='P001').name, 'Pizza Margherita')
+        self.assertEqual(read_inventory_file(b'item_code,name\nP001,Pizza\n', 'csv'),
+                         [{'item_code': 'P001', 'name': 'Pizza'}])
+
+
+class AdminChangelistTests(TestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=100,
+                            current_quantity=100)
+        self.transaction = create_transaction([{'item_code': 'P001', 'quantity': 1}])
+        admin_user = Users.objects.create_superuser(username='admin', password='testpass')
+        self.client.force_login(admin_user)
+
+    def changelist_queries(self, model, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:transaction_system_{model}_changelist'), params, follow=True)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_date_hierarchy_opens_on_the_current_month(self):
+        today = timezone.now().date()
+        for model, field in (('transaction', 'transaction_date'), ('refund', 'refund_date')):
+            response = self.client.get(reverse(f'admin:transaction_system_{model}_changelist'))
+            self.assertRedirects(response, reverse(f'admin:transaction_system_{model}_changelist')
+                                 + f'?{field}__year={today.year}&{field}__month={today.month}')
+        response = self.client.get(reverse('admin:transaction_system_transaction_changelist'),
+                                   {'q': str(self.transaction.pk)})
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_query_count_does_not_grow_with_the_rows(self):
+        queries = {model: self.changelist_queries(model) for model in ('transaction', 'billitem')}
+        for _ in range(5):
+            create_transaction([{'item_code': 'P001', 'quantity': 1}])
+        self.assertEqual({model: self.changelist_queries(model) for model in queries}, queries)
+
+    def test_search_by_transaction_id(self):
+        response = self.client.get(reverse('admin:transaction_system_billitem_changelist'),
+                                   {'q': str(self.transaction.pk)})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get(reverse('admin:transaction_system_billitem_changelist'), {'q': 'pizza'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+
+class TransactionHistoryTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        for code in ('P001', 'D001', 'B001'):
+            Item.objects.create(name=code, item_code=code, price=2.0, category='Food', starting_quantity=100,
+                                current_quantity=100)
+        self.transactions = [create_transaction([{'item_code': 'P001', 'quantity': 1},
+                                                 {'item_code': 'D001', 'quantity': 2}]) for _ in range(3)]
+        Users.objects.create_user(username='testuser', password='testpass', admin=True)
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8'))
+
+    def list_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('transactions'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_pages_cost_a_constant_number_of_queries(self):
+        self.list_queries()  # Caches the credentials
+        response, queries = self.list_queries()
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual(response.data['results'][0]['transaction_id'], str(self.transactions[-1].pk))
+        for _ in range(3):
+            create_transaction([{'item_code': 'P001', 'quantity': 1}, {'item_code': 'D001', 'quantity': 1},
+                                {'item_code': 'B001', 'quantity': 1}])
+        response, more_queries = self.list_queries()
+        self.assertEqual(len(response.data['results']), 6)
+        self.assertEqual(more_queries, queries)
+
+    def test_cursor_pages(self):
+        response, _ = self.list_queries(page_size=2)
+        self.assertEqual(len(response.data['results']), 2)
+        next_page = self.client.get(response.data['next'])
+        self.assertEqual(len(next_page.data['results']), 1)
+        self.assertIsNone(next_page.data['next'])
+        seen = {transaction['transaction_id'] for transaction in response.data['results'] + next_page.data['results']}
+        self.assertEqual(seen, {str(transaction.pk) for transaction in self.transactions})
+
+        yesterday = timezone.now().date() - timedelta(days=1)
+        response, _ = self.list_queries(end_date=str(yesterday))
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(reverse('transactions'), {'start_date': '2024-02-01', 'end_date': '2024-01-01'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_receipt_is_cached_until_refunded(self):
+        url = reverse('receipt', args=[self.transactions[0].pk])
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([line['quantity'] for line in response.data['bill_items']], [1, 2])
+        with self.assertNumQueries(0):
+            self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('refunds'), {'transactions': [
+                {'transaction_id': str(self.transactions[0].pk), 'items': [{'item_code': 'D001', 'quantity': 1}]}]},
+                format='json')
+        response = self.client.get(url)
+        self.assertEqual(len(response.data['refunds']), 1)
+        self.assertEqual(self.client.get(reverse('receipt', args=[uuid.uuid4()])).status_code, 404)
+
+
+class ItemSearchTests(APITestCase):
+
+    def setUp(self):
+        clear_item_index()
+        for code, name in (('P001', 'Pizza Margherita'), ('P002', 'Pizza Funghi'), ('B001', 'Burger'),
+                           ('D001', 'Diet Cola'), ('D002', 'Cola'), ('PZ01', 'Panzerotti')):
+            Item.objects.create(name=name, item_code=code, price=5.0, category='Food', starting_quantity=10,
+                                current_quantity=10)
+        Users.objects.create_user(username='testuser', password='testpass')
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8'))
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('item-search'), {'q': q, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['item_code'] for item in response.data]
+
+    def test_ranking(self):
+        self.assertEqual(self.search('p00'), ['P002', 'P001'])  # Ties by name
+        self.assertEqual(self.search('cola'), ['D002', 'D001'])  # Name prefix before substring
+        self.assertEqual(self.search('pizza', limit=1), ['P002'])  # The shorter name is more similar
+        self.assertEqual(self.search('d002'), ['D002'])
+
+    def test_fuzzy_match(self):
+        self.assertEqual(self.search('burgr'), ['B001'])
+        self.assertEqual(self.search('margarita')[0], 'P001')
+        self.assertEqual(self.search('xyz'), [])
+
+    def test_trigrams_match_pg_trgm(self):
+        self.assertEqual(trigrams('Cola!'), {'  c', ' co', 'col', 'ola', 'la '})
+
+    def test_invalid_query(self):
+        response = self.client.get(reverse('item-search'), {'limit': 5})
+        self.assertEqual(response.status_code, 400)
+
+
+class MoneyTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Item.objects.create(name="Gum", item_code="G001", price=Decimal('0.10'), category='Food', starting_quantity=1000,
+                            current_quantity=1000)
+        for _ in range(10):
+            create_transaction([{'item_code': 'G001', 'quantity': 1}])
+        Users.objects.create_user(username='testuser', password='testpass')
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8'))
+
+    def test_amounts_are_stored_as_minor_units(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT price FROM transaction_system_item')
+            self.assertEqual(cursor.fetchone()[0], 10)
+        self.assertEqual(Item.objects.get(price=Decimal('0.1')).price, Decimal('0.10'))
+        self.assertEqual((to_minor_units(Decimal('19.995')), to_minor_units(3), from_minor_units(1999)),
+                         (2000, 300, Decimal('19.99')))
+
+    def test_sums_are_exact(self):
+        today = timezone.now().date()
+        self.assertEqual(get_sales_summary_for_day(today)['total_sales'], Decimal('1.00'))
+        # 0.1 summed as floats is not 1.0
+        self.assertEqual(str(get_sales_data_for_date_range(today, today)['total_sales']), '1.00')
+        self.assertEqual(get_sales_data(today, today)[:2], (Decimal('1.00'), Decimal('0.1000')))
+        self.assertEqual(get_avg_sales_summary(today, today)['items'][0]['avg_item_sales'], Decimal('0.1000'))
+
+    def test_serializers_present_decimals(self):
+        response = self.client.get(reverse('item-details', args=['G001']))
+        self.assertEqual(response.data['price'], '0.10')
+
+
+class ResultSetTests(TestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pen", item_code="P001", price=Decimal('1.50'), category='Stationery',
+                            starting_quantity=100, current_quantity=100)
+        Item.objects.create(name="Tea", item_code="T001", price=Decimal('4.00'), category='Food',
+                            starting_quantity=100, current_quantity=100)
+        create_transaction([{'item_code': 'P001', 'quantity': 2}, {'item_code': 'T001', 'quantity': 1}])
+        create_transaction([{'item_code': 'P001', 'quantity': 1}])
+        self.today = timezone.now().date()
+
+    def test_columns_are_typed_arrays(self):
+        sales = get_sales_data_by_item(self.today, self.today)
+        self.assertEqual(len(sales), 2)
+        self.assertEqual(sales.arrays['total_quantity_sold'].dtype, np.int64)
+        self.assertEqual(sales.arrays['item__name'].tolist(), [0, 1])
+        self.assertEqual(sales.categories['item__name'], ['Pen', 'Tea'])
+        self.assertEqual(list(sales), [
+            {'transaction__transaction_date': self.today, 'item__name': 'Pen', 'item__category': 'Stationery',
+             'total_quantity_sold': 3, 'total_sales': 4.5},
+            {'transaction__transaction_date': self.today, 'item__name': 'Tea', 'item__category': 'Food',
+             'total_quantity_sold': 1, 'total_sales': 4.0},
+        ])
+
+    def test_frame_shares_the_arrays(self):
+        sales = get_sales_data_by_item(self.today, self.today)
+        sales_df = sales.to_frame()
+        self.assertIsInstance(sales_df['item__category'].dtype, pd.CategoricalDtype)
+        self.assertEqual(sales_df.to_dict(orient='records'), list(sales))
+        self.assertEqual(get_trend_analysis(self.today, self.today)[0]['moving_avg_sales'], 4.5)
+
+    def test_empty_range(self):
+        sales = get_sales_data_by_item(self.today + timedelta(days=1), self.today + timedelta(days=1))
+        self.assertEqual((len(sales), list(sales)), (0, []))
+        self.assertTrue(sales.to_frame().empty)
+        self.assertEqual(get_trend_analysis(self.today + timedelta(days=1), self.today + timedelta(days=1)), [])
+
+
+@override_settings(ADMISSION_CONTROL={
+    'analytics': {'limit': 1, 'queue': 1, 'timeout': 0, 'global_limit': 1, 'retry_after': 5},
+})
+class AdmissionControlTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        Item.objects.create(name="Pizza", item_code="P001", price=5.0, category='Food', starting_quantity=100,
+                            current_quantity=100)
+        for quantity in (1, 2, 3):
+            create_transaction([{'item_code': 'P001', 'quantity': quantity}])
+        Users.objects.create_user(username='testuser', password='testpass')
+        self.credentials = 'Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8')
+        self.today = timezone.now().date()
+
+    def trend_analysis(self):
+        return self.client.get(reverse('trend-analysis'), {'start_date': self.today, 'end_date': self.today},
+                               HTTP_AUTHORIZATION=self.credentials)
+
+    def test_analytics_are_shed_while_checkout_goes_on(self):
+        analytics = get_admission_class('analytics')
+        token = analytics.admit()
+        try:
+            response = self.trend_analysis()
+            self.assertEqual((response.status_code, response['Retry-After']), (503, '5'))
+            response = self.client.post(reverse('add-sales'), {'items': [{'item_code': 'P001', 'quantity': 1}]},
+                                        format='json', HTTP_AUTHORIZATION=self.credentials)
+            self.assertEqual(response.status_code, 201)
+        finally:
+            analytics.release(token)
+        self.assertEqual(self.trend_analysis().status_code, 200)
+
+    def test_full_queue_is_turned_away_at_once(self):
+        analytics = get_admission_class('analytics')
+        analytics.waiting = 1  # A request is already waiting for the slot
+        try:
+            response = self.trend_analysis()
+        finally:
+            analytics.waiting = 0
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '5'))
+
+    def test_global_limit_is_shared_by_the_processes(self):
+        config = settings.ADMISSION_CONTROL['analytics']
+        token = AdmissionClass('analytics', config).admit()  # Another process
+        with self.assertRaises(Rejected):
+            get_admission_class('analytics').admit()
+        get_redis_connection('default').zrem('admission_analytics', token)
+        get_admission_class('analytics').release(get_admission_class('analytics').admit())
+
+    def test_global_slot_is_kept_while_held(self):
+        redis = get_redis_connection('default')
+        analytics = get_admission_class('analytics')
+        with override_settings(ADMISSION_LEASE=0.3):
+            token = analytics.admit()
+            try:
+                time.sleep(0.6)  # Longer than the lease
+                self.assertGreater(redis.zscore('admission_analytics', token), time.time())
+            finally:
+                analytics.release(token)
+        self.assertIsNone(redis.zscore('admission_analytics', token))
+
+    def test_query_cost_is_estimated_from_the_sales_volume(self):
+        self.assertEqual(estimated_bill_lines(self.today, self.today), 3)
+        self.assertEqual(estimated_bill_lines(self.today - timedelta(days=1000), self.today + timedelta(days=10)), 3)
+        self.assertEqual(estimated_bill_lines(self.today + timedelta(days=1), self.today + timedelta(days=10)), 0)
+        with override_settings(ANALYTICS_MAX_BILL_LINES=2):
+            response = self.trend_analysis()
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(ANALYTICS_SYNC_MAX_BILL_LINES=2)
+    def test_expensive_ranges_are_computed_by_celery(self):
+        with mock.patch('transaction_system.views.compute_trend_analysis.delay') as delay:
+            for _ in range(2):
+                self.assertEqual(self.trend_analysis().status_code, 202)
+        delay.assert_called_once_with(self.today.isoformat(), self.today.isoformat())
+        self.assertLessEqual(cache.ttl(trend_analysis_lock_key(self.today, self.today)), TASK_LOCK_TIMEOUT)
+        compute_trend_analysis(self.today.isoformat(), self.today.isoformat())
+        self.assertEqual(self.trend_analysis().data['trend_data'][0]['total_quantity_sold'], 6)
+
+        params = {'start_date': self.today, 'end_date': self.today}
+        with mock.patch('transaction_system.views.export_sales_report.delay') as delay:
+            response = self.client.get(reverse('sales-report'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(self.today.isoformat(), self.today.isoformat())
+        export_sales_report(self.today.isoformat(), self.today.isoformat())
+        response = self.client.get(reverse('sales-report'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Total Sales:, 30.0', response.content)
+
+        with mock.patch('transaction_system.views.compute_average_sales.delay') as delay:
+            response = self.client.get(reverse('average-sales'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(self.today.isoformat(), self.today.isoformat())
+        compute_average_sales(self.today.isoformat(), self.today.isoformat())
+        response = self.client.get(reverse('average-sales'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 200)
+
+        params = {'start_date_1': self.today, 'end_date_1': self.today, 'start_date_2': self.today, 'end_date_2': self.today}
+        with mock.patch('transaction_system.views.compute_sales_range.delay') as delay:
+            response = self.client.get(reverse('sales-comparison'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(self.today.isoformat(), self.today.isoformat())  # Started once for both ranges
+        compute_sales_range(self.today.isoformat(), self.today.isoformat())
+        response = self.client.get(reverse('sales-comparison'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 200)
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        Item.objects.create(name="Pizza", item_code="P001", price=Decimal('5.50'), category='Food',
+                            starting_quantity=10, current_quantity=10)
+
+    def test_sales_write_their_event_in_the_same_transaction(self):
+        transaction = create_transaction([{'item_code': 'P001', 'quantity': 2}])
+        with self.assertRaises(InsufficientStock):
+            create_transaction([{'item_code': 'P001', 'quantity': 100}])
+        event = OutboxEvent.objects.get()
+        self.assertEqual((event.event_type, event.published_at), (OutboxEvent.SALE, None))
+        self.assertEqual(event.payload['transaction_id'], str(transaction.transaction_id))
+        self.assertEqual((event.payload['total_amount'], event.payload['items']), ('11.00', [['P001', 2, '5.50']]))
+
+    def test_consumer_groups_read_incrementally_and_replay(self):
+        create_transaction([{'item_code': 'P001', 'quantity': 1}])
+        create_consumer_group('loyalty', '0')
+        for _ in range(2):
+            create_transaction([{'item_code': 'P001', 'quantity': 1}])
+        self.assertEqual(publish_outbox(batch_size=2), 2)
+        self.assertEqual(publish_outbox(batch_size=2), 1)
+        self.assertEqual(publish_outbox(), 0)
+        self.assertFalse(OutboxEvent.objects.filter(published_at__isnull=True).exists())
+
+        events = read_sales_events('loyalty', 'worker-1', count=2)
+        self.assertEqual([event['event_id'] for _, event in events], list(
+            OutboxEvent.objects.order_by('id').values_list('id', flat=True)[:2]))
+        ack_sales_events('loyalty', [stream_id for stream_id, _ in events])
+        update_outbox_metrics()
+        self.assertEqual(REGISTRY.get_sample_value('retail_sales_stream_lag_events', {'group': 'loyalty'}), 1)
+        self.assertEqual(REGISTRY.get_sample_value('retail_sales_stream_pending_events', {'group': 'loyalty'}), 0)
+        self.assertEqual(REGISTRY.get_sample_value('retail_outbox_backlog_events'), 0)
+
+        self.assertEqual(len(read_sales_events('loyalty', 'worker-1')), 1)
+        create_consumer_group('loyalty', events[0][0])  # Replay from an offset
+        self.assertEqual(len(read_sales_events('loyalty', 'worker-1')), 2)
+
+    def test_relay_publishes_and_purges(self):
+        create_transaction([{'item_code': 'P001', 'quantity': 1}])
+        out = StringIO()
+        call_command('relay_outbox', '--once', stdout=out)
+        self.assertIn('Published 1 events', out.getvalue())
+        self.assertEqual(get_redis_connection('default').xlen(SALES_STREAM), 1)
+        OutboxEvent.objects.update(published_at=timezone.now() - timedelta(seconds=settings.OUTBOX_RETENTION + 1))
+        self.assertEqual(purge_outbox(), 1)
+
+
+class ArchiveTests(TestCase):
+
+    def setUp(self):
+        archive = tempfile.TemporaryDirectory()
+        self.addCleanup(archive.cleanup)
+        overridden = override_settings(SALES_ARCHIVE_DIR=archive.name)
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+        Item.objects.create(name="Pizza", item_code="P001", price='10.25', category='Food', starting_quantity=100,
+                            current_quantity=100)
+        Item.objects.create(name="Cola", item_code="D001", price='2.10', category='Drinks', starting_quantity=100,
+                            current_quantity=100)
+        # Sales of January and February 2024 and of today
+        for sold_at, quantity in ((datetime(2024, 1, 9, 14, 30), 1), (datetime(2024, 1, 9, 18, 0), 2),
+                                  (datetime(2024, 1, 31, 9, 0), 3), (datetime(2024, 2, 1, 10, 0), 4)):
+            transaction = create_transaction([{'item_code': 'P001', 'quantity': quantity},
+                                              {'item_code': 'D001', 'quantity': 1}])
+            sold_at = timezone.make_aware(sold_at, timezone.utc)
+            Transaction.objects.filter(pk=transaction.pk).update(transaction_date=sold_at.date(), transaction_time=sold_at)
+        self.refunded = Transaction.objects.get(transaction_date=datetime(2024, 1, 31).date())
+        refund_transactions([{'transaction_id': self.refunded.pk, 'items': [{'item_code': 'D001', 'quantity': 1}]}])
+        create_transaction([{'item_code': 'D001', 'quantity': 5}])
+
+    def analytics(self, start_date, end_date):
+        start_date, end_date = datetime.strptime(start_date, '%Y-%m-%d').date(), \
+            datetime.strptime(end_date, '%Y-%m-%d').date()
+        total_sales, avg_sales, item_sales = get_sales_data(start_date, end_date)
+        # Sales of the same day are in no particular order
+        item_sales = sorted(item_sales, key=lambda row: (row['transaction_date'], row['name']))
+        return {
+            'summary': get_sales_summary_for_day(start_date),
+            'avg': get_avg_sales_summary(start_date, end_date),
+            'sales': (total_sales, avg_sales, item_sales),
+            'by_item': list(get_sales_data_by_item(start_date, end_date)),
+            'range': get_sales_data_for_date_range(start_date, end_date),
+            'heatmap': get_sales_heatmap(start_date, end_date),
+            'drinks_heatmap': get_sales_heatmap(start_date, end_date, category='Drinks'),
+        }
+
+    maxDiff = None
+
+    def assertSameAnalytics(self, archived, expected):
+        for name, value in expected.items():
+            with self.subTest(name):
+                self.assertEqual(json.loads(json.dumps(archived[name], default=str)),
+                                 json.loads(json.dumps(value, default=str)))
+
+    def test_months_to_archive(self):
+        self.assertEqual(months_to_archive(datetime(2025, 3, 15).date()), ['2024-01'])
+        self.assertEqual(months_to_archive(datetime(2025, 4, 1).date()), ['2024-01', '2024-02'])
+        self.assertEqual(months_to_archive(datetime(2025, 2, 28).date()), [])
+
+    def test_archived_sales_are_moved_out_of_the_database(self):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_sales', '2024-01', stdout=out)
+        self.assertIn('"transactions": 2, "bill_items": 4', out.getvalue())
+        self.assertEqual(archived_months(), ['2024-01'])
+        # The refunded transaction stays in the database with its refund
+        self.assertEqual(list(Transaction.objects.filter(transaction_date__lt=datetime(2024, 2, 1).date())),
+                         [self.refunded])
+
+        archived = archived_sales(datetime(2024, 1, 1).date(), datetime(2024, 1, 31).date())
+        self.assertEqual(len(archived.transactions), 2)
+        self.assertEqual(sorted(archived.lines['unit_price'].tolist()), [210, 210, 1025, 1025])
+        self.assertIsNone(archived_sales(datetime(2024, 2, 1).date(), datetime(2024, 2, 29).date()))
+
+    def test_analytics_are_unchanged_by_archiving(self):
+        ranges = [('2024-01-09', '2024-01-09'), ('2024-01-01', '2024-02-29'), ('2024-01-31', '2024-02-01')]
+        expected = [self.analytics(*date_range) for date_range in ranges]
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('archive_sales', '2024-01', stdout=StringIO())
+            call_command('archive_sales', '2024-01', stdout=StringIO())  # Nothing left to archive
+        self.assertEqual(Transaction.objects.count(), 3)
+        for date_range, before in zip(ranges, expected):
+            with self.subTest(date_range=date_range):
+                self.assertSameAnalytics(self.analytics(*date_range), before)
+
+
+class StockHistoryTests(APITestCase):
+
+    def setUp(self):
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=100,
+                            current_quantity=100)
+        Item.objects.create(name="Cola", item_code="D001", price=2.0, category='Drinks', starting_quantity=100,
+                            current_quantity=100)
+        self.today = timezone.now().date()
+        self.closed = self.today - timedelta(days=2)
+        earlier = create_transaction([{'item_code': 'P001', 'quantity': 2}])
+        Transaction.objects.filter(pk=earlier.pk).update(transaction_date=self.closed)
+        # Sold and partly refunded after the closed day
+        later = create_transaction([{'item_code': 'P001', 'quantity': 3}, {'item_code': 'D001', 'quantity': 1}])
+        refund_transactions([{'transaction_id': later.pk, 'items': [{'item_code': 'P001', 'quantity': 1}]}])
+        Users.objects.create_user(username='testuser', password='testpass')
+        self.credentials = 'Basic ' + base64.b64encode(b'testuser:testpass').decode('utf-8')
+
+    def test_snapshot_is_the_stock_at_the_end_of_the_day(self):
+        self.assertEqual(snapshot_inventory_levels(self.closed.isoformat()), 2)
+        self.assertEqual(snapshot_inventory_levels(self.closed.isoformat()), 0)  # Already written
+        self.assertEqual(dict(InventorySnapshot.objects.values_list('item_id', 'quantity')), {'P001': 98, 'D001': 100})
+
+    def test_stock_history(self):
+        snapshot_inventory_levels(self.closed.isoformat())
+        with self.assertNumQueries(2):
+            history = stock_history(['P001'], self.closed - timedelta(days=1), self.today + timedelta(days=1))
+        self.assertEqual(history['dates'][0], self.closed - timedelta(days=1))
+        self.assertEqual(history['dates'][-1], self.today)
+        self.assertEqual(history['items'], [{'item_code': 'P001', 'name': 'Pizza', 'quantities': [None, 98, None, 96]}])
+
+        params = {'item_codes': 'D001,P001', 'start_date': self.closed.isoformat(), 'end_date': self.today.isoformat()}
+        response = self.client.get(reverse('stock-history'), params, HTTP_AUTHORIZATION=self.credentials)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['quantities'] for item in response.data['items']], [[100, None, 99], [98, None, 96]])
+
+    def test_invalid_requests(self):
+        for params in ({'item_codes': 'P001,X999', 'start_date': '2024-09-01', 'end_date': '2024-09-30'},
+                       {'item_codes': ',', 'start_date': '2024-09-01', 'end_date': '2024-09-30'},
+                       {'item_codes': 'P001', 'start_date': '2023-09-01', 'end_date': '2024-09-30'}):
+            response = self.client.get(reverse('stock-history'), params, HTTP_AUTHORIZATION=self.credentials)
+            self.assertEqual(response.status_code, 400)
+
+
+class ArchiveCommitTests(TransactionTestCase):
+
+    def test_files_of_a_failed_commit_are_deleted(self):
+        archive = tempfile.TemporaryDirectory()
+        self.addCleanup(archive.cleanup)
+        Item.objects.create(name="Pizza", item_code="P001", price=10.0, category='Food', starting_quantity=100,
+                            current_quantity=100)
+        transaction = create_transaction([{'item_code': 'P001', 'quantity': 1}])
+        day = datetime(2024, 1, 9).date()
+        Transaction.objects.filter(pk=transaction.pk).update(transaction_date=day)
+
+        with override_settings(SALES_ARCHIVE_DIR=archive.name):
+            with mock.patch.object(connection, 'commit', side_effect=DatabaseError('commit failed')):
+                with self.assertRaises(DatabaseError):
+                    archive_day(day)
+            self.assertEqual([path.name for path in Path(archive.name).rglob('*.parquet')], [])
+            self.assertTrue(Transaction.objects.filter(pk=transaction.pk).exists())
+
+            self.assertEqual(archive_day(day), (1, 1))
+            self.assertEqual(len(list(Path(archive.name).rglob('[!.]*.parquet'))), 2)
+            self.assertFalse(Transaction.objects.filter(pk=transaction.pk).exists())
@@ -1,12 +1,27 @@
 from django.urls import path
-from .views import ItemDetailView, AddSalesView, SalesSummaryView, AverageSalesView, SalesReportView, TrendAnalysisView, SalesComparisonView
+from rest_framework.authtoken.views import obtain_auth_token
+from .views import ItemDetailView, AddSalesView, SalesSummaryView, AverageSalesView, SalesReportView, TrendAnalysisView, SalesComparisonView, \
+    TopSellersView, LiveSalesView, MarketBasketView, StockForecastView, SalesHeatmapView, RefundView, \
+    InventoryView, TransactionListView, ReceiptView, ItemSearchView, StockHistoryView
 
 urlpatterns = [
+    path('api-token', obtain_auth_token, name='api-token'),
+    path('item-search', ItemSearchView.as_view(), name='item-search'),
     path('items/<str:item_code>', ItemDetailView.as_view(), name='item-details'),
+    path('inventory', InventoryView.as_view(), name='inventory'),
     path('add-sales', AddSalesView.as_view(), name='add-sales'),
+    path('transactions', TransactionListView.as_view(), name='transactions'),
+    path('transactions/<uuid:transaction_id>', ReceiptView.as_view(), name='receipt'),
+    path('refunds', RefundView.as_view(), name='refunds'),
     path('sales-summary', SalesSummaryView.as_view(), name='sales-summary'),
+    path('top-sellers', TopSellersView.as_view(), name='top-sellers'),
+    path('live-sales', LiveSalesView.as_view(), name='live-sales'),
     path('average-sales-summary', AverageSalesView.as_view(), name='average-sales'),
     path('sales-report', SalesReportView.as_view(), name='sales-report'),
     path('trend-analysis', TrendAnalysisView.as_view(), name='trend-analysis'),
     path('sales-comparison', SalesComparisonView.as_view(), name='sales-comparison'),
+    path('market-basket', MarketBasketView.as_view(), name='market-basket'),
+    path('sales-heatmap', SalesHeatmapView.as_view(), name='sales-heatmap'),
+    path('stock-forecast', StockForecastView.as_view(), name='stock-forecast'),
+    path('stock-history', StockHistoryView.as_view(), name='stock-history'),
 ]
@@ -1,11 +1,71 @@
+from collections import defaultdict
 from datetime import datetime
+from io import StringIO
 
 import numpy as np
-from django.core.exceptions import ValidationError
-from django.db.models.functions import Coalesce
-from .models import Item, Transaction, BillItem
+import pandas as pd
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+from .models import Item, Transaction, BillItem, Refund, RefundLine
+from .instrumentation import stage, timed_stage
+from .metrics import STOCK_LOCK_WAIT
+from .leaderboard import record_sale
+from .live import publish_sale
+from .outbox import add_sale_event
+from .money import AVERAGE_DECIMAL_PLACES, MINOR_UNITS, as_money, average_amount, from_minor_units, to_minor_units
+from .archive import archived_sales
+from .resultsets import ResultSet, CATEGORY, INTEGER, FLOAT
+from RetailApp.db.routers import analytics_db
 from django.utils import timezone
-from django.db.models import Sum, Avg, ExpressionWrapper, F, FloatField
+from django.db import connections, transaction as db_transaction
+from django.db.models import Sum, Avg, Max, Count, Case, When, Value, F, IntegerField, \
+    Prefetch
+
+
+class ItemNotFound(ValueError):
+    """
+    Raised when a sale refers to an item_code that does not exist.
+    """
+
+
+class InsufficientStock(ValueError):
+    """
+    Raised when a sale asks for more than the current stock of an item.
+    """
+
+
+class TransactionNotFound(ValueError):
+    """
+    Raised when a refund refers to a transaction_id that does not exist.
+    """
+
+
+class InvalidRefund(ValueError):
+    """
+    Raised when a refund asks for an item or a quantity the transaction did not sell, or that was already refunded.
+    """
+
+
+def estimated_count(queryset):
+    """
+    PostgreSQL's estimate of the number of rows of a queryset: the table statistics (pg_class.reltuples) of an
+    unfiltered queryset, the planner's row estimate otherwise. None on other databases or for a table that
+    was never analyzed.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        if not queryset.query.where:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+            return int(row[0]) if row and row[0] >= 0 else None
+        try:
+            sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+        except EmptyResultSet:
+            return 0
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        return int(cursor.fetchone()[0][0]['Plan']['Plan Rows'])
 
 
 def parse_date_range(start_date_str, end_date_str):
@@ -41,99 +101,254 @@ def calculate_total_amount(items_data):
         total_amount += quantity * item.price
     return total_amount
 
-def undo_transaction(transaction):
+def restore_stock(quantities):
     """
-    Undo a transaction by restoring the stock of items.
+    Add `quantities` ({item_code: quantity}) back to the stock of the items with a single conditional UPDATE.
+    The rows are locked in item_code order first, the same order as create_transaction, to avoid deadlocks.
+    Has to run in a transaction.
     """
-    for bill_item in transaction.bill_items.all():
-        item = bill_item.item
-        item.current_quantity += bill_item.quantity
-        item.save()
+    item_codes = sorted(code for code, quantity in quantities.items() if quantity)
+    if not item_codes:
+        return 0
+    list(Item.objects.select_for_update().filter(item_code__in=item_codes).order_by('item_code')
+         .values_list('item_code', flat=True))
+    return Item.objects.filter(item_code__in=item_codes).update(current_quantity=F('current_quantity') + Case(
+        *[When(item_code=code, then=Value(quantities[code])) for code in item_codes],
+        output_field=IntegerField(),
+    ))
+
+
+def _invalidate_receipts(transaction_ids):
+    from .caching import invalidate_receipts  # caching imports this module
+    invalidate_receipts(transaction_ids)
 
-    transaction.delete()
+
+def receipts():
+    """
+    Transactions with everything a receipt shows (bill items with their item, refunds with their lines)
+    prefetched, a page of receipts costs the same number of queries for any number of bill items.
+    """
+    return Transaction.objects.prefetch_related(
+        Prefetch('bill_items', queryset=BillItem.objects.select_related('item').order_by('id')),
+        Prefetch('refunds', queryset=Refund.objects.prefetch_related(
+            Prefetch('lines', queryset=RefundLine.objects.order_by('id'))).order_by('refund_time')),
+    )
+
+
+def undo_transaction(transaction):
+    """
+    Undo a transaction by restoring the stock of items and deleting it.
+    Use `refund_transactions` to void a sale and keep it in the sales history.
+    """
+    with db_transaction.atomic():
+        restore_stock(dict(transaction.bill_items.values_list('item_id').annotate(quantity=Sum('quantity')).order_by()))
+        transaction_id = transaction.pk
+        transaction.delete()
+        db_transaction.on_commit(lambda: _invalidate_receipts([transaction_id]))
     return True
 
 def create_transaction(items_data):
     """
     Create a new transaction and associated bill items.
+    The stock rows are locked (in item_code order, to avoid deadlocks) until the transaction is committed,
+    so concurrent checkouts cannot oversell an item.
     """
-    transaction = Transaction.objects.create(transaction_date=timezone.now().date())
-    total_amount = 0
+    item_codes = sorted({item_data.get('item_code') for item_data in items_data})
 
-    for item_data in items_data:
-        item_code = item_data.get('item_code')
-        quantity = item_data.get('quantity')
+    with db_transaction.atomic():
+        with STOCK_LOCK_WAIT.time():
+            items = {item.item_code: item for item in
+                     Item.objects.select_for_update().filter(item_code__in=item_codes).order_by('item_code')}
 
-        try:
-            item = Item.objects.get(item_code=item_code)
-        except Item.DoesNotExist:
-            undo_transaction(transaction)
-            raise ValueError(f"Item with code {item_code} not found.")
+        transaction = Transaction.objects.create(transaction_date=timezone.now().date())
+        total_amount = 0
+        bill_items = []
 
-        if item.current_quantity < quantity:
-            undo_transaction(transaction)
-            raise ValueError(f"Insufficient stock for item: {item.name} with item_code: {item_code}")
+        for item_data in items_data:
+            item_code = item_data.get('item_code')
+            quantity = item_data.get('quantity')
 
-        BillItem.objects.create(
-            transaction=transaction,
-            item=item,
-            quantity=quantity,
-            unit_price=item.price
-        )
+            item = items.get(item_code)
+            if item is None:
+                raise ItemNotFound(f"Item with code {item_code} not found.")
 
-        total_amount += quantity * item.price
-        item.current_quantity -= quantity
-        item.save()
+            if item.current_quantity < quantity:
+                raise InsufficientStock(f"Insufficient stock for item: {item.name} with item_code: {item_code}")
+
+            bill_items.append(BillItem(
+                transaction=transaction,
+                item=item,
+                quantity=quantity,
+                unit_price=item.price
+            ))
+
+            total_amount += quantity * item.price
+            item.current_quantity -= quantity
 
-    transaction.total_amount = total_amount
-    transaction.save()
+        BillItem.objects.bulk_create(bill_items)
+        Item.objects.bulk_update(items.values(), ['current_quantity'])
+
+        transaction.total_amount = total_amount
+        transaction.save()
+        add_sale_event(transaction, bill_items)
+
+        db_transaction.on_commit(lambda: record_sale(transaction, bill_items))
+        db_transaction.on_commit(lambda: publish_sale(transaction, bill_items))
 
     return transaction
 
 
+
+def refund_transactions(refunds_data, reason=''):
+    """
+    Refund bill items of one or many transactions in a single atomic block.
+    `refunds_data` is a list of {'transaction_id': ..., 'items': [{'item_code': ..., 'quantity': ...}]}, a transaction
+    without items is voided: everything that was not refunded yet is refunded.
+    The stock of all affected items is restored with one conditional UPDATE. Returns the created refunds.
+    """
+    transaction_ids = [refund_data['transaction_id'] for refund_data in refunds_data]
+
+    with db_transaction.atomic():
+        # Locking the transactions serializes concurrent refunds of the same sale.
+        found = set(Transaction.objects.select_for_update().filter(transaction_id__in=transaction_ids)
+                    .order_by('transaction_id').values_list('transaction_id', flat=True))
+        missing = [str(transaction_id) for transaction_id in transaction_ids if transaction_id not in found]
+        if missing:
+            raise TransactionNotFound(f"Transactions not found: {', '.join(missing)}.")
+
+        sold = defaultdict(dict)  # transaction_id -> item_code -> quantity and unit_price
+        for row in BillItem.objects.filter(transaction_id__in=transaction_ids) \
+                .values('transaction_id', 'item_id').annotate(quantity=Sum('quantity'), unit_price=Max('unit_price')) \
+                .order_by():
+            sold[row['transaction_id']][row['item_id']] = row
+        refunded = {
+            (row['refund__transaction_id'], row['item_id']): row['quantity']
+            for row in RefundLine.objects.filter(refund__transaction_id__in=transaction_ids)
+            .values('refund__transaction_id', 'item_id').annotate(quantity=Sum('quantity'))
+            .order_by()
+        }
+
+        today = timezone.now().date()
+        refunds, refund_lines, restored = [], [], defaultdict(int)
+        for refund_data in refunds_data:
+            transaction_id = refund_data['transaction_id']
+            if refund_data.get('items'):
+                requested = defaultdict(int)
+                for item_data in refund_data['items']:
+                    requested[item_data['item_code']] += item_data['quantity']
+            else:
+                requested = {item_code: row['quantity'] - refunded.get((transaction_id, item_code), 0)
+                             for item_code, row in sold[transaction_id].items()}
+
+            refund = Refund(transaction_id=transaction_id, refund_date=today, reason=reason)
+            lines = []
+            for item_code, quantity in requested.items():
+                key = (transaction_id, item_code)
+                if item_code not in sold[transaction_id]:
+                    raise InvalidRefund(f"Item {item_code} was not sold in transaction {transaction_id}.")
+                remaining = sold[transaction_id][item_code]['quantity'] - refunded.get(key, 0)
+                if quantity > remaining:
+                    raise InvalidRefund(f"Only {remaining} of item {item_code} can be refunded "
+                                        f"from transaction {transaction_id}.")
+                if quantity:
+                    lines.append(RefundLine(refund=refund, item_id=item_code, quantity=quantity,
+                                            unit_price=sold[transaction_id][item_code]['unit_price']))
+                    refunded[key] = refunded.get(key, 0) + quantity
+                    restored[item_code] += quantity
+            if not lines:
+                raise InvalidRefund(f"Transaction {transaction_id} has nothing left to refund.")
+
+            refund.total_amount = sum(line.quantity * line.unit_price for line in lines)
+            refunds.append(refund)
+            refund_lines.extend(lines)
+
+        Refund.objects.bulk_create(refunds)
+        RefundLine.objects.bulk_create(refund_lines)
+        restore_stock(restored)
+        db_transaction.on_commit(lambda: _invalidate_receipts(transaction_ids))
+
+    return refunds
+
 def get_sales_summary_for_day(date):
     """
     Calculate the  sales summary for a given date.
     """
-    total_sales = Transaction.objects.filter(transaction_date=date).aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
-    items_quantity = BillItem.objects.select_related('item', 'transaction').filter(transaction__transaction_date=date) \
+    db = analytics_db(date)
+    total_sales = Transaction.objects.using(db).filter(transaction_date=date).aggregate(total_sales=Sum('total_amount'))['total_sales'] or 0
+    items_quantity = BillItem.objects.using(db).select_related('item', 'transaction').filter(transaction__transaction_date=date) \
         .values('item__name') \
         .annotate(total_quantity_sold=Sum('quantity')) \
         .order_by('item__name')
 
-    categories_quantity = BillItem.objects.select_related('item', 'transaction').filter(transaction__transaction_date=date) \
+    categories_quantity = BillItem.objects.using(db).select_related('item', 'transaction').filter(transaction__transaction_date=date) \
         .values('item__category') \
         .annotate(total_quantity_sold=Sum('quantity')) \
         .order_by('item__category')
 
+    items_quantity, categories_quantity = list(items_quantity), list(categories_quantity)
+    archived = archived_sales(date, date)
+    if archived is not None and len(archived.transactions):
+        total_sales += from_minor_units(int(archived.transactions['total_amount'].sum()))
+        items_quantity = _add_archived_quantities(items_quantity, archived.lines, 'name', 'item__name')
+        categories_quantity = _add_archived_quantities(categories_quantity, archived.lines, 'category',
+                                                       'item__category')
+
     return  {
         "total_sales": total_sales,
-        "items_quantity": list(items_quantity),
-        "categories_quantity": list(categories_quantity)
+        "items_quantity": items_quantity,
+        "categories_quantity": categories_quantity
     }
 
 
+def _add_archived_quantities(rows, lines, column, key):
+    """
+    Add the quantities of archived bill lines per `column` to rows of {key: ..., 'total_quantity_sold': ...}.
+    """
+    totals = defaultdict(int, {row[key]: row['total_quantity_sold'] for row in rows})
+    for value, quantity in lines.groupby(column)['quantity'].sum().items():
+        totals[value] += int(quantity)
+    return [{key: value, 'total_quantity_sold': totals[value]} for value in sorted(totals)]
+
+
+def _line_totals(bill_items, key, lines, column):
+    """
+    Quantity, sales (minor units) and number of lines per `key` of the bill items in the database
+    plus the archived `lines` per `column`, as a DataFrame indexed by the key.
+    """
+    hot = pd.DataFrame(list(bill_items.values(key).annotate(
+        quantity_sold=Sum('quantity'), sales=Sum(F('quantity') * F('unit_price')), lines=Count('id')).order_by()
+        .values_list(key, 'quantity_sold', 'sales', 'lines')), columns=[key, 'quantity', 'sales', 'lines'])
+    archived = pd.DataFrame({key: lines[column], 'quantity': lines['quantity'],
+                             'sales': lines['quantity'] * lines['unit_price'], 'lines': 1})
+    return pd.concat([hot, archived]).groupby(key).sum()
+
+
 def get_avg_sales_summary(start_date, end_date):
     """
     Calculate the Avg sales summary for a given date range.
     """
-    total_sales_amount = Transaction.objects.filter(transaction_date__range=(start_date, end_date)) \
-                             .aggregate(total_amount=Avg('total_amount'))['total_amount'] or 0
+    db = analytics_db(end_date)
+    archived = archived_sales(start_date, end_date)
+    if archived is not None:
+        return _avg_sales_summary_with_archive(db, start_date, end_date, archived)
 
-    item_data = (BillItem.objects.select_related('item', 'transaction').filter(
+    total_sales_amount = Transaction.objects.using(db).filter(transaction_date__range=(start_date, end_date)) \
+        .aggregate(total_amount=as_money(Avg('total_amount'), AVERAGE_DECIMAL_PLACES))['total_amount'] or 0
+
+    item_data = (BillItem.objects.using(db).select_related('item', 'transaction').filter(
         transaction__transaction_date__range=(start_date, end_date))
         .values('item__name')
         .annotate(
         avg_quantity_sold=Avg('quantity'),
-        avg_item_sales=Avg(F('quantity') * F('unit_price'))
+        avg_item_sales=as_money(Avg(F('quantity') * F('unit_price')), AVERAGE_DECIMAL_PLACES)
     ))
 
-    category_data = BillItem.objects.select_related('item', 'transaction').filter(
+    category_data = BillItem.objects.using(db).select_related('item', 'transaction').filter(
         transaction__transaction_date__range=(start_date, end_date)) \
         .values('item__category') \
         .annotate(
         avg_quantity_sold=Avg('quantity'),
-        avg_category_sales=Avg(F('quantity') * F('unit_price'))
+        avg_category_sales=as_money(Avg(F('quantity') * F('unit_price')), AVERAGE_DECIMAL_PLACES)
     )
 
     return {
@@ -143,65 +358,147 @@ def get_avg_sales_summary(start_date, end_date):
     }
 
 
+def _avg_sales_summary_with_archive(db, start_date, end_date, archived):
+    """
+    get_avg_sales_summary of a range that reaches into the archive: the averages of the sums and counts
+    of the database and of the archive.
+    """
+    transactions = Transaction.objects.using(db).filter(transaction_date__range=(start_date, end_date)) \
+        .aggregate(total=Sum('total_amount'), count=Count('pk'))
+    total = to_minor_units(transactions['total'] or 0) + int(archived.transactions['total_amount'].sum())
+    count = transactions['count'] + len(archived.transactions)
+
+    bill_items = BillItem.objects.using(db).filter(transaction__transaction_date__range=(start_date, end_date))
+    items = _line_totals(bill_items, 'item__name', archived.lines, 'name')
+    categories = _line_totals(bill_items, 'item__category', archived.lines, 'category')
+    return {
+        'avg_sales_amount': average_amount(total, count) if count else 0,
+        'items': [{'item__name': name, 'avg_quantity_sold': row.quantity / row.lines,
+                   'avg_item_sales': average_amount(row.sales, row.lines)} for name, row in items.iterrows()],
+        'categories': [{'item__category': category, 'avg_quantity_sold': row.quantity / row.lines,
+                        'avg_category_sales': average_amount(row.sales, row.lines)}
+                       for category, row in categories.iterrows()],
+    }
+
+
+def _add_archived_sales(sales, lines, columns, order):
+    """
+    Add the archived bill lines to a ResultSet of the quantity and sales of every day, item name and category
+    (`columns`, in that order), sorted by the `order` columns and then the others.
+    """
+    archived = pd.DataFrame({
+        columns[0]: lines['transaction_date'], columns[1]: lines['name'], columns[2]: lines['category'],
+        'total_quantity_sold': lines['quantity'], 'total_sales': lines['quantity'] * lines['unit_price'],
+    }).groupby(list(columns), as_index=False, sort=False).sum()
+    archived['total_sales'] /= MINOR_UNITS
+    combined = pd.concat([sales.to_frame().astype({column: object for column in columns}), archived]) \
+        .groupby(list(columns), as_index=False, sort=False).sum() \
+        .sort_values(order + [column for column in columns if column not in order])
+    return ResultSet.from_frame(combined, sales.columns)
+
+
 def get_sales_data(start_date, end_date):
     """
     Calculate the sales data for a given date range.
     """
-    transactions = Transaction.objects.filter(transaction_date__range=(start_date, end_date))
+    db = analytics_db(end_date)
+    transactions = Transaction.objects.using(db).filter(transaction_date__range=(start_date, end_date))
 
     total_sales = transactions.aggregate(
-        total_sales=Coalesce(Sum('total_amount', output_field=FloatField()), 0.0)
+        total_sales=as_money(Sum('total_amount'), default=0)
     )['total_sales']
 
     avg_sales = transactions.aggregate(
-        avg_sales=Coalesce(Avg('total_amount', output_field=FloatField()), 0.0)
+        avg_sales=as_money(Avg('total_amount'), AVERAGE_DECIMAL_PLACES, default=0)
     )['avg_sales']
 
-    item_sales = BillItem.objects.select_related('item', 'transaction') \
+    item_sales = BillItem.objects.using(db) \
         .filter(transaction__transaction_date__range=(start_date, end_date)).order_by('transaction__transaction_date') \
         .values(transaction_date=F('transaction__transaction_date'),
         name=F('item__name'),
         category=F('item__category') ) \
         .annotate(
         total_quantity_sold=Sum('quantity'),
-        total_sales=Coalesce(
-            Sum(ExpressionWrapper(
-                F('quantity') * F('unit_price'),
-                output_field=FloatField()
-            )),
-            0.0,
-            output_field=FloatField()
-        )
+        total_sales=as_money(Sum(F('quantity') * F('unit_price')), default=0)
     )
+    item_sales = ResultSet.from_queryset(item_sales, {
+        'transaction_date': CATEGORY,
+        'name': CATEGORY,
+        'category': CATEGORY,
+        'total_quantity_sold': INTEGER,
+        'total_sales': FLOAT,
+    })
+
+    archived = archived_sales(start_date, end_date)
+    if archived is not None:
+        totals = transactions.aggregate(total=Sum('total_amount'), count=Count('pk'))
+        total = to_minor_units(totals['total'] or 0) + int(archived.transactions['total_amount'].sum())
+        count = totals['count'] + len(archived.transactions)
+        total_sales = from_minor_units(total)
+        avg_sales = average_amount(total, count) if count else average_amount(0, 1)
+        item_sales = _add_archived_sales(item_sales, archived.lines, ('transaction_date', 'name', 'category'),
+                                         ['transaction_date'])
     return total_sales, avg_sales, item_sales
 
 
 
+def get_sales_report(start_date, end_date):
+    """
+    The CSV sales report of a date range: the sales of every item per day, then the total and average sales.
+    """
+    total_sales, avg_sales, item_sales = get_sales_data(start_date, end_date)
+
+    with stage('pandas'):
+        item_sales_df = item_sales.to_frame()
+
+        csv_buffer = StringIO()
+        item_sales_df.to_csv(csv_buffer, index=False)
+
+    csv_buffer.write("\nTotal Sales:, {}\n".format(total_sales))
+    csv_buffer.write("Average Sales:, {}\n".format(avg_sales))
+    return csv_buffer.getvalue()
+
+
 def get_sales_data_by_item(start_date, end_date):
+    """
+    Day-wise quantity and sales of every item in a date range, ordered by item and date, as a ResultSet.
+    """
     # Group and aggregate data by day, item, and category
-    sales_data = BillItem.objects.select_related('item', 'transaction') \
+    sales_data = BillItem.objects.using(analytics_db(end_date)) \
         .filter(transaction__transaction_date__range=(start_date, end_date)) \
         .values('transaction__transaction_date', 'item__name', 'item__category') \
         .annotate(
             total_quantity_sold=Sum('quantity'),
-            total_sales=ExpressionWrapper(
-                Sum(F('quantity') * F('unit_price')),
-                output_field=FloatField()
-            )
+            total_sales=as_money(Sum(F('quantity') * F('unit_price')))
         ) \
         .order_by('item__name', 'transaction__transaction_date')  # Order by item and date
-    return list(sales_data)
-
+    sales_data = ResultSet.from_queryset(sales_data, {
+        'transaction__transaction_date': CATEGORY,
+        'item__name': CATEGORY,
+        'item__category': CATEGORY,
+        'total_quantity_sold': INTEGER,
+        'total_sales': FLOAT,
+    })
+
+    archived = archived_sales(start_date, end_date)
+    if archived is not None:
+        sales_data = _add_archived_sales(
+            sales_data, archived.lines, ('transaction__transaction_date', 'item__name', 'item__category'),
+            ['item__name', 'transaction__transaction_date'])
+    return sales_data
+
+@timed_stage('pandas')
 def calculate_moving_average(sales_df, window=3):
     # Calculate moving average for each item day-wise
-    sales_df['moving_avg_sales'] = sales_df.groupby('item__name')['total_sales'].transform(
+    sales_df['moving_avg_sales'] = sales_df.groupby('item__name', observed=True)['total_sales'].transform(
         lambda x: x.rolling(window=window, min_periods=1).mean()
     )
     return sales_df
 
+@timed_stage('pandas')
 def calculate_manual_trend(sales_df):
     # Calculate day-wise sales trend
-    sales_df['sales_trend'] = sales_df.groupby('item__name')['total_sales'].diff().fillna(0)
+    sales_df['sales_trend'] = sales_df.groupby('item__name', observed=True)['total_sales'].diff().fillna(0)
     sales_df['trend'] = np.where(
         sales_df['sales_trend'] > 0, 'Increasing',
         np.where(sales_df['sales_trend'] < 0, 'Decreasing', '-')
@@ -209,23 +506,87 @@ def calculate_manual_trend(sales_df):
     return sales_df
 
 
+def get_trend_analysis(start_date, end_date):
+    """
+    Day-wise sales of every item in a date range with their moving average and trend.
+    """
+    sales_data = get_sales_data_by_item(start_date, end_date)
+    with stage('pandas'):
+        sales_df = sales_data.to_frame()
+
+    if sales_df.empty:
+        return []
+
+    sales_df = calculate_moving_average(sales_df)
+    sales_df = calculate_manual_trend(sales_df)
+    with stage('pandas'):
+        return sales_df.to_dict(orient='records')
+
 
 def get_sales_data_for_date_range(start_date, end_date):
     """
     Fetch sales data for given date range.
     """
-    sales_data = BillItem.objects.select_related('item', 'transaction') \
-        .filter(transaction__transaction_date__range=(start_date, end_date)) \
-        .aggregate(
-        total_sales=Coalesce(
-            Sum(ExpressionWrapper(
-                F('quantity') * F('unit_price'),
-                output_field=FloatField()
-            )),
-            0.0,
-            output_field=FloatField()
-        ),
+    bill_items = BillItem.objects.using(analytics_db(end_date)).select_related('item', 'transaction') \
+        .filter(transaction__transaction_date__range=(start_date, end_date))
+    archived = archived_sales(start_date, end_date)
+    if archived is not None:
+        totals = bill_items.aggregate(sales=Sum(F('quantity') * F('unit_price')), quantity=Sum('quantity'))
+        lines = archived.lines
+        return {
+            'total_sales': from_minor_units(
+                (totals['sales'] or 0) + int((lines['quantity'] * lines['unit_price']).sum())),
+            'total_quantity_sold': (totals['quantity'] or 0) + int(lines['quantity'].sum()) or None,
+        }
+
+    sales_data = bill_items.aggregate(
+        total_sales=as_money(Sum(F('quantity') * F('unit_price')), default=0),
         total_quantity_sold=Sum('quantity')
     )
 
-    return sales_data
\ No newline at end of file
+    return sales_data
+
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+
+def get_sales_heatmap(start_date, end_date, category=None):
+    """
+    Sales, quantity and number of transactions of a date range bucketed by weekday x hour of the sale time,
+    optionally only of the items of one category. Rows are the weekdays (Monday first), columns the hours 0 - 23.
+    """
+    bill_items = BillItem.objects.using(analytics_db(end_date)) \
+        .filter(transaction__transaction_date__range=(start_date, end_date))
+    if category:
+        bill_items = bill_items.filter(item__category=category)
+    buckets = bill_items \
+        .values(weekday=ExtractIsoWeekDay('transaction__transaction_time'),
+                hour=ExtractHour('transaction__transaction_time')) \
+        .annotate(
+            total_sales=as_money(Sum(F('quantity') * F('unit_price'))),
+            total_quantity_sold=Sum('quantity'),
+            transactions=Count('transaction', distinct=True),
+        ) \
+        .order_by()
+
+    heatmap = {metric: [[0] * 24 for _ in WEEKDAYS] for metric in ('total_sales', 'total_quantity_sold', 'transactions')}
+    for bucket in buckets:
+        for metric, cells in heatmap.items():
+            cells[bucket['weekday'] - 1][bucket['hour']] = bucket[metric]
+
+    archived = archived_sales(start_date, end_date, category)
+    if archived is not None and len(archived.lines):
+        lines = archived.lines
+        times = lines['transaction_time'].dt.tz_convert(timezone.get_current_timezone_name())
+        archived_buckets = pd.DataFrame({
+            'weekday': times.dt.dayofweek + 1, 'hour': times.dt.hour, 'total_quantity_sold': lines['quantity'],
+            'total_sales': lines['quantity'] * lines['unit_price'], 'transaction_id': lines['transaction_id'],
+        }).groupby(['weekday', 'hour']).agg(total_sales=('total_sales', 'sum'),
+                                            total_quantity_sold=('total_quantity_sold', 'sum'),
+                                            transactions=('transaction_id', 'nunique'))
+        for (weekday, hour), bucket in archived_buckets.iterrows():
+            # A transaction is either archived or in the database, the distinct counts add up
+            heatmap['total_sales'][weekday - 1][hour] += from_minor_units(bucket['total_sales'])
+            heatmap['total_quantity_sold'][weekday - 1][hour] += int(bucket['total_quantity_sold'])
+            heatmap['transactions'][weekday - 1][hour] += int(bucket['transactions'])
+    return {'weekdays': WEEKDAYS, 'hours': list(range(24)), **heatmap}
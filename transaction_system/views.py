@@ -1,22 +1,48 @@
-from io import StringIO
+import json
+from asgiref.sync import sync_to_async
 from django.utils import timezone
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views import View
 from rest_framework.decorators import authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework.authentication import BasicAuthentication
 from rest_framework import status
 from django.shortcuts import get_object_or_404
-from .models import Item
+from django.db.models import Prefetch
+from .models import Item, Transaction, BillItem, Refund
 from .serializers import ItemSerializer, TransactionSerializer, \
-    SalesTransactionSerializer, DateRangeSerializer, SalesComparisonRequestSerializer
-from .utils import create_transaction, get_sales_summary_for_day, get_avg_sales_summary, get_sales_data, \
-    get_sales_data_by_item, calculate_moving_average, calculate_manual_trend, get_sales_data_for_date_range
+    SalesTransactionSerializer, DateRangeSerializer, SalesComparisonRequestSerializer, TopSellersRequestSerializer, \
+    MarketBasketRequestSerializer, StockForecastRequestSerializer, SalesHeatmapRequestSerializer, \
+    RefundRequestSerializer, RefundSerializer, ReceiptSerializer, TransactionHistoryRequestSerializer, \
+    ItemSearchRequestSerializer, StockHistoryRequestSerializer
+from .utils import ItemNotFound, InsufficientStock, TransactionNotFound, InvalidRefund, create_transaction, \
+    refund_transactions, get_sales_summary_for_day, get_avg_sales_summary, \
+    get_trend_analysis, get_sales_heatmap, receipts, get_sales_report
+from .caching import AVERAGE_SALES_TIMEOUT, TREND_ANALYSIS_TIMEOUT, MARKET_BASKET_TIMEOUT, average_sales_cache_key, \
+    trend_analysis_cache_key, market_basket_cache_key, market_basket_lock_key, record_cache_miss, \
+    get_cached_sales_data_for_date_range, STOCK_FORECAST_TIMEOUT, STOCK_FORECAST_CACHE_KEY, SALES_HEATMAP_TIMEOUT, \
+    sales_heatmap_cache_key, RECEIPT_TIMEOUT, receipt_cache_key, sales_report_cache_key, \
+    sales_report_lock_key, trend_analysis_lock_key, TASK_LOCK_TIMEOUT, average_sales_lock_key, sales_range_cache_key, \
+    sales_range_lock_key
+from .basket import market_basket, bought_together
+from .forecasting import forecast_stock_depletion, items_running_out
+from .snapshots import stock_history
+from .inventory import apply_inventory_changes, read_inventory_file
+from .search import search_items
+from .tasks import compute_market_basket, compute_trend_analysis, export_sales_report, compute_average_sales, \
+    compute_sales_range
+from .leaderboard import get_top_sellers
+from .authentication import AUTHENTICATION_CLASSES, authenticate
+from .permissions import IsStoreAdmin
+from .admission import admission_class
+from .pagination import TransactionCursorPagination
+from .live import sales_feed
+from .metrics import CHECKOUT_OUTCOMES, record_cache_lookup
+from django.conf import settings
 from django.core.cache import cache
 from django.utils.decorators import method_decorator
 from django.views.decorators.cache import cache_page
-import pandas as pd
 
 
 """
@@ -33,7 +59,7 @@ Responses:
 - 200 OK: Returned when the item is found. The response body contains the serialized item data.
 - 404 Not Found: Returned when the item with the provided code is not found.
 """
-@authentication_classes([BasicAuthentication])
+@authentication_classes(AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated, ])
 class ItemDetailView(APIView):
     def get(self, request, item_code=None):
@@ -42,6 +68,35 @@ class ItemDetailView(APIView):
         return Response(serializer.data)
 
 
+"""
+API Endpoint: Search Items
+Method: GET
+URL: /api/item-search/
+
+This API endpoint allows authenticated users, e.g. POS operators, to look up items by a part of their name or code.
+Items match by item code prefix, name prefix or substring, and by trigram similarity of the name, so typos still
+find the item. The best matches are returned first: exact code, code prefix, name prefix, name substring, then the
+most similar names.
+
+Query Parameters:
+- q: The search term.
+- limit: Number of items to return (1 - 50, default 10).
+
+Responses:
+- 200 OK: Returned with the matching items in the response body.
+- 400 Bad Request: Returned when the provided query parameters are invalid.
+"""
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated, ])
+class ItemSearchView(APIView):
+    def get(self, request):
+        serializer = ItemSearchRequestSerializer(data=request.query_params)
+        if serializer.is_valid():
+            items = search_items(serializer.validated_data['q'], serializer.validated_data['limit'])
+            return Response(ItemSerializer(items, many=True).data)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 """
 API Endpoint: Add Sales Transaction
 Method: POST
@@ -50,7 +105,7 @@ URL: /api/add-sales/
 This API endpoint allows authenticated users to create a new sales transaction by providing the necessary data in the request body.
 
 Request Headers:
-- Authorization: Basic <credentials>
+- Authorization: Basic <credentials> or Token <key>
 
 Request Body:
 {
@@ -67,7 +122,7 @@ Responses:
 - 201 Created: Returned when the transaction is created successfully. The response body contains the serialized transaction data.
 - 400 Bad Request: Returned when the request data is invalid or when the create_transaction function raises a ValueError. The response body contains an error message.
 """
-@authentication_classes([BasicAuthentication])
+@authentication_classes(AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated, ])
 class AddSalesView(APIView):
     def post(self, request):
@@ -76,13 +131,172 @@ class AddSalesView(APIView):
             items_data =  serializer.data.get('items')
             try:
                 transaction = create_transaction(items_data)
+                # Re-read with the bill items and their items prefetched, 3 queries instead of one per bill item
+                transaction = Transaction.objects.prefetch_related(
+                    Prefetch('bill_items', queryset=BillItem.objects.select_related('item').order_by('id'))).get(pk=transaction.pk)
                 serializer = TransactionSerializer(transaction)
+                CHECKOUT_OUTCOMES.labels(outcome='success').inc()
                 return Response(serializer.data, status=status.HTTP_201_CREATED)
+            except ItemNotFound as e:
+                CHECKOUT_OUTCOMES.labels(outcome='missing_item').inc()
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except InsufficientStock as e:
+                CHECKOUT_OUTCOMES.labels(outcome='out_of_stock').inc()
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
             except ValueError as e:
+                CHECKOUT_OUTCOMES.labels(outcome='invalid').inc()
                 return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         else:
+            # Unknown item codes are already rejected by SalesItemSerializer.validate_item_code
+            item_errors = serializer.errors.get('items', [])
+            missing_item = isinstance(item_errors, list) and any('item_code' in error for error in item_errors)
+            CHECKOUT_OUTCOMES.labels(outcome='missing_item' if missing_item else 'invalid').inc()
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+
+"""
+API Endpoint: Transaction History
+Method: GET
+URL: /api/transactions/
+
+This API endpoint allows authenticated users to list transactions with their receipts, newest first.
+The list is cursor paginated: follow the `next` and `previous` links of the response, every page costs the same
+small number of queries however deep the client pages.
+
+Query Parameters:
+- start_date, end_date: Optional range of transaction dates (format: YYYY-MM-DD).
+- start_time, end_time: Optional range of transaction times (ISO 8601).
+- page_size: Number of transactions per page (default 50, at most 500).
+
+Responses:
+- 200 OK: Returned with the page of transactions and the `next` and `previous` links in the response body.
+- 400 Bad Request: Returned when the provided query parameters are invalid.
+"""
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated, ])
+class TransactionListView(APIView):
+    def get(self, request):
+        serializer = TransactionHistoryRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        filters = {
+            'transaction_date__gte': serializer.validated_data.get('start_date'),
+            'transaction_date__lte': serializer.validated_data.get('end_date'),
+            'transaction_time__gte': serializer.validated_data.get('start_time'),
+            'transaction_time__lte': serializer.validated_data.get('end_time'),
+        }
+        transactions = receipts().filter(**{lookup: value for lookup, value in filters.items() if value is not None})
+
+        paginator = TransactionCursorPagination()
+        page = paginator.paginate_queryset(transactions, request, view=self)
+        return paginator.get_paginated_response(ReceiptSerializer(page, many=True).data)
+
+
+"""
+API Endpoint: Get Receipt
+Method: GET
+URL: /api/transactions/<transaction_id>/
+
+This API endpoint allows authenticated users to retrieve the receipt of a transaction: its bill items and refunds.
+
+Receipts are cached by transaction_id, a refund removes the receipt of its transaction from the cache.
+
+Responses:
+- 200 OK: Returned with the receipt in the response body.
+- 404 Not Found: Returned when the transaction does not exist.
+"""
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated, ])
+class ReceiptView(APIView):
+    def get(self, request, transaction_id=None):
+        cache_key = receipt_cache_key(transaction_id)
+        receipt = record_cache_lookup('receipt', cache.get(cache_key))
+        if receipt is None:
+            receipt = ReceiptSerializer(get_object_or_404(receipts(), transaction_id=transaction_id)).data
+            cache.set(cache_key, receipt, timeout=RECEIPT_TIMEOUT)
+        return Response(receipt)
+
+
+"""
+API Endpoint: Refund / Void Sales
+Method: POST
+URL: /api/refunds/
+
+This API endpoint allows store admins to refund bill items of one or many transactions, or to void them completely,
+e.g. to reverse an erroneous till upload. All refunds of a request are applied in a single database transaction:
+either all of them succeed or none. The stock of the refunded items is restored.
+
+Request Body:
+- transactions: A list of transactions, each with a transaction_id and optionally the items (item_code and quantity)
+  to refund. A transaction without items is voided: everything that was not refunded yet is refunded.
+- reason: Optional reason of the refund.
+
+Responses:
+- 201 Created: Returned with the created refunds in the response body.
+- 400 Bad Request: Returned when an item or quantity was not sold or was already refunded.
+- 403 Forbidden: Returned when the user is not a store admin.
+- 404 Not Found: Returned when a transaction does not exist.
+"""
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsStoreAdmin, ])
+class RefundView(APIView):
+    def post(self, request):
+        serializer = RefundRequestSerializer(data=request.data)
+        if not serializer.is_valid():
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            refunds = refund_transactions(serializer.validated_data['transactions'],
+                                          serializer.validated_data['reason'])
+        except TransactionNotFound as e:
+            return Response({"error": str(e)}, status=status.HTTP_404_NOT_FOUND)
+        except InvalidRefund as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        refunds = Refund.objects.filter(pk__in=[refund.pk for refund in refunds]).prefetch_related('lines')
+        return Response(RefundSerializer(refunds, many=True).data, status=status.HTTP_201_CREATED)
+
 
+"""
+API Endpoint: Bulk Inventory Changes
+Method: POST
+URL: /api/inventory/
+
+This API endpoint allows store admins to apply a price file or a stock delivery to the item catalog in one request.
+Every row has an item_code and any of name, price, category and received_quantity. The rows are compared with the
+current catalog, only changed items are written, received quantities are added to the current stock and unknown
+item codes are created (they need name, price and category). All changes are applied in a single database transaction.
+
+Request Body:
+- A JSON list of rows, or a CSV or JSON file uploaded as multipart form field `file`.
+
+Query Parameters:
+- dry_run: If true, only report what would change.
+
+Responses:
+- 200 OK: Returned with the number of created, updated, restocked and unchanged items in the response body.
+- 400 Bad Request: Returned when a row is invalid.
+- 403 Forbidden: Returned when the user is not a store admin.
+"""
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsStoreAdmin, ])
+class InventoryView(APIView):
+    def post(self, request):
+        dry_run = request.query_params.get('dry_run', '').lower() in ('1', 'true', 'yes')
+        try:
+            upload = request.FILES.get('file')
+            if upload is not None:
+                file_format = 'json' if upload.name.lower().endswith('.json') else 'csv'
+                rows = read_inventory_file(upload.read(), file_format)
+            elif isinstance(request.data, list):
+                rows = request.data
+            else:
+                return Response({"error": "Send a JSON list of items or upload a CSV or JSON file as `file`."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            report = apply_inventory_changes(rows, dry_run=dry_run)
+        except ValueError as e:  # InventoryError, or a file that is not valid UTF-8 / JSON
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
 
 
 """
@@ -98,19 +312,83 @@ Responses:
 - 200 OK: Returned with the sales summary data in the response body.
 """
 @method_decorator(cache_page(60 * 5), name='dispatch')  # Cache view for 5 minutes
-@authentication_classes([BasicAuthentication])
+@authentication_classes(AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated])
 class SalesSummaryView(APIView):
     def get(self, request):
         today = timezone.now().date()
         cache_key = f'sales_summary_{today}'
-        summary = cache.get(cache_key)
+        summary = record_cache_lookup('sales_summary_day', cache.get(cache_key))
         if not summary:
             summary = get_sales_summary_for_day(today)
             cache.set(cache_key, summary, timeout=60 * 5)  # Caching key for 5 minutes
         return Response(summary)
 
 
+"""
+API Endpoint: Live Sales Stream
+Method: GET
+URL: /api/live-sales/
+
+This API endpoint allows authenticated users to follow today's sales as Server-Sent Events (text/event-stream).
+It is an async view and has to be served by the ASGI application (RetailApp/asgi.py), e.g. with uvicorn.
+
+Events:
+- snapshot: today's running totals (total_sales, items_quantity, categories_quantity), sent on connect and whenever
+  the totals are reloaded from the database. Replace the dashboard's totals with it.
+- sale: the increments of a single committed transaction. Add them to the dashboard's totals.
+- A `: keep-alive` comment is sent when there were no sales for a while.
+
+Responses:
+- 200 OK: The event stream.
+- 401 Unauthorized: Returned when the credentials are missing or invalid.
+"""
+class LiveSalesView(View):
+    async def get(self, request):
+        if await sync_to_async(authenticate)(request) is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided or are invalid.'},
+                                status=status.HTTP_401_UNAUTHORIZED)
+
+        async def events():
+            async for event, data in sales_feed.subscribe():
+                if event == 'heartbeat':
+                    yield ': keep-alive\n\n'
+                else:
+                    yield f'event: {event}\ndata: {json.dumps(data)}\n\n'
+
+        response = StreamingHttpResponse(events(), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # Stop nginx from buffering the stream
+        return response
+
+
+"""
+API Endpoint: Get Top Sellers
+Method: GET
+URL: /api/top-sellers/
+
+This API endpoint allows authenticated users to retrieve the best selling items and categories, by quantity and by revenue,
+of the current day or of the last hours. The numbers are read from the real-time leaderboard that every checkout updates.
+
+Query Parameters:
+- limit: Number of items and categories to return (1 - 100, default 10).
+- hours: Optional, return the top sellers of the last `hours` hours (1 - 48) instead of the current day.
+
+Responses:
+- 200 OK: Returned with the top items and categories in the response body.
+- 400 Bad Request: Returned when the provided query parameters are invalid.
+"""
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated, ])
+class TopSellersView(APIView):
+    def get(self, request):
+        serializer = TopSellersRequestSerializer(data=request.query_params)
+        if serializer.is_valid():
+            return Response(get_top_sellers(serializer.validated_data['limit'],
+                                            serializer.validated_data.get('hours')))
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
 """
 API Endpoint: Get Average Sales
 Method: GET
@@ -119,6 +397,8 @@ URL: /api/average-sales/
 This API endpoint allows authenticated users to retrieve the average sales summary for a given date range.
 
 The average sales summary is cached for 1 hour to improve performance and reduce the load on the database.
+The summary of a date range with more than ANALYTICS_SYNC_MAX_BILL_LINES sales lines is computed by a celery task,
+the request is answered with 202 until it is ready.
 
 Query Parameters:
 - start_date: The start date of the date range (format: YYYY-MM-DD).
@@ -126,10 +406,12 @@ Query Parameters:
 
 Responses:
 - 200 OK: Returned with the average sales summary data in the response body.
-- 400 Bad Request: Returned when the provided query parameters are invalid.
+- 202 Accepted: Returned while the summary of a large date range is computed, retry later.
+- 400 Bad Request: Returned when the provided query parameters are invalid or the date range is too large.
 """
 @method_decorator(cache_page(60 * 60), name='dispatch')  # Cache view for 1 hour
-@authentication_classes([BasicAuthentication])
+@admission_class('analytics')
+@authentication_classes(AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated, ])
 class AverageSalesView(APIView):
     def get(self, request):
@@ -137,11 +419,17 @@ class AverageSalesView(APIView):
         if serializer.is_valid():
             start_date = serializer.validated_data['start_date']
             end_date = serializer.validated_data['end_date']
-            cache_key = f'sales_summary_{start_date}_{end_date}'
-            summary = cache.get(cache_key)
+            cache_key = average_sales_cache_key(start_date, end_date)
+            summary = record_cache_lookup('sales_summary_range', cache.get(cache_key))
             if not summary:
+                record_cache_miss('average_sales', start_date, end_date)
+                if serializer.runs_async:
+                    if cache.add(average_sales_lock_key(start_date, end_date), True, timeout=TASK_LOCK_TIMEOUT):
+                        compute_average_sales.delay(start_date.isoformat(), end_date.isoformat())
+                    return Response({"message": "The summary of this date range is being computed, retry later."},
+                                    status=status.HTTP_202_ACCEPTED)
                 summary = get_avg_sales_summary(start_date, end_date)
-                cache.set(cache_key, summary, timeout=60 * 60)
+                cache.set(cache_key, summary, timeout=AVERAGE_SALES_TIMEOUT)
             return Response(summary)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -153,6 +441,8 @@ Method: GET
 URL: /api/sales-report/
 
 This API endpoint allows authenticated users to generate a sales report in CSV format for a given date range.
+Reports of date ranges with more than ANALYTICS_SYNC_MAX_BILL_LINES sales lines are generated by a celery task,
+the request is answered with 202 until the report is ready.
 
 Query Parameters:
 - start_date: The start date of the date range (format: YYYY-MM-DD).
@@ -160,27 +450,33 @@ Query Parameters:
 
 Responses:
 - 200 OK: Returned with the sales report in CSV format as an attachment.
-- 400 Bad Request: Returned when the provided query parameters are invalid.
+- 202 Accepted: Returned while the report of a large date range is generated, retry later.
+- 400 Bad Request: Returned when the provided query parameters are invalid or the date range is too large.
+- 429 / 503: Returned with a Retry-After header when too many reports are being generated.
 """
 @method_decorator(cache_page(60 * 60), name='dispatch')
-@authentication_classes([BasicAuthentication])
+@admission_class('reports')
+@authentication_classes(AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated, ])
 class SalesReportView(APIView):
 
     def get(self, request):
         serializer = DateRangeSerializer(data=request.query_params)
         if serializer.is_valid():
-            total_sales, avg_sales, item_sales = get_sales_data(serializer.data.get('start_date'), serializer.data.get('end_date'))
-
-            item_sales_df = pd.DataFrame(list(item_sales))
-
-            csv_buffer = StringIO()
-            item_sales_df.to_csv(csv_buffer, index=False)
-
-            csv_buffer.write("\nTotal Sales:, {}\n".format(total_sales))
-            csv_buffer.write("Average Sales:, {}\n".format(avg_sales))
+            start_date = serializer.validated_data['start_date']
+            end_date = serializer.validated_data['end_date']
 
-            response = HttpResponse(csv_buffer.getvalue(), content_type='text/csv')
+            if serializer.runs_async:
+                report = record_cache_lookup('sales_report', cache.get(sales_report_cache_key(start_date, end_date)))
+                if report is None:
+                    if cache.add(sales_report_lock_key(start_date, end_date), True, timeout=TASK_LOCK_TIMEOUT):
+                        export_sales_report.delay(start_date.isoformat(), end_date.isoformat())
+                    return Response({"message": "The report of this date range is being generated, retry later."},
+                                    status=status.HTTP_202_ACCEPTED)
+            else:
+                report = get_sales_report(start_date, end_date)
+
+            response = HttpResponse(report, content_type='text/csv')
             response['Content-Disposition'] = 'attachment; filename="sales_report.csv"'
 
             return response
@@ -194,6 +490,8 @@ Method: GET
 URL: /api/trend-analysis/
 
 This API endpoint allows authenticated users to perform trend analysis on sales data for a given date range.
+The trend of a date range with more than ANALYTICS_SYNC_MAX_BILL_LINES sales lines is computed by a celery task,
+the request is answered with 202 until it is ready.
 
 Query Parameters:
 - start_date: The start date of the date range (format: YYYY-MM-DD).
@@ -201,10 +499,13 @@ Query Parameters:
 
 Responses:
 - 200 OK: Returned with the trend analysis data in the response body.
-- 400 Bad Request: Returned when the provided query parameters are invalid.
+- 202 Accepted: Returned while the trend of a large date range is computed, retry later.
+- 400 Bad Request: Returned when the provided query parameters are invalid or the date range is too large.
+- 429 / 503: Returned with a Retry-After header when too many analytics requests are running.
 """
 # @method_decorator(cache_page(60 * 60), name='dispatch')
-@authentication_classes([BasicAuthentication])
+@admission_class('analytics')
+@authentication_classes(AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated, ])
 class TrendAnalysisView(APIView):
     def get(self, request):
@@ -216,19 +517,25 @@ class TrendAnalysisView(APIView):
         start_date = serializer.validated_data['start_date']
         end_date = serializer.validated_data['end_date']
 
-        sales_data = get_sales_data_by_item(start_date, end_date)
-        sales_df = pd.DataFrame(sales_data)
-
-        if sales_df.empty:
+        cache_key = trend_analysis_cache_key(start_date, end_date)
+        trend_data = record_cache_lookup('trend_analysis', cache.get(cache_key))
+        if trend_data is None:
+            record_cache_miss('trend_analysis', start_date, end_date)
+            if serializer.runs_async:
+                if cache.add(trend_analysis_lock_key(start_date, end_date), True, timeout=TASK_LOCK_TIMEOUT):
+                    compute_trend_analysis.delay(start_date.isoformat(), end_date.isoformat())
+                return Response({"message": "The trend of this date range is being computed, retry later."},
+                                status=status.HTTP_202_ACCEPTED)
+            trend_data = get_trend_analysis(start_date, end_date)
+            cache.set(cache_key, trend_data, timeout=TREND_ANALYSIS_TIMEOUT)
+
+        if not trend_data:
             return Response({"message": "No sales data found for the given date range."},
                             status=status.HTTP_200_OK)
 
-        sales_df = calculate_moving_average(sales_df)
-        sales_df = calculate_manual_trend(sales_df)
-
         # Prepare the trend analysis result for response
         trend_analysis_result = {
-            "trend_data": sales_df.to_dict(orient='records'),
+            "trend_data": trend_data,
         }
 
         return Response(trend_analysis_result, status=status.HTTP_200_OK)
@@ -239,6 +546,8 @@ Method: GET
 URL: /api/sales-comparison/
 
 This API endpoint allows authenticated users to compare sales data between two date ranges.
+The totals of a date range with more than ANALYTICS_SYNC_MAX_BILL_LINES sales lines are computed by a celery task,
+the request is answered with 202 until they are ready.
 
 Query Parameters:
 - start_date_1: The start date of the first date range (format: YYYY-MM-DD).
@@ -248,19 +557,34 @@ Query Parameters:
 
 Responses:
 - 200 OK: Returned with the sales comparison data in the response body.
-- 400 Bad Request: Returned when the provided query parameters are invalid.
+- 202 Accepted: Returned while the totals of a large date range are computed, retry later.
+- 400 Bad Request: Returned when the provided query parameters are invalid or a date range is too large.
 """
 @method_decorator(cache_page(60 * 60), name='dispatch')
-@authentication_classes([BasicAuthentication])
+@admission_class('analytics')
+@authentication_classes(AUTHENTICATION_CLASSES)
 @permission_classes([IsAuthenticated, ])
 class SalesComparisonView(APIView):
     def get(self, request):
         serializer = SalesComparisonRequestSerializer(data=request.query_params)
         if serializer.is_valid():
             data = serializer.validated_data
-
-            sales_data_1 = get_sales_data_for_date_range(data['start_date_1'], data['end_date_1'])
-            sales_data_2 = get_sales_data_for_date_range(data['start_date_2'], data['end_date_2'])
+            ranges = [(data['start_date_1'], data['end_date_1']), (data['start_date_2'], data['end_date_2'])]
+
+            computing = False
+            for (start_date, end_date), runs_async in zip(ranges, serializer.runs_async):
+                if runs_async and record_cache_lookup(
+                        'sales_range', cache.get(sales_range_cache_key(start_date, end_date))) is None:
+                    record_cache_miss('sales_range', start_date, end_date)
+                    if cache.add(sales_range_lock_key(start_date, end_date), True, timeout=TASK_LOCK_TIMEOUT):
+                        compute_sales_range.delay(start_date.isoformat(), end_date.isoformat())
+                    computing = True
+            if computing:
+                return Response({"message": "The sales of these date ranges are being computed, retry later."},
+                                status=status.HTTP_202_ACCEPTED)
+
+            sales_data_1, sales_data_2 = (get_cached_sales_data_for_date_range(start_date, end_date)
+                                          for start_date, end_date in ranges)
 
             comparison = {
                 f"date_range_from_{data['start_date_1']} to {data['end_date_1']}": {
@@ -290,4 +614,173 @@ class SalesComparisonView(APIView):
 
             return Response(comparison, status=status.HTTP_200_OK)
         else:
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+"""
+API Endpoint: Market Basket Analysis
+Method: GET
+URL: /api/market-basket/
+
+This API endpoint allows authenticated users to find the items that are frequently bought together in a given date range,
+with the support (share of baskets with both items), confidence and lift of every pair.
+
+The analysis is cached for 6 hours. Ranges longer than MARKET_BASKET_SYNC_DAYS days are computed by a celery task;
+the first request for such a range starts the task and returns 202, later requests return the result once it is ready.
+
+Query Parameters:
+- start_date: The start date of the date range (format: YYYY-MM-DD).
+- end_date: The end date of the date range (format: YYYY-MM-DD).
+- item_code: Optional, return the items most often bought with this item, ordered by confidence.
+- limit: Number of pairs or items to return (1 - 100, default 20).
+
+Responses:
+- 200 OK: Returned with the number of baskets and the pairs (or items) in the response body.
+- 202 Accepted: Returned while the analysis of a long date range is being computed.
+- 400 Bad Request: Returned when the provided query parameters are invalid.
+"""
+@admission_class('analytics')
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated, ])
+class MarketBasketView(APIView):
+    def get(self, request):
+        serializer = MarketBasketRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        start_date = serializer.validated_data['start_date']
+        end_date = serializer.validated_data['end_date']
+
+        cache_key = market_basket_cache_key(start_date, end_date)
+        result = record_cache_lookup('market_basket', cache.get(cache_key))
+        if result is None:
+            if (end_date - start_date).days + 1 > settings.MARKET_BASKET_SYNC_DAYS:
+                if cache.add(market_basket_lock_key(start_date, end_date), True, timeout=TASK_LOCK_TIMEOUT):
+                    compute_market_basket.delay(start_date.isoformat(), end_date.isoformat())
+                return Response({"message": "The analysis of this date range is being computed, retry later."},
+                                status=status.HTTP_202_ACCEPTED)
+            result = market_basket(start_date, end_date)
+            cache.set(cache_key, result, timeout=MARKET_BASKET_TIMEOUT)
+
+        item_code = serializer.validated_data.get('item_code')
+        pairs = bought_together(result, item_code, serializer.validated_data['limit'])
+        if item_code:
+            return Response({'baskets': result['baskets'], 'item_code': item_code, 'bought_with': pairs},
+                            status=status.HTTP_200_OK)
+        return Response({'baskets': result['baskets'], 'pairs': pairs}, status=status.HTTP_200_OK)
+
+
+"""
+API Endpoint: Stock Forecast
+Method: GET
+URL: /api/stock-forecast/
+
+This API endpoint allows authenticated users to find the items that will run out of stock soon, with their sales velocity
+(exponentially weighted average of the daily quantities sold), days of stock remaining and a suggested reorder quantity.
+
+The forecast of the whole catalog is precomputed every 15 minutes by a celery task and served from the cache.
+
+Query Parameters:
+- days: Return the items whose stock lasts less than this many days (default 7).
+- category: Optional, only return the items of this category.
+- limit: Maximum number of items to return (1 - 1000, default 100).
+
+Responses:
+- 200 OK: Returned with the items running out, the item that runs out first first.
+- 400 Bad Request: Returned when the provided query parameters are invalid.
+"""
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated, ])
+class StockForecastView(APIView):
+    def get(self, request):
+        serializer = StockForecastRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        forecast = record_cache_lookup('stock_forecast', cache.get(STOCK_FORECAST_CACHE_KEY))
+        if forecast is None:
+            forecast = forecast_stock_depletion()
+            cache.set(STOCK_FORECAST_CACHE_KEY, forecast, timeout=STOCK_FORECAST_TIMEOUT)
+
+        return Response({
+            'date': forecast['date'],
+            'items': items_running_out(forecast, serializer.validated_data['days'],
+                                       serializer.validated_data.get('category'), serializer.validated_data['limit']),
+        }, status=status.HTTP_200_OK)
+
+
+"""
+API Endpoint: Stock History
+Method: GET
+URL: /api/stock-history/
+
+This API endpoint allows authenticated users to retrieve the daily stock level of items over a date range, e.g. stock on
+hand over the last 90 days. Past days are read from the end of day inventory snapshots written nightly by a celery task,
+today is the live stock.
+
+Query Parameters:
+- item_codes: Comma separated codes of the items (at most 100).
+- start_date: The start date of the date range (format: YYYY-MM-DD).
+- end_date: The end date of the date range (format: YYYY-MM-DD), at most 366 days after the start date.
+
+Responses:
+- 200 OK: Returned with the dates of the range up to today and per item its quantities on those dates
+  (null for a day without a snapshot).
+- 400 Bad Request: Returned when the provided query parameters are invalid or an item does not exist.
+"""
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated, ])
+class StockHistoryView(APIView):
+    def get(self, request):
+        serializer = StockHistoryRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            history = stock_history(serializer.validated_data['item_codes'], serializer.validated_data['start_date'],
+                                    serializer.validated_data['end_date'])
+        except ItemNotFound as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(history, status=status.HTTP_200_OK)
+
+
+"""
+API Endpoint: Sales Heatmap
+Method: GET
+URL: /api/sales-heatmap/
+
+This API endpoint allows authenticated users to retrieve the sales, quantity sold and number of transactions of a date range
+bucketed by weekday and hour of the day, e.g. for staffing.
+
+Heatmaps of closed periods (ending before today) are cached for 24 hours.
+
+Query Parameters:
+- start_date: The start date of the date range (format: YYYY-MM-DD).
+- end_date: The end date of the date range (format: YYYY-MM-DD).
+- category: Optional, only count the items of this category.
+
+Responses:
+- 200 OK: Returned with 7 x 24 matrices (Monday first, hours 0 - 23) of total_sales, total_quantity_sold and transactions.
+- 400 Bad Request: Returned when the provided query parameters are invalid.
+"""
+@admission_class('analytics')
+@authentication_classes(AUTHENTICATION_CLASSES)
+@permission_classes([IsAuthenticated, ])
+class SalesHeatmapView(APIView):
+    def get(self, request):
+        serializer = SalesHeatmapRequestSerializer(data=request.query_params)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        start_date = serializer.validated_data['start_date']
+        end_date = serializer.validated_data['end_date']
+        category = serializer.validated_data.get('category')
+
+        if end_date >= timezone.now().date():
+            return Response(get_sales_heatmap(start_date, end_date, category), status=status.HTTP_200_OK)
+
+        cache_key = sales_heatmap_cache_key(start_date, end_date, category)
+        heatmap = record_cache_lookup('sales_heatmap', cache.get(cache_key))
+        if heatmap is None:
+            heatmap = get_sales_heatmap(start_date, end_date, category)
+            cache.set(cache_key, heatmap, timeout=SALES_HEATMAP_TIMEOUT)
+        return Response(heatmap, status=status.HTTP_200_OK)